@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# .env is read once, before any module in app/ reads its settings
+load_dotenv()
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from app import metrics
+from app.executor import get_executor
+
+#---------------------------------------------------------
+# admission control in front of the executor (POST /run and socket runs)
+#
+# 1. token buckets per player and per duel: a run costs one token; an empty
+#    bucket means RateLimited(retry_after) straight away
+# 2. RUN_CONCURRENCY runs judge at once (defaults to the executor's
+#    capacity: JUDGE0_RUN_CAPACITY, or the local worker count)
+# 3. the rest wait in a fair queue: one ring of players, each with their
+#    own FIFO, served round-robin so a player with three runs queued can't
+#    get ahead of three players with one each. a full queue (or a player
+#    with RUN_USER_QUEUE runs already waiting) means Overloaded
+#
+# buckets, slots and the queue are per worker.
+
+USER_RATE = float(os.getenv("RUN_USER_RATE", "0.5"))  # runs per second, sustained
+USER_BURST = float(os.getenv("RUN_USER_BURST", "3"))
+DUEL_RATE = float(os.getenv("RUN_DUEL_RATE", "1"))
+DUEL_BURST = float(os.getenv("RUN_DUEL_BURST", "6"))
+QUEUE_LIMIT = int(os.getenv("RUN_QUEUE_LIMIT", "500"))
+USER_QUEUE_LIMIT = int(os.getenv("RUN_USER_QUEUE", "2"))
+# longest a run may wait for a slot before it's turned away
+QUEUE_TIMEOUT = float(os.getenv("RUN_QUEUE_TIMEOUT", "15"))
+MAX_BUCKETS = 50000
+
+rejected = metrics.Counter("lcduel_runs_rejected_total", "Runs turned away by admission control", ["reason"])
+queue_wait = metrics.Histogram(
+    "lcduel_run_queue_wait_seconds", "Time a run waited for an executor slot",
+    buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 15.0),
+)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many runs, try again in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    def __init__(self, message="The judge is busy, try again shortly"):
+        super().__init__(message)
+        self.retry_after = 5.0
+
+
+class TokenBuckets:
+    # key -> [tokens, last refill]; full buckets are the same as no bucket,
+    # so the oldest entries can be dropped when there are too many
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = OrderedDict()
+
+    def take(self, key, now=None):
+        # 0 when a token was taken, else seconds until one is available
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.pop(key, None) or [self.burst, now]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        self.buckets[key] = bucket
+        while len(self.buckets) > MAX_BUCKETS:
+            self.buckets.popitem(last=False)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate if self.rate > 0 else float("inf")
+
+    def refund(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket[0] = min(self.burst, bucket[0] + 1)
+
+
+class FairQueue:
+    def __init__(self):
+        self.ring = OrderedDict()  # user -> deque of waiters; ring order = service order
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def pending(self, user):
+        waiting = self.ring.get(user)
+        return len(waiting) if waiting else 0
+
+    def push(self, user, waiter):
+        self.ring.setdefault(user, deque()).append(waiter)
+        self.size += 1
+
+    def pop(self):
+        user, waiting = next(iter(self.ring.items()))
+        waiter = waiting.popleft()
+        del self.ring[user]
+        if waiting:
+            self.ring[user] = waiting  # back of the ring
+        self.size -= 1
+        return waiter
+
+    def remove(self, user, waiter):
+        waiting = self.ring.get(user)
+        if waiting and waiter in waiting:
+            waiting.remove(waiter)
+            self.size -= 1
+            if not waiting:
+                del self.ring[user]
+
+    def position(self, user, waiter):
+        # 1-based turn under round-robin: every user ahead in the ring gets
+        # one more turn than the rounds this waiter still has to sit out
+        rounds = self.ring[user].index(waiter)
+        position = rounds + 1
+        ahead = True
+        for other, waiting in self.ring.items():
+            if other == user:
+                ahead = False
+                continue
+            position += min(len(waiting), rounds + 1 if ahead else rounds)
+        return position
+
+
+class Admission:
+    def __init__(self, slots=None):
+        self.slots = slots
+        self.running = 0
+        self.queue = FairQueue()
+        self.users = TokenBuckets(USER_RATE, USER_BURST)
+        self.duels = TokenBuckets(DUEL_RATE, DUEL_BURST)
+
+    def _capacity(self):
+        if self.slots is None:
+            self.slots = int(os.getenv("RUN_CONCURRENCY", "0")) or get_executor().capacity
+        return self.slots
+
+    def check(self, user, duel_key):
+        # spend one token from the player's and the duel's bucket
+        wait = self.users.take(user)
+        if wait:
+            rejected.labels("user_rate").inc()
+            raise RateLimited(wait)
+        wait = self.duels.take(duel_key)
+        if wait:
+            self.users.refund(user)
+            rejected.labels("duel_rate").inc()
+            raise RateLimited(wait)
+
+    async def _acquire(self, user, on_queued=None, timeout=QUEUE_TIMEOUT):
+        if self.running < self._capacity() and not self.queue:
+            self.running += 1
+            return
+        if len(self.queue) >= QUEUE_LIMIT or self.queue.pending(user) >= USER_QUEUE_LIMIT:
+            rejected.labels("queue_full").inc()
+            raise Overloaded()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queue.push(user, waiter)
+        started = time.monotonic()
+        try:
+            if on_queued is not None:
+                await on_queued(self.queue.position(user, waiter))
+            async with asyncio.timeout(timeout):
+                await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed to us just as we gave up: pass it on
+                self._release()
+            else:
+                self.queue.remove(user, waiter)
+                waiter.cancel()
+            if isinstance(e, TimeoutError):
+                rejected.labels("queue_timeout").inc()
+                raise Overloaded() from None
+            raise
+        queue_wait.observe(time.monotonic() - started)
+
+    def _release(self):
+        # hand the slot straight to the next waiter, if any
+        while self.queue:
+            waiter = self.queue.pop()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    @asynccontextmanager
+    async def admit(self, user, duel_key=None, on_queued=None):
+        # raises RateLimited or Overloaded; on_queued(position) is awaited
+        # if the run has to wait for a slot
+        duel_key = duel_key or user
+        self.check(user, duel_key)
+        try:
+            await self._acquire(user, on_queued)
+        except Overloaded:
+            # nothing ran, so it doesn't count against the player
+            self.users.refund(user)
+            self.duels.refund(duel_key)
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+
+admission = Admission()
+
+metrics.Gauge("lcduel_runs_judging", "Runs holding an executor slot", fn=lambda: admission.running)
+metrics.Gauge("lcduel_runs_queued", "Runs waiting for an executor slot", fn=lambda: len(admission.queue))
@@ -0,0 +1,262 @@
+import ast
+import importlib
+import json
+import math
+import os
+import re
+
+#---------------------------------------------------------
+# output checkers: does a run's stdout match a test case's expected output?
+#
+# a problem names its checker in problems.checker (NULL means auto):
+#   auto         whitespace-separated tokens; if they differ, both sides as
+#                a value (JSON, or a Python literal, so True / [1, 2] / 'a'
+#                pass) - where the expected number isn't an integer, within
+#                FLOAT_TOLERANCE either way; an integer has to match (1.0 does)
+#   tokens       tokens only, exactly
+#   float[:tol]  like auto, with its own tolerance (relative or absolute),
+#                integers included
+#   unordered    the output as a value, every list compared as a multiset
+#                (3sum, group anagrams); plain tokens as a multiset otherwise
+#   exact        the stripped text, character for character
+#   anything else: a function registered with @checker(name), or a
+#   "module:function" path, called as fn(expected, output) -> bool
+#
+# expected outputs are tokenized and parsed once, when runner loads a
+# problem (prepare), not on every run. stdout is read as a stream of chunks
+# that the token comparison walks lazily, stopping at the first difference;
+# only a value comparison joins it into one string. the local executor
+# compares straight from the stdout file in its worker and sends back a
+# preview, so a large output never crosses the process boundary.
+
+FLOAT_TOLERANCE = float(os.getenv("CHECKER_FLOAT_TOLERANCE", "1e-6"))
+VALUE_LIMIT = 4 * 1024 * 1024  # characters; longer output isn't parsed as a value
+CHUNK_SIZE = 64 * 1024
+
+MODES = ("auto", "tokens", "float", "unordered", "exact")
+
+CHECKERS = {}  # name -> fn(expected, output) -> bool
+
+_TOKEN = re.compile(r"\S+")
+
+
+def checker(name):
+    # @checker("linked-list") def same_list(expected, output): ...
+    def register(fn):
+        CHECKERS[name] = fn
+        return fn
+    return register
+
+
+def _custom(name):
+    fn = CHECKERS.get(name)
+    if fn is None and ":" in name:
+        module, _, attr = name.partition(":")
+        fn = CHECKERS[name] = getattr(importlib.import_module(module), attr)
+    if fn is None:
+        raise LookupError(f"unknown checker {name!r}")
+    return fn
+
+
+# ---------------------------
+#  values
+# ---------------------------
+def _sort_key(value):
+    return json.dumps(value, sort_keys=True, default=repr)
+
+
+def _plain(value):
+    # Python literal -> what json.loads would have produced
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_plain(v) for v in value), key=_sort_key)
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    return value
+
+
+def _parse(text):
+    # (parsed?, value)
+    try:
+        return True, json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return True, _plain(ast.literal_eval(text))
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return False, None
+
+
+def _unordered(value):
+    if isinstance(value, list):
+        return sorted((_unordered(v) for v in value), key=_sort_key)
+    if isinstance(value, dict):
+        return {k: _unordered(v) for k, v in value.items()}
+    return value
+
+
+def _close(a, b, tolerance, strict_ints):
+    # a is the expected value; strict_ints: an integer one gets no tolerance
+    if isinstance(a, int) and (strict_ints or isinstance(b, int)):
+        return a == b
+    return a == b or (tolerance is not None and math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance))
+
+
+def _equal(a, b, tolerance, strict_ints):
+    # True and 1 are different answers, 1 and 1.0 aren't
+    if isinstance(a, bool) or isinstance(b, bool):
+        return a is b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return _close(a, b, tolerance, strict_ints)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_equal(x, y, tolerance, strict_ints) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k], tolerance, strict_ints) for k in a)
+    return a == b
+
+
+# ---------------------------
+#  tokens
+# ---------------------------
+def _tokens(chunks):
+    # whitespace-separated tokens across chunk boundaries, one at a time
+    carry = ""
+    for chunk in chunks:
+        if carry:
+            chunk = carry + chunk
+            carry = ""
+        end = len(chunk)
+        for match in _TOKEN.finditer(chunk):
+            if match.end() == end:
+                carry = match.group()  # may continue in the next chunk
+            else:
+                yield match.group()
+    if carry:
+        yield carry
+
+
+def _number(token):
+    try:
+        return int(token)
+    except ValueError:
+        return float(token)
+
+
+def _same_token(expected, actual, tolerance, strict_ints):
+    if expected == actual:
+        return True
+    if tolerance is None:
+        return False
+    try:
+        return _close(_number(expected), _number(actual), tolerance, strict_ints)
+    except ValueError:
+        return False
+
+
+def _same_tokens(expected, actual, tolerance, strict_ints):
+    count = 0
+    for token in actual:
+        if count == len(expected) or not _same_token(expected[count], token, tolerance, strict_ints):
+            return False
+        count += 1
+    return count == len(expected)
+
+
+def file_chunks(path):
+    with open(path, errors="replace") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+class Check:
+    # one test case's expected output, parsed for its problem's checker
+    __slots__ = ("mode", "tolerance", "strict_ints", "custom", "text", "tokens", "parsed", "value")
+
+    def __init__(self, expected, mode="auto", tolerance=None, custom=None):
+        self.mode = mode
+        self.tolerance = FLOAT_TOLERANCE if tolerance is None and mode in ("auto", "float", "unordered") else tolerance
+        self.strict_ints = mode != "float"
+        self.custom = custom
+        self.text = expected.strip()
+        self.tokens = None
+        self.parsed, self.value = False, None
+        if mode in ("auto", "tokens", "float"):
+            self.tokens = tuple(self.text.split())
+        if mode in ("auto", "float", "unordered"):
+            self.parsed, self.value = _parse(self.text)
+        if mode == "unordered":
+            if self.parsed:
+                self.value = _unordered(self.value)
+            else:
+                self.tokens = tuple(sorted(self.text.split()))
+
+    @property
+    def streams(self):
+        # custom checkers get the whole output as a string, wherever it is
+        return self.custom is None
+
+    def matches(self, read):
+        # read() -> a fresh iterator over stdout's chunks
+        if self.custom is not None:
+            return bool(_custom(self.custom)(self.text, "".join(read())))
+        if self.mode == "exact":
+            return "".join(read()).strip() == self.text
+        if self.mode == "unordered":
+            if not self.parsed:
+                return tuple(sorted(_tokens(read()))) == self.tokens
+        elif _same_tokens(
+            self.tokens, _tokens(read()), None if self.mode == "tokens" else self.tolerance, self.strict_ints,
+        ):
+            return True
+        elif self.mode == "tokens" or not self.parsed:
+            return False
+
+        output = "".join(read())
+        if len(output) > VALUE_LIMIT:
+            return False
+        parsed, value = _parse(output)
+        if not parsed:
+            return False
+        if self.mode == "unordered":
+            value = _unordered(value)
+        return _equal(self.value, value, self.tolerance, self.strict_ints)
+
+    def matches_text(self, output):
+        return self.matches(lambda: (output,))
+
+    def matches_file(self, path):
+        return self.matches(lambda: file_chunks(path))
+
+
+def parse_spec(spec):
+    # problems.checker -> (mode, tolerance, custom); ValueError if it names nothing
+    if not spec:
+        return "auto", None, None
+    mode, _, argument = spec.partition(":")
+    if mode == "float" and argument:
+        try:
+            return "float", float(argument), None
+        except ValueError:
+            raise ValueError(f"bad float tolerance in checker {spec!r}") from None
+    if spec in MODES:
+        return spec, None, None
+    try:
+        _custom(spec)
+    except (LookupError, ImportError, AttributeError) as e:
+        raise ValueError(f"checker {spec!r} can't be loaded: {e}") from None
+    return "custom", None, spec
+
+
+def prepare(testcases, spec=None):
+    # the problem's cases, each with its Check under "check"
+    mode, tolerance, custom = parse_spec(spec)
+    return [
+        {**case, "check": Check(case["expected_output"], mode, tolerance, custom)}
+        for case in testcases
+    ]
+
+
+def check_for(case):
+    # cases that didn't come through runner.load_testcases get auto
+    return case.get("check") or Check(case["expected_output"])
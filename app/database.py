@@ -1,17 +1,83 @@
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import create_engine, func, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String, Text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+from sqlalchemy.orm import deferred, sessionmaker
+from contextlib import asynccontextmanager
 import os
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSON, JSONB
 
 
-load_dotenv()
-
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# pool settings, shared by both engines
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+# compiled SQL (SQLAlchemy) and prepared statements per connection (asyncpg)
+DB_QUERY_CACHE = int(os.getenv("DB_QUERY_CACHE", "1000"))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "500"))
+
+
+def _pool_options(url):
+    options = {"pool_pre_ping": True, "query_cache_size": DB_QUERY_CACHE}
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
+
+def _async_url(url):
+    # same database, async driver: postgresql -> asyncpg, sqlite -> aiosqlite
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+        return url.update_query_dict({"prepared_statement_cache_size": str(DB_STATEMENT_CACHE)})
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+
+# sync engine: scripts (migrations, fetch_problems, seed_problems). the app
+# never uses it, so it (and its driver) is only created when first imported:
+# from app.database import engine, SessionLocal
+_sync = {}
+
+
+def __getattr__(name):
+    if name not in ("engine", "SessionLocal"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if not _sync:
+        _sync["engine"] = create_engine(DATABASE_URL, **_pool_options(make_url(DATABASE_URL)))
+        _sync["SessionLocal"] = sessionmaker(bind=_sync["engine"], autoflush=False, autocommit=False)
+    return _sync[name]
+
+
+# async engine: everything the app does while serving requests
+async_engine = create_async_engine(_async_url(DATABASE_URL), **_pool_options(make_url(DATABASE_URL)))
+
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+async def get_db():
+    # FastAPI dependency: one session per request
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+@asynccontextmanager
+async def use_session(db=None):
+    # reuse the caller's session (from get_db) or open one, e.g. for sockets
+    if db is not None:
+        yield db
+    else:
+        async with AsyncSessionLocal() as session:
+            yield session
 
 Base = declarative_base()
 
@@ -21,9 +87,88 @@ class Problem(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     difficulty = Column(String, nullable=False)
-    slug = Column(String, nullable=False)
+    slug = Column(String, nullable=False, unique=True, index=True)
     tags = Column(String, nullable=True)
-    testcases = Column(JSON, nullable=True)
+    # JSONB on Postgres; deferred so metadata queries never drag the blob along
+    testcases = deferred(Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True))
+    # statement, filled by fetch_problems / on first match
+    description = Column(Text, nullable=True)
+    link = Column(String, nullable=True)
+    # how outputs are compared (app/checker.py); NULL = auto
+    checker = Column(String, nullable=True)
+
+    # the tags GIN index is Postgres-only, see migrations.py
+    __table_args__ = (
+        Index("ix_problems_difficulty", func.lower(difficulty)),
+    )
+
+
+# ---------------------------
+#  history, written behind the hot path by app/history.py
+# ---------------------------
+class Duel(Base):
+    __tablename__ = "duels"
+
+    # the id the duel got when it started (app/duels.py), so submissions
+    # can point at it before this row exists
+    id = Column(String(32), primary_key=True)
+    player1 = Column(String, nullable=False, index=True)
+    player2 = Column(String, nullable=False, index=True)
+    # "win" (winner set), "draw" or "none" (time ran out, nobody finished)
+    outcome = Column(String(8), nullable=False)
+    winner = Column(String, nullable=True)
+    slug = Column(String, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    ended_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class Submission(Base):
+    __tablename__ = "submissions"
+
+    id = Column(String(32), primary_key=True)
+    username = Column(String, nullable=True, index=True)
+    # no foreign key: the duel row is only written once the duel ends
+    duel_id = Column(String(32), nullable=True, index=True)
+    slug = Column(String, nullable=False)
+    language = Column(String, nullable=True)
+    code = Column(Text, nullable=False)
+    via = Column(String(8), nullable=False)  # "http" or "ws"
+    passed = Column(Integer, nullable=False)
+    total = Column(Integer, nullable=False)
+    all_passed = Column(Boolean, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class TestResult(Base):
+    __tablename__ = "test_results"
+
+    id = Column(Integer, primary_key=True)
+    submission_id = Column(String(32), ForeignKey("submissions.id", ondelete="CASCADE"), nullable=False, index=True)
+    case_index = Column(Integer, nullable=False)
+    passed = Column(Boolean, nullable=False)
+    status = Column(String, nullable=True)
+    output = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+
+
+# ---------------------------
+#  leaderboard snapshots, written by app/leaderboard.py
+# ---------------------------
+class PlayerStats(Base):
+    __tablename__ = "player_stats"
+
+    username = Column(String, primary_key=True)
+    rating = Column(Float, nullable=False)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+    streak = Column(Integer, nullable=False, default=0)  # current run of wins
+    best_streak = Column(Integer, nullable=False, default=0)
+    last_change = Column(Float, nullable=False, default=0.0)  # rating change in the last duel
+    # difficulty -> {"rating", "wins", "losses", "draws", "last_change"}
+    by_difficulty = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
 
 if __name__ == "__main__":
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=__getattr__("engine"))
\ No newline at end of file
@@ -0,0 +1,185 @@
+import json
+import time
+import uuid
+
+from app import metrics
+from app.state import get_backend
+
+#---------------------------------------------------------
+# duel records, kept in the state backend so every worker sees them
+#
+#   lcduel:duel:<p1>|<p2>    hash: id, start (epoch seconds), duration, slug,
+#                            title, difficulty, problem (json, what the
+#                            players were sent), finished:<username> for
+#                            each player done, progress:<username> (json),
+#                            code:<username> (last code snapshot),
+#                            verdict:<username> (json, their last run)
+#   lcduel:player:<username> the duel key that player is in
+#   lcduel:deadlines         zset of running duels by deadline, so timers
+#                            can be rebuilt after a restart
+#
+# "paused" holds the seconds left while a duel's clock is stopped.
+#
+# the record is deleted by claim() when the duel ends. every later write
+# goes through _update, which only writes while "start" is still there, so
+# a progress or code snapshot racing the end can't recreate the hash.
+#
+# a duel key is the sorted (player1, player2) tuple used everywhere else.
+
+DUEL_DURATION = 600  # 10 minutes
+DEADLINES_KEY = "lcduel:deadlines"
+
+_backend = get_backend()
+
+
+def _duel_id(duel_key):
+    return "lcduel:duel:" + "|".join(duel_key)
+
+
+def _player_id(username):
+    return f"lcduel:player:{username}"
+
+
+async def create(duel_key, slug=None, duration=DUEL_DURATION, title=None, difficulty=None, problem=None):
+    # returns the deadline (epoch seconds)
+    start = time.time()
+    await _backend.hset(_duel_id(duel_key), {
+        "id": uuid.uuid4().hex,
+        "start": repr(start),
+        "duration": duration,
+        "slug": slug or "",
+        "title": title or "",
+        "difficulty": difficulty or "",
+        "problem": json.dumps(problem or {}),
+    })
+    await _backend.zadd(DEADLINES_KEY, {"|".join(duel_key): start + duration})
+    for player in duel_key:
+        await _backend.set(_player_id(player), "|".join(duel_key))
+    return start + duration
+
+
+async def _update(duel_key, mapping):
+    # False once the duel has ended
+    return await _backend.hset_existing(_duel_id(duel_key), mapping, "start")
+
+
+async def get(duel_key):
+    # {"id", "start", "duration", "deadline", "paused", "slug", "title",
+    #  "difficulty", "problem": {...}, "finished": set(),
+    #  "progress": {username: {...}}, "code": {username: text},
+    #  "verdicts": {username: {...}}}
+    # or None once it's over
+    fields = await _backend.hgetall(_duel_id(duel_key))
+    if "start" not in fields:
+        return None
+    start, duration = float(fields["start"]), float(fields["duration"])
+    return {
+        "id": fields.get("id"),
+        "start": start,
+        "duration": duration,
+        "deadline": start + duration,
+        "paused": float(fields["paused"]) if fields.get("paused") else None,
+        "slug": fields.get("slug") or None,
+        "title": fields.get("title") or None,
+        "difficulty": fields.get("difficulty") or None,
+        "problem": json.loads(fields["problem"]) if fields.get("problem") else {},
+        "finished": {field.split(":", 1)[1] for field in fields if field.startswith("finished:")},
+        "progress": {
+            field.split(":", 1)[1]: json.loads(value)
+            for field, value in fields.items() if field.startswith("progress:")
+        },
+        "code": {
+            field.split(":", 1)[1]: value
+            for field, value in fields.items() if field.startswith("code:")
+        },
+        "verdicts": {
+            field.split(":", 1)[1]: json.loads(value)
+            for field, value in fields.items() if field.startswith("verdict:")
+        },
+    }
+
+
+async def history_id(duel_key):
+    # the id history rows use for this duel, None once it's over
+    if not duel_key:
+        return None
+    return await _backend.hget(_duel_id(duel_key), "id")
+
+
+async def set_progress(duel_key, username, progress):
+    await _update(duel_key, {f"progress:{username}": json.dumps(progress)})
+
+
+async def set_code(duel_key, username, text):
+    await _update(duel_key, {f"code:{username}": text})
+
+
+async def set_verdict(duel_key, username, verdict):
+    await _update(duel_key, {f"verdict:{username}": json.dumps(verdict)})
+
+
+async def update_problem(duel_key, fields):
+    # the statement arrived after the duel started
+    problem = await _backend.hget(_duel_id(duel_key), "problem")
+    if problem is None:
+        return
+    await _update(duel_key, {"problem": json.dumps({**json.loads(problem), **fields})})
+
+
+async def set_deadline(duel_key, deadline):
+    # overtime / resume: the duration grows so start stays the real start
+    duel = await get(duel_key)
+    if duel is None:
+        return None
+    if not await _update(duel_key, {"duration": repr(deadline - duel["start"]), "paused": ""}):
+        return None
+    await _backend.zadd(DEADLINES_KEY, {"|".join(duel_key): deadline})
+    return deadline
+
+
+async def pause(duel_key, remaining):
+    if not await _update(duel_key, {"paused": repr(remaining)}):
+        return False
+    await _backend.zrem(DEADLINES_KEY, "|".join(duel_key))
+    return True
+
+
+async def pending():
+    # [(duel_key, deadline)] for every running, unpaused duel
+    rows = await _backend.zrangebyscore(DEADLINES_KEY, float("-inf"), float("inf"))
+    return [(tuple(member.split("|")), deadline) for member, deadline in rows]
+
+
+async def _active():
+    return await _backend.zcard(DEADLINES_KEY)
+
+
+metrics.Gauge("lcduel_active_duels", "Duels with their clock running, across all workers", fn=_active)
+
+
+async def duel_key_for(username):
+    if not username:
+        return None
+    value = await _backend.get(_player_id(username))
+    return tuple(value.split("|")) if value else None
+
+
+async def mark_finished(duel_key, username):
+    # returns the record as it is after the write, or None if the duel
+    # already ended. read after writing: when both players finish at once
+    # on different workers, at least one of them sees both fields (claim()
+    # then decides which one finalizes)
+    if not await _update(duel_key, {f"finished:{username}": 1}):
+        return None
+    return await get(duel_key)
+
+
+async def claim(duel_key):
+    # True for exactly one caller across all workers; that caller finalizes
+    if not await _backend.delete(_duel_id(duel_key)):
+        return False
+    await _backend.zrem(DEADLINES_KEY, "|".join(duel_key))
+    for player in duel_key:
+        if await duel_key_for(player) == tuple(duel_key):
+            await _backend.delete(_player_id(player))
+    return True
@@ -0,0 +1,136 @@
+import asyncio
+import os
+
+from app.checker import check_for
+
+#---------------------------------------------------------
+# execution backends behind /run
+#
+# an executor takes a problem's test cases plus the user's code and returns
+# one result row per case, in order:
+#   {"input", "expected", "output", "passed", "error", "status"}
+# raw outcomes use Judge0's shape ({"stdout", "stderr", "compile_output",
+# "status": {"id", "description"}}) so every backend shares build_result,
+# which leaves the output comparison to the case's checker (app/checker.py)
+
+
+class Executor:
+    name = "base"
+    capacity = 4  # runs it can judge at once; admission control sizes its slots from this
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def run(self, testcases, code, language, duel_key=None, on_result=None, fail_fast=False):
+        raise NotImplementedError
+
+
+def error_result(case, error, status):
+    return {
+        "input": case["input"].strip(),
+        "expected": case["expected_output"].strip(),
+        "output": None,
+        "passed": False,
+        "error": error,
+        "status": status,
+    }
+
+
+def build_result(case, result):
+    # result may carry "passed" already, when the executor compared the
+    # output itself (the local one does, from the stdout file)
+    check = check_for(case)
+    input_data = case["input"].strip()
+    expected_output = check.text
+
+    stdout = result.get("stdout") or ""
+    stderr = (result.get("stderr") or "").strip()
+    compile_output = (result.get("compile_output") or "").strip()
+
+    status_id = (result.get("status") or {}).get("id")
+    status_desc = (result.get("status") or {}).get("description", "Unknown")
+
+    # Status IDs: 3 = Accepted
+    execution_success = status_id == 3
+
+    actual_output = stdout.strip()
+
+    # Only mark as passed if execution succeeded AND output matches
+    if not execution_success:
+        passed = False
+    elif "passed" in result:
+        passed = result["passed"]
+    else:
+        passed = check.matches_text(stdout)
+
+    error_message = None
+    if not execution_success:
+        error_message = stderr or compile_output or status_desc
+    elif not passed:
+        error_message = "Output mismatch"
+
+    return {
+        "input": input_data,
+        "expected": expected_output,
+        "output": actual_output,
+        "passed": passed,
+        "error": error_message,
+        "status": status_desc,
+    }
+
+
+async def collect(testcases, work, on_result=None, fail_fast=False):
+    # work(report) runs the cases and awaits report(idx, result) for each one;
+    # on_result(idx, result) is awaited as soon as each case comes back, in
+    # completion order; fail_fast stops at the first failing case and marks
+    # the rest as skipped
+    results = [None] * len(testcases)
+    failed = asyncio.Event()
+
+    async def report(idx, result):
+        if failed.is_set():
+            return
+        results[idx] = result
+        if on_result:
+            await on_result(idx, result)
+        if fail_fast and not result["passed"]:
+            failed.set()
+
+    running = asyncio.ensure_future(work(report))
+    stop = asyncio.ensure_future(failed.wait())
+
+    try:
+        await asyncio.wait({running, stop}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (running, stop):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(running, stop, return_exceptions=True)
+
+    for idx, result in enumerate(results):
+        if result is None:
+            results[idx] = error_result(testcases[idx], "Skipped after an earlier failure", "Skipped")
+
+    return results
+
+
+# ---------------------------
+#  backend selection: EXECUTOR=judge0 (default) or EXECUTOR=local
+# ---------------------------
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        backend = os.getenv("EXECUTOR", "judge0")
+        if backend == "local":
+            from app.local_executor import LocalExecutor
+            _executor = LocalExecutor()
+        else:
+            from app.judge0 import Judge0Executor
+            _executor = Judge0Executor()
+    return _executor
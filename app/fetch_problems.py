@@ -1,36 +1,234 @@
-import requests
+import argparse
+import asyncio
+import json
+import os
+import time
 
-from app.database import SessionLocal, Problem
+import httpx
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
 
-def populate_problems():
+from app.database import SessionLocal, engine, Problem
+from app.problems import PROBLEM_API_URL, statement_fields
+from app.runner import announce_changes
+from app.state import get_backend
+
+#---------------------------------------------------------
+# catalog ingest: python -m app.fetch_problems [--restart] [--no-details]
+#
+# streams the catalog a page at a time, diffs each page against the slugs
+# (and title/difficulty/tags) already stored, and upserts only what changed
+# with INSERT ... ON CONFLICT (slug) DO UPDATE in batches. the offset of the
+# last committed page is checkpointed, so a failed run picks up where it
+# stopped. statements for problems that don't have one yet are then fetched
+# concurrently under a rate limit and written back in batches; that step
+# resumes on its own since it only looks at rows with no description.
+#
+# the slugs of every committed batch are announced on the state backend, so
+# running servers drop their cached test cases, verdicts and statements of
+# those problems; run it with the servers' STATE_BACKEND / REDIS_URL.
+
+CATALOG_URL = "https://alfa-leetcode-api.onrender.com/problems"
+PAGE_SIZE = int(os.getenv("INGEST_PAGE_SIZE", "500"))
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+DETAIL_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "8"))
+DETAIL_RATE = float(os.getenv("INGEST_RATE", "5"))  # statement requests per second
+CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT", ".ingest_checkpoint.json")
+REQUEST_TIMEOUT = 30.0
+MAX_RETRIES = 3
+
+
+# ---------------------------
+#  checkpoint
+# ---------------------------
+def _load_checkpoint():
+    try:
+        with open(CHECKPOINT_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_checkpoint(state):
+    tmp = CHECKPOINT_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, CHECKPOINT_PATH)
+
+
+def _clear_checkpoint():
+    if os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)
+
+
+# ---------------------------
+#  DB side (sync engine, called through asyncio.to_thread)
+# ---------------------------
+def _known_problems():
+    # slug -> (title, difficulty, tags), one query for the whole catalog
+    with engine.connect() as conn:
+        rows = conn.execute(select(Problem.slug, Problem.title, Problem.difficulty, Problem.tags))
+        return {row.slug: (row.title, row.difficulty, row.tags) for row in rows}
+
+
+def _upsert(rows):
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(Problem.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Problem.__table__.c.slug],
+        set_={column: stmt.excluded[column] for column in ("title", "difficulty", "tags")},
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, rows)
+
+
+def _missing_statements():
+    with engine.connect() as conn:
+        return conn.execute(select(Problem.id, Problem.slug).where(Problem.description.is_(None))).all()
+
+
+def _store_statements(rows):
+    # ORM bulk UPDATE by primary key: one executemany per batch
     db = SessionLocal()
+    try:
+        db.execute(update(Problem), rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+# ---------------------------
+#  HTTP side
+# ---------------------------
+async def _get_json(client, url, params):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            res = await client.get(url, params=params)
+            if res.status_code == 200:
+                return res.json()
+            if res.status_code != 429 and res.status_code < 500:
+                print(f"[INGEST] {url} {params}: API error {res.status_code}")
+                return None
+            error = f"API error {res.status_code}"
+        except (httpx.HTTPError, ValueError) as e:
+            error = str(e) or type(e).__name__
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(2 ** attempt)
+    print(f"[INGEST] {url} {params}: giving up ({error})")
+    return None
+
 
-    url = "https://alfa-leetcode-api.onrender.com/"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        print("Failed to fetch problems from API")
-        return
-    
-    data = response.json()
-    print(f"Fetched {len(data)} problems")
-
-    for p in data:
-        existing = db.query(Problem).filter(Problem.slug == p["titleSlug"]).first()
-        if existing:
-            continue
-
-        problem = Problem(
-            title=p["title"],
-            difficulty=p["difficulty"],
-            slug=p["titleSlug"],
-            tags=",".join(p["topicTags"]) if p["topicTags"] else ""
-        )
-        db.add(problem)
-
-    db.commit()
-    db.close()
+class _RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_at = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        delay = max(0.0, self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def _row(item):
+    tags = [tag["name"] if isinstance(tag, dict) else tag for tag in item.get("topicTags") or []]
+    return {
+        "title": item["title"],
+        "difficulty": item["difficulty"],
+        "slug": item["titleSlug"],
+        "tags": ",".join(tags),
+    }
+
+
+# ---------------------------
+#  pipeline
+# ---------------------------
+async def ingest_catalog(client, restart=False):
+    known = await asyncio.to_thread(_known_problems)
+    if restart:
+        _clear_checkpoint()
+    skip = _load_checkpoint().get("skip", 0)
+    print(f"{len(known)} problems stored, catalog from offset {skip}")
+
+    written = 0
+    while True:
+        data = await _get_json(client, CATALOG_URL, {"limit": PAGE_SIZE, "skip": skip})
+        if data is None:
+            raise RuntimeError(f"catalog page at offset {skip} failed; rerun to resume")
+        items = data.get("problemsetQuestionList") or []
+        if not items:
+            break
+
+        changed = []
+        for item in items:
+            row = _row(item)
+            if known.get(row["slug"]) != (row["title"], row["difficulty"], row["tags"]):
+                changed.append(row)
+                known[row["slug"]] = (row["title"], row["difficulty"], row["tags"])
+        for i in range(0, len(changed), BATCH_SIZE):
+            await asyncio.to_thread(_upsert, changed[i:i + BATCH_SIZE])
+            await announce_changes(row["slug"] for row in changed[i:i + BATCH_SIZE])
+        written += len(changed)
+
+        skip += len(items)
+        _save_checkpoint({"skip": skip})
+        print(f"offset {skip}: {len(changed)} new or changed")
+        if len(items) < PAGE_SIZE:
+            break
+
+    _clear_checkpoint()
+    return written
+
+
+async def ingest_statements(client):
+    missing = await asyncio.to_thread(_missing_statements)
+    print(f"Fetching statements for {len(missing)} problems")
+    semaphore = asyncio.Semaphore(DETAIL_CONCURRENCY)
+    limiter = _RateLimiter(DETAIL_RATE)
+
+    async def one(problem_id, slug):
+        async with semaphore:
+            await limiter.wait()
+            data = await _get_json(client, PROBLEM_API_URL, {"titleSlug": slug})
+        return {"id": problem_id, **statement_fields(slug, data)} if data else None
+
+    stored = 0
+    for i in range(0, len(missing), BATCH_SIZE):
+        batch = missing[i:i + BATCH_SIZE]
+        rows = await asyncio.gather(*(one(row.id, row.slug) for row in batch))
+        stored_slugs = [problem.slug for problem, row in zip(batch, rows) if row]
+        rows = [row for row in rows if row]
+        if rows:
+            await asyncio.to_thread(_store_statements, rows)
+            await announce_changes(stored_slugs)
+        stored += len(rows)
+        print(f"{stored}/{len(missing)} statements stored")
+    return stored
+
+
+async def _populate(details=True, restart=False, transport=None):
+    backend = get_backend()
+    await backend.start()
+    try:
+        async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, transport=transport) as client:
+            started = time.monotonic()
+            written = await ingest_catalog(client, restart=restart)
+            print(f"Catalog: {written} problems written in {time.monotonic() - started:.1f}s")
+            if details:
+                await ingest_statements(client)
+    finally:
+        await backend.close()
+
+
+def populate_problems(details=True, restart=False):
+    asyncio.run(_populate(details=details, restart=restart))
     print("Problems added successfully!")
 
+
 if __name__ == "__main__":
-    populate_problems()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Import the problem catalog")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first page")
+    parser.add_argument("--no-details", action="store_true", help="skip fetching problem statements")
+    args = parser.parse_args()
+    populate_problems(details=not args.no_details, restart=args.restart)
@@ -0,0 +1,252 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+
+from app import metrics
+from app.database import AsyncSessionLocal, Duel, Submission, TestResult, async_engine
+from app.log import get_logger
+
+#---------------------------------------------------------
+# duel history and submissions, written behind the hot path
+#
+# record_duel / record_run only append rows to an in-memory buffer, so
+# they're safe to call from a socket handler. a background task flushes
+# the buffer every FLUSH_INTERVAL seconds, or sooner once BATCH_SIZE rows
+# are waiting. each flush is one transaction with one executemany per table
+# (duels, submissions, then test_results, so the foreign key holds).
+#
+# the buffer is bounded: past MAX_BUFFERED rows new records are dropped and
+# counted rather than letting memory grow while the DB is down. when a
+# flush fails its rows are written again one per transaction: the ones the
+# DB refuses (while still answering) go back for another try and are
+# dropped after MAX_ATTEMPTS, so one bad row can't hold up the rest. if the
+# DB doesn't answer at all, everything stays buffered for later. NUL
+# characters, which Postgres text can't hold, are stripped on the way in.
+# close() flushes whatever is left, so a clean shutdown loses nothing.
+
+FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))  # seconds
+BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+MAX_BUFFERED = int(os.getenv("HISTORY_MAX_BUFFERED", "50000"))
+RETRY_DELAY = 5.0
+MAX_ATTEMPTS = 3  # times a refused row is tried on its own before it's dropped
+MAX_OUTPUT = 1000  # characters of a test case's output/error worth keeping
+
+TABLES = (Duel, Submission, TestResult)
+
+log = get_logger("history")
+
+flush_seconds = metrics.Histogram("lcduel_history_flush_seconds", "One write-behind flush",
+                                  buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+dropped = metrics.Counter("lcduel_history_dropped_total", "History rows dropped because the buffer was full")
+refused = metrics.Counter("lcduel_history_refused_total", "History rows dropped because the DB kept refusing them",
+                          ["table"])
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _clip(text):
+    return text[:MAX_OUTPUT] if isinstance(text, str) else text
+
+
+def _clean(row):
+    return {key: value.replace("\x00", "") if isinstance(value, str) else value for key, value in row.items()}
+
+
+class WriteBehind:
+    def __init__(self):
+        self.buffers = {table: [] for table in TABLES}
+        self.buffered = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.flushing = None
+        self.attempts = {}  # id(row) -> (row, failed tries), rows refused before
+
+    def _add(self, rows):
+        # rows: [(table, row)], added together or not at all
+        if self.buffered + len(rows) > MAX_BUFFERED:
+            dropped.inc(len(rows))
+            log.warning("history buffer full, dropping", rows=len(rows))
+            return False
+        for table, row in rows:
+            self.buffers[table].append(_clean(row))
+        self.buffered += len(rows)
+        if self.buffered >= BATCH_SIZE:
+            self.wakeup.set()
+        return True
+
+    def record_duel(self, duel_key, duel, winner):
+        # duel: the record from duels.get() as it was when the duel ended
+        if not duel.get("id"):
+            return
+        player1, player2 = duel_key
+        self._add([(Duel, {
+            "id": duel["id"],
+            "player1": player1,
+            "player2": player2,
+            "outcome": winner if winner in ("draw", "none") else "win",
+            "winner": winner if winner in duel_key else None,
+            "slug": duel.get("slug"),
+            "started_at": datetime.fromtimestamp(duel["start"], timezone.utc),
+            "ended_at": _now(),
+        })])
+
+    def record_run(self, username, duel_id, slug, language, code, results, via):
+        submission_id = uuid.uuid4().hex
+        passed = sum(1 for r in results if r["passed"])
+        rows = [(Submission, {
+            "id": submission_id,
+            "username": username,
+            "duel_id": duel_id,
+            "slug": slug,
+            "language": language,
+            "code": code,
+            "via": via,
+            "passed": passed,
+            "total": len(results),
+            "all_passed": passed == len(results),
+            "created_at": _now(),
+        })]
+        rows.extend((TestResult, {
+            "submission_id": submission_id,
+            "case_index": idx,
+            "passed": bool(r["passed"]),
+            "status": r.get("status"),
+            "output": _clip(r.get("output")),
+            "error": _clip(r.get("error")),
+        }) for idx, r in enumerate(results))
+        self._add(rows)
+        return submission_id
+
+    # ---------------------------
+    #  flushing
+    # ---------------------------
+    async def flush(self):
+        # one flush at a time; a caller arriving mid-flush waits for it and
+        # then flushes whatever came in meanwhile
+        while self.flushing is not None:
+            try:
+                await asyncio.shield(self.flushing)
+            except Exception:
+                pass  # its rows are back in the buffer
+        if not self.buffered:
+            return
+        self.flushing = asyncio.ensure_future(self._flush())
+        self.flushing.add_done_callback(self._flushed)
+        # shielded: cancelling the caller mustn't abandon a half-done write
+        await asyncio.shield(self.flushing)
+
+    def _flushed(self, task):
+        self.flushing = None
+
+    def _put_back(self, batch):
+        # in front of anything recorded meanwhile
+        for table, rows in batch.items():
+            self.buffers[table][:0] = rows
+            self.buffered += len(rows)
+
+    async def _flush(self):
+        batch = {table: rows for table, rows in self.buffers.items() if rows}
+        self.buffers = {table: [] for table in TABLES}
+        self.buffered = 0
+
+        started = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as session:
+                for table in TABLES:
+                    rows = batch.get(table)
+                    if rows:
+                        await session.execute(insert(table), rows)
+                await session.commit()
+        except Exception:
+            log.exception("history batch failed, writing its rows one by one")
+            self._retry_or_drop(await self._write_each(batch))
+            return
+        flush_seconds.observe(time.perf_counter() - started)
+        if self.attempts:
+            for rows in batch.values():
+                for row in rows:
+                    self.attempts.pop(id(row), None)
+
+    async def _write_each(self, batch):
+        # one transaction per row; returns [(table, row, error)] for the rows
+        # the DB refused. raises, with every unwritten row back in the
+        # buffer, if the DB isn't answering
+        pending = [(table, row) for table in TABLES for row in batch.get(table, ())]
+        done = 0
+        refused_rows = []
+        try:
+            async with async_engine.connect() as conn:
+                for table, row in pending:
+                    try:
+                        async with conn.begin():
+                            await conn.execute(insert(table), [row])
+                        self.attempts.pop(id(row), None)
+                    except Exception as e:
+                        # still answering: it's this row the DB won't take
+                        await conn.execute(select(1))
+                        await conn.rollback()
+                        refused_rows.append((table, row, e))
+                    done += 1
+        except Exception:
+            left = {table: [] for table in TABLES}
+            for table, row, _ in refused_rows:
+                left[table].append(row)
+            for table, row in pending[done:]:
+                left[table].append(row)
+            self._put_back(left)
+            raise
+        return refused_rows
+
+    def _retry_or_drop(self, refused_rows):
+        again = {table: [] for table in TABLES}
+        for table, row, error in refused_rows:
+            _, tries = self.attempts.pop(id(row), (row, 0))
+            tries += 1
+            if tries >= MAX_ATTEMPTS:
+                refused.labels(table.__tablename__).inc()
+                log.error("history row refused, dropping", table=table.__tablename__, error=repr(error))
+                continue
+            self.attempts[id(row)] = (row, tries)
+            again[table].append(row)
+        self._put_back(again)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("history flush failed, retrying", buffered=self.buffered)
+                await asyncio.sleep(RETRY_DELAY)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("final history flush failed", lost=self.buffered)
+
+
+history = WriteBehind()
+
+metrics.Gauge("lcduel_history_buffered", "History rows waiting to be written", fn=lambda: history.buffered)
@@ -0,0 +1,414 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app import metrics
+from app.executor import Executor, build_result, collect, error_result
+from app.log import get_logger
+
+#---------------------------------------------------------
+# Judge0 submission engine
+RAPIDAPI_HOST = "judge0-ce.p.rapidapi.com"
+RAPIDAPI_URL = f"https://{RAPIDAPI_HOST}/submissions"
+ABOUT_URL = f"https://{RAPIDAPI_HOST}/about"
+RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY")
+
+HEADERS = {
+    "Content-Type": "application/json",
+    "X-RapidAPI-Key": RAPIDAPI_KEY,
+    "X-RapidAPI-Host": RAPIDAPI_HOST,
+}
+
+# Language ID mapping for Judge0
+LANGUAGE_IDS = {
+    "python": 71,  # Python 3
+    "javascript": 63,  # Node.js
+    "cpp": 54,  # C++ (GCC 9.2.0)
+    "java": 62,  # Java
+    "c": 50,  # C (GCC 9.2.0)
+}
+
+# Judge0 rejects batches bigger than this (MAX_SUBMISSION_BATCH_SIZE)
+BATCH_SIZE = 20
+# the first poll goes out soon after submitting and the gap doubles while
+# nothing new is done, up to POLL_INTERVAL: a quick run isn't held to a
+# fixed tick and a slow one doesn't eat the quota
+POLL_FIRST = float(os.getenv("JUDGE0_POLL_FIRST", "0.05"))
+POLL_INTERVAL = 0.5
+# runs with this many cases or fewer go out as wait=true submissions
+# instead: one round trip each, no polling
+WAIT_CASES = int(os.getenv("JUDGE0_WAIT_CASES", "1"))
+POLL_TIMEOUT = 30.0
+REQUEST_TIMEOUT = 30.0
+RESULT_FIELDS = "token,stdout,stderr,compile_output,status"
+
+# 1 = In Queue, 2 = Processing
+PENDING_STATUSES = (1, 2)
+
+# keep us under the RapidAPI quota: requests in flight overall and per duel
+GLOBAL_CONCURRENCY = int(os.getenv("JUDGE0_MAX_CONCURRENCY", "8"))
+DUEL_CONCURRENCY = int(os.getenv("JUDGE0_DUEL_CONCURRENCY", "3"))
+
+_global_limit = asyncio.Semaphore(GLOBAL_CONCURRENCY)
+_duel_limits = {}
+
+# shared connection pool
+MAX_CONNECTIONS = int(os.getenv("JUDGE0_MAX_CONNECTIONS", str(GLOBAL_CONCURRENCY * 2)))
+KEEPALIVE_EXPIRY = 60.0
+CONNECT_TIMEOUT = 5.0
+# open a connection at startup (one GET /about) so the first run skips the handshakes
+WARM_CONNECTION = os.getenv("JUDGE0_WARM_CONNECTION", "1") == "1"
+
+# retry with jittered exponential backoff on these
+MAX_RETRIES = int(os.getenv("JUDGE0_MAX_RETRIES", "3"))
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 8.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.PoolTimeout)
+
+# circuit breaker: after this many consecutive failures stop calling Judge0
+# for a while and fail runs straight away
+BREAKER_THRESHOLD = int(os.getenv("JUDGE0_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_AFTER = float(os.getenv("JUDGE0_BREAKER_RESET_AFTER", "30"))
+
+
+log = get_logger("judge0")
+
+case_seconds = metrics.Histogram(
+    "lcduel_judge0_case_seconds", "Test case sent to Judge0 until its verdict is in",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0),
+)
+errors = metrics.Counter("lcduel_judge0_errors_total", "Failed Judge0 requests by cause", ["reason"])
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Judge0Client:
+    # one per process: keeps TLS connections to RapidAPI alive between runs
+
+    def __init__(self, transport=None):
+        headers = {k: v for k, v in HEADERS.items() if v}
+        self.http = httpx.AsyncClient(
+            headers=headers,
+            http2=transport is None and _http2_available(),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+            transport=transport,
+        )
+        self.failures = 0
+        self.opened_at = None
+
+    # ---------------------------
+    #  circuit breaker
+    # ---------------------------
+    def _check_circuit(self):
+        if self.opened_at is None:
+            return
+        if time.monotonic() - self.opened_at < BREAKER_RESET_AFTER:
+            errors.labels("circuit_open").inc()
+            raise CircuitOpenError("Judge0 is unavailable, try again shortly")
+        # half-open: let this request through as a probe
+        self.opened_at = time.monotonic()
+
+    def _record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def _record_failure(self):
+        self.failures += 1
+        if self.failures >= BREAKER_THRESHOLD:
+            if self.opened_at is None:
+                log.warning("circuit open", failures=self.failures)
+            self.opened_at = time.monotonic()
+
+    def _backoff(self, attempt, response):
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        retry_after = _retry_after(response)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, BACKOFF_CAP))
+        return delay
+
+    async def request(self, method, url, **kwargs):
+        self._check_circuit()
+
+        response = None
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = await self.http.request(method, url, **kwargs)
+            except RETRY_ERRORS as e:
+                errors.labels(type(e).__name__).inc()
+                response = None
+                if attempt == MAX_RETRIES:
+                    self._record_failure()
+                    raise
+            except httpx.TimeoutException:
+                errors.labels("timeout").inc()
+                self._record_failure()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self._record_success()
+                    return response
+                errors.labels(str(response.status_code)).inc()
+                if attempt == MAX_RETRIES:
+                    break
+
+            await asyncio.sleep(self._backoff(attempt, response))
+
+        # quota exhaustion isn't an outage, so 429s don't trip the breaker
+        if response.status_code != 429:
+            self._record_failure()
+        return response
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def warm(self):
+        # straight through httpx: a failure here is logged, not counted
+        # against the breaker
+        try:
+            await self.http.get(ABOUT_URL)
+        except httpx.HTTPError as e:
+            log.warning("judge0 warm-up request failed", error=repr(e))
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+client = None
+
+
+async def start_client():
+    if WARM_CONNECTION:
+        await get_client().warm()
+    return get_client()
+
+
+async def close_client():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def get_client():
+    # outside the app lifespan (scripts) the client is created on first use
+    global client
+    if client is None:
+        client = Judge0Client()
+    return client
+
+
+@asynccontextmanager
+async def _limited(duel_key):
+    entry = _duel_limits.get(duel_key)
+    if entry is None:
+        entry = _duel_limits[duel_key] = [asyncio.Semaphore(DUEL_CONCURRENCY), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            async with _global_limit:
+                yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _duel_limits.pop(duel_key, None)
+
+
+def _payload(language_id, code, case):
+    # plain text, no base64 - user code is sent untouched
+    return {
+        "language_id": language_id,
+        "source_code": code,
+        "stdin": case["input"].strip(),
+        "redirect_stderr_to_stdout": False,
+    }
+
+
+# ---------------------------
+#  single submission (wait=true), used when batching isn't available
+# ---------------------------
+async def _run_single(client, language_id, code, case, duel_key):
+    started = time.perf_counter()
+    try:
+        async with _limited(duel_key):
+            response = await client.post(
+                f"{RAPIDAPI_URL}?base64_encoded=false&wait=true",
+                json=_payload(language_id, code, case),
+            )
+
+        if response.status_code != 200 and response.status_code != 201:
+            return error_result(case, f"Submission failed with status {response.status_code}", "Submission Error")
+
+        case_seconds.observe(time.perf_counter() - started)
+        return build_result(case, response.json())
+
+    except CircuitOpenError as e:
+        return error_result(case, str(e), "Unavailable")
+    except httpx.TimeoutException:
+        return error_result(case, "Execution timeout", "Timeout")
+    except Exception as e:
+        return error_result(case, str(e), "Error")
+
+
+# ---------------------------
+#  batch submission + token polling
+# ---------------------------
+async def _submit_batch(client, language_id, code, cases, duel_key):
+    async with _limited(duel_key):
+        response = await client.post(
+            f"{RAPIDAPI_URL}/batch?base64_encoded=false",
+            json={"submissions": [_payload(language_id, code, case) for case in cases]},
+        )
+
+    if response.status_code != 200 and response.status_code != 201:
+        return None
+    return [entry.get("token") for entry in response.json()]
+
+
+async def _poll_batch(client, waiting, testcases, report, duel_key, started):
+    # waiting: token -> index into testcases; started: when the batch went out
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + POLL_TIMEOUT
+    delay = POLL_FIRST
+
+    while waiting:
+        await asyncio.sleep(min(delay, POLL_INTERVAL))
+        pending = len(waiting)
+
+        try:
+            async with _limited(duel_key):
+                response = await client.get(
+                    f"{RAPIDAPI_URL}/batch",
+                    params={"tokens": ",".join(waiting), "base64_encoded": "false", "fields": RESULT_FIELDS},
+                )
+            # a failed poll is retried on the next tick
+            submissions = response.json().get("submissions", []) if response.status_code == 200 else []
+        except httpx.TimeoutException:
+            submissions = []
+
+        for sub in submissions:
+            if not sub or sub.get("token") not in waiting:
+                continue
+            if (sub.get("status") or {}).get("id") in PENDING_STATUSES:
+                continue
+            idx = waiting.pop(sub["token"])
+            case_seconds.observe(time.perf_counter() - started)
+            await report(idx, build_result(testcases[idx], sub))
+
+        if len(waiting) == pending:
+            delay *= 2
+
+        if waiting and loop.time() >= deadline:
+            timed_out = list(waiting.values())
+            waiting.clear()
+            for idx in timed_out:
+                await report(idx, error_result(testcases[idx], "Execution timeout", "Timeout"))
+
+
+async def _run_chunk(client, language_id, code, testcases, indices, report, duel_key):
+    started = time.perf_counter()
+    try:
+        tokens = await _submit_batch(client, language_id, code, [testcases[i] for i in indices], duel_key)
+    except Exception:
+        tokens = None
+
+    waiting = {}
+    rejected = []
+    for idx, token in zip(indices, tokens or [None] * len(indices)):
+        if token:
+            waiting[token] = idx
+        else:
+            rejected.append(idx)
+
+    async def run_rejected():
+        # batch endpoint unavailable (or some cases rejected): bounded fan-out instead
+        async def one(idx):
+            await report(idx, await _run_single(client, language_id, code, testcases[idx], duel_key))
+        await asyncio.gather(*(one(idx) for idx in rejected))
+
+    async def poll():
+        try:
+            await _poll_batch(client, waiting, testcases, report, duel_key, started)
+        except Exception as e:
+            failed = list(waiting.values())
+            waiting.clear()
+            for idx in failed:
+                await report(idx, error_result(testcases[idx], str(e), "Error"))
+
+    await asyncio.gather(run_rejected(), poll())
+
+
+async def run_testcases(client, testcases, code, language, duel_key=None, on_result=None, fail_fast=False):
+    language_id = LANGUAGE_IDS.get(language, 71)  # Default to Python
+    chunks = [list(range(i, min(i + BATCH_SIZE, len(testcases)))) for i in range(0, len(testcases), BATCH_SIZE)]
+
+    async def wait_each(report):
+        async def one(idx):
+            await report(idx, await _run_single(client, language_id, code, testcases[idx], duel_key))
+        await asyncio.gather(*(one(idx) for idx in range(len(testcases))))
+
+    if len(testcases) <= WAIT_CASES:
+        return await collect(testcases, wait_each, on_result=on_result, fail_fast=fail_fast)
+
+    async def work(report):
+        await asyncio.gather(*(
+            _run_chunk(client, language_id, code, testcases, chunk, report, duel_key) for chunk in chunks
+        ))
+
+    return await collect(testcases, work, on_result=on_result, fail_fast=fail_fast)
+
+
+class Judge0Executor(Executor):
+    name = "judge0"
+    # a run only holds a request slot while it submits or polls, and spends
+    # most of its time between polls, so many more runs than requests fit
+    capacity = int(os.getenv("JUDGE0_RUN_CAPACITY", str(GLOBAL_CONCURRENCY * 8)))
+
+    async def start(self):
+        await start_client()
+
+    async def close(self):
+        await close_client()
+
+    async def run(self, testcases, code, language, duel_key=None, on_result=None, fail_fast=False):
+        return await run_testcases(
+            get_client(), testcases, code, language,
+            duel_key=duel_key, on_result=on_result, fail_fast=fail_fast,
+        )
@@ -0,0 +1,412 @@
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import matchmaker, metrics
+from app.database import PlayerStats, async_engine
+from app.log import get_logger
+from app.state import get_backend
+from app.websocket.manager import WORKER_ID
+
+#---------------------------------------------------------
+# leaderboard: ratings, records and win streaks, kept sorted in memory
+#
+# every finalized duel updates both players' stats and moves them on the
+# global board and on the board for the duel's difficulty. a board is an
+# indexable skip list ordered by (-rating, username): each link also stores
+# how many entries it jumps over, so a player's rank and the entry at a
+# given position are O(log n), and a page is one descent plus page-size
+# steps along the bottom level.
+#
+# the global rating is the matchmaker's Elo rating; each difficulty board
+# keeps its own Elo rating, moved only by duels of that difficulty.
+#
+# every worker holds the whole leaderboard. the worker that finalizes a
+# duel applies the result and, with a shared backend, publishes the two
+# players' new stats on UPDATES_CHANNEL for the others to apply (absolute
+# values, so an update applied twice does no harm).
+#
+# players changed here are upserted into player_stats every
+# SNAPSHOT_INTERVAL seconds and on shutdown; load() reads them back, as a
+# phase of the startup warm-up (app.warmup) rather than before the worker
+# answers. duels that end before then are rated once it's done, in the
+# background (endpoint.rate), so they build on the players' loaded stats.
+
+UPDATES_CHANNEL = "lcduel:leaderboard"
+SNAPSHOT_INTERVAL = float(os.getenv("LEADERBOARD_SNAPSHOT_INTERVAL", "30"))  # seconds
+MAX_PAGE = 100
+RETRY_DELAY = 5.0
+
+GLOBAL = "global"
+COLUMNS = ("username", "rating", "wins", "losses", "draws", "streak", "best_streak", "last_change", "by_difficulty")
+
+MAX_LEVEL = 24  # enough for tens of millions of players at P = 1/4
+P = 0.25
+
+log = get_logger("leaderboard")
+_backend = get_backend()
+
+snapshot_seconds = metrics.Histogram("lcduel_leaderboard_snapshot_seconds", "One leaderboard snapshot write",
+                                     buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _shown(value):
+    # one decimal, and no "-0.0" for a draw between near-equal ratings
+    return round(value, 1) + 0.0
+
+
+# ---------------------------
+#  indexable skip list
+# ---------------------------
+class _Last:
+    # key of the tail node: sorts after every real key
+    def __lt__(self, other):
+        return False
+
+    __le__ = __lt__
+
+
+_END = _Last()
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level  # entries jumped over by next[level], counting the one landed on
+
+
+class SkipList:
+    def __init__(self):
+        self.size = 0
+        self.tail = _Node(_END, 0)
+        self.head = _Node(None, MAX_LEVEL)
+        self.head.next = [self.tail] * MAX_LEVEL
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, key):
+        # last node before key on every level, and how far each one is from the next level's
+        chain = [None] * MAX_LEVEL
+        steps_at = [0] * MAX_LEVEL
+        node = self.head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key <= key:
+                steps_at[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = 1
+        while height < MAX_LEVEL and random.random() < P:
+            height += 1
+        new = _Node(key, height)
+        steps = 0
+        for level in range(height):
+            before = chain[level]
+            new.next[level] = before.next[level]
+            before.next[level] = new
+            new.width[level] = before.width[level] - steps
+            before.width[level] = steps + 1
+            steps += steps_at[level]
+        for level in range(height, MAX_LEVEL):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [None] * MAX_LEVEL
+        node = self.head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            before = chain[level]
+            before.width[level] += target.width[level] - 1
+            before.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        # 0-based position of key, None if it isn't there
+        position = 0
+        node = self.head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position if node.next[0].key == key else None
+
+    def slice(self, start, count):
+        # up to count keys from position start on
+        if start >= self.size or count <= 0:
+            return []
+        node = self.head
+        remaining = start + 1
+        for level in reversed(range(MAX_LEVEL)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not self.tail and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Board:
+    def __init__(self):
+        self.order = SkipList()
+        self.keys = {}  # username -> its key in order
+
+    def __len__(self):
+        return len(self.order)
+
+    def set(self, username, rating):
+        key = (-rating, username)
+        old = self.keys.get(username)
+        if old == key:
+            return
+        if old is not None:
+            self.order.remove(old)
+        self.order.insert(key)
+        self.keys[username] = key
+
+    def rank(self, username):
+        # 1-based, None for a player who isn't on this board
+        key = self.keys.get(username)
+        return None if key is None else self.order.rank(key) + 1
+
+    def page(self, offset, limit):
+        # [(rank, username, rating)]
+        return [
+            (offset + i + 1, username, -negated)
+            for i, (negated, username) in enumerate(self.order.slice(offset, limit))
+        ]
+
+
+# ---------------------------
+#  player stats
+# ---------------------------
+def _blank(username):
+    return {
+        "username": username,
+        "rating": matchmaker.DEFAULT_RATING,
+        "wins": 0,
+        "losses": 0,
+        "draws": 0,
+        "streak": 0,
+        "best_streak": 0,
+        "last_change": 0.0,
+        "by_difficulty": {},
+    }
+
+
+def _blank_record():
+    # one difficulty's part of a player's stats
+    return {"rating": matchmaker.DEFAULT_RATING, "wins": 0, "losses": 0, "draws": 0, "last_change": 0.0}
+
+
+def _tally(record, score):
+    key = "wins" if score == 1 else "losses" if score == 0 else "draws"
+    record[key] += 1
+
+
+class Leaderboard:
+    def __init__(self):
+        self.players = {}  # username -> stats, replaced (never changed in place) on update
+        self.boards = {GLOBAL: Board()}
+        self.dirty = set()  # changed on this worker since the last snapshot
+        self.loaded = asyncio.Event()
+        self.task = None
+
+    def _apply(self, stats):
+        username = stats["username"]
+        self.players[username] = stats
+        self.boards[GLOBAL].set(username, stats["rating"])
+        for difficulty, record in stats["by_difficulty"].items():
+            self.boards.setdefault(difficulty, Board()).set(username, record["rating"])
+
+    def _copy(self, username):
+        stats = self.players.get(username)
+        if stats is None:
+            return _blank(username)
+        return {**stats, "by_difficulty": {d: dict(r) for d, r in stats["by_difficulty"].items()}}
+
+    async def record(self, duel_key, difficulty, winner, deltas):
+        # called once per duel by the worker that finalized it, after
+        # matchmaker.record_result; winner None means a draw, deltas is
+        # what record_result returned
+        player1, player2 = duel_key
+        score1 = 0.5 if winner is None else (1.0 if winner == player1 else 0.0)
+        one, two = self._copy(player1), self._copy(player2)
+
+        difficulty = (difficulty or "").lower()
+        if difficulty:
+            record1 = one["by_difficulty"].setdefault(difficulty, _blank_record())
+            record2 = two["by_difficulty"].setdefault(difficulty, _blank_record())
+            delta = matchmaker.elo_delta(record1["rating"], record2["rating"], score1)
+            for record, change, score in ((record1, delta, score1), (record2, -delta, 1 - score1)):
+                record["rating"] += change
+                record["last_change"] = change
+                _tally(record, score)
+
+        for stats, score in ((one, score1), (two, 1 - score1)):
+            username = stats["username"]
+            stats["rating"] = matchmaker.get_rating(username)
+            stats["last_change"] = deltas.get(username, 0.0)
+            _tally(stats, score)
+            stats["streak"] = stats["streak"] + 1 if score == 1 else 0
+            stats["best_streak"] = max(stats["best_streak"], stats["streak"])
+            self._apply(stats)
+            self.dirty.add(username)
+
+        if _backend.shared:
+            await _backend.publish(UPDATES_CHANNEL, json.dumps({"origin": WORKER_ID, "players": [one, two]}))
+
+    async def _on_update(self, channel, message):
+        update = json.loads(message)
+        if update["origin"] == WORKER_ID:
+            return
+        for stats in update["players"]:
+            self._apply(stats)
+
+    # ---------------------------
+    #  reads
+    # ---------------------------
+    def page(self, difficulty=None, offset=0, limit=50):
+        name = (difficulty or GLOBAL).lower()
+        board = self.boards.get(name)
+        offset = max(0, offset)
+        limit = max(1, min(limit, MAX_PAGE))
+        entries = []
+        for rank, username, rating in (board.page(offset, limit) if board else []):
+            stats = self.players[username]
+            record = stats if name == GLOBAL else stats["by_difficulty"][name]
+            entry = {
+                "rank": rank,
+                "username": username,
+                "rating": _shown(rating),
+                "wins": record["wins"],
+                "losses": record["losses"],
+                "draws": record["draws"],
+                "last_change": _shown(record["last_change"]),
+            }
+            if name == GLOBAL:
+                entry["streak"] = stats["streak"]
+            entries.append(entry)
+        return {"board": name, "total": len(board) if board else 0, "offset": offset, "limit": limit, "entries": entries}
+
+    def stats(self, username):
+        # None for a player with no finished duels
+        stats = self.players.get(username)
+        if stats is None:
+            return None
+        return {
+            **stats,
+            "rating": _shown(stats["rating"]),
+            "last_change": _shown(stats["last_change"]),
+            "played": stats["wins"] + stats["losses"] + stats["draws"],
+            "rank": self.boards[GLOBAL].rank(username),
+            "by_difficulty": {
+                difficulty: {
+                    **record,
+                    "rating": _shown(record["rating"]),
+                    "last_change": _shown(record["last_change"]),
+                    "rank": self.boards[difficulty].rank(username),
+                }
+                for difficulty, record in stats["by_difficulty"].items()
+            },
+        }
+
+    # ---------------------------
+    #  snapshots
+    # ---------------------------
+    async def load(self):
+        table = PlayerStats.__table__
+        async with async_engine.connect() as conn:
+            rows = (await conn.execute(select(*(table.c[column] for column in COLUMNS)))).all()
+        for row in rows:
+            stats = dict(row._mapping)
+            if stats["username"] in self.players:
+                # updated from another worker since start(): newer than the row
+                continue
+            stats["by_difficulty"] = stats["by_difficulty"] or {}
+            self._apply(stats)
+            # with the memory backend ratings don't outlive the process otherwise
+            if not _backend.shared:
+                matchmaker.ratings.setdefault(stats["username"], stats["rating"])
+        self.loaded.set()
+        log.info("leaderboard loaded", players=len(rows))
+        return len(rows)
+
+    async def snapshot(self):
+        if not self.dirty:
+            return
+        usernames, self.dirty = self.dirty, set()
+        now = _now()
+        rows = [{**self.players[username], "updated_at": now} for username in usernames]
+
+        insert = postgresql.insert if async_engine.dialect.name == "postgresql" else sqlite.insert
+        stmt = insert(PlayerStats.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PlayerStats.__table__.c.username],
+            set_={column: stmt.excluded[column] for column in COLUMNS[1:] + ("updated_at",)},
+        )
+        started = time.perf_counter()
+        try:
+            async with async_engine.begin() as conn:
+                await conn.execute(stmt, rows)
+        except BaseException:
+            # still to be written next time
+            self.dirty |= usernames
+            raise
+        snapshot_seconds.observe(time.perf_counter() - started)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                await self.snapshot()
+            except Exception:
+                log.exception("leaderboard snapshot failed, retrying", dirty=len(self.dirty))
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def start(self):
+        await _backend.subscribe(UPDATES_CHANNEL, self._on_update)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        try:
+            await self.snapshot()
+        except Exception:
+            log.exception("final leaderboard snapshot failed", lost=len(self.dirty))
+
+
+leaderboard = Leaderboard()
+
+metrics.Gauge("lcduel_leaderboard_players", "Players on the global leaderboard", fn=lambda: len(leaderboard.players))
@@ -0,0 +1,272 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from app.checker import check_for
+from app.executor import Executor, build_result, collect, error_result
+
+#---------------------------------------------------------
+# local sandboxed execution (EXECUTOR=local)
+#
+# submissions run on a pool of pre-warmed worker processes. compiled
+# languages are built once per run and the binary is reused for every case;
+# python cases fork the already-initialised worker instead of paying for a
+# fresh interpreter each time. every case gets rlimits for cpu, memory and
+# output size plus a wall-clock timeout.
+#
+# rlimits are not a security boundary on their own - run this inside a
+# container / as an unprivileged user when taking untrusted code.
+
+LOCAL_WORKERS = int(os.getenv("LOCAL_WORKERS", str(os.cpu_count() or 2)))
+CPU_LIMIT = int(os.getenv("LOCAL_CPU_LIMIT", "2"))  # seconds
+WALL_LIMIT = float(os.getenv("LOCAL_WALL_LIMIT", "5"))  # seconds
+MEMORY_LIMIT = int(os.getenv("LOCAL_MEMORY_MB", "256")) * 1024 * 1024
+OUTPUT_LIMIT = int(os.getenv("LOCAL_OUTPUT_KB", "1024")) * 1024
+# stdout is checked from its file in the worker; only this much comes back for display
+OUTPUT_PREVIEW = int(os.getenv("LOCAL_OUTPUT_PREVIEW_KB", "64")) * 1024
+COMPILE_TIMEOUT = 15.0
+
+COMPILERS = {
+    "c": ["gcc", "-O2", "-std=c11", "-o", "main", "main.c", "-lm"],
+    "cpp": ["g++", "-O2", "-std=c++17", "-o", "main", "main.cpp"],
+}
+SOURCE_FILES = {"python": "main.py", "c": "main.c", "cpp": "main.cpp"}
+
+# Judge0 status ids, so results look the same whichever backend ran them
+ACCEPTED = {"id": 3, "description": "Accepted"}
+TIME_LIMIT = {"id": 5, "description": "Time Limit Exceeded"}
+COMPILATION_ERROR = {"id": 6, "description": "Compilation Error"}
+RUNTIME_SIGSEGV = {"id": 7, "description": "Runtime Error (SIGSEGV)"}
+RUNTIME_NZEC = {"id": 11, "description": "Runtime Error (NZEC)"}
+RUNTIME_OTHER = {"id": 12, "description": "Runtime Error (Other)"}
+INTERNAL_ERROR = {"id": 13, "description": "Internal Error"}
+
+
+# ---------------------------
+#  worker side (runs inside the process pool)
+# ---------------------------
+def _warm_worker():
+    # imported once per worker, so forked python cases start hot
+    import json  # noqa: F401
+    import collections  # noqa: F401
+    import heapq  # noqa: F401
+    import itertools  # noqa: F401
+    import math  # noqa: F401
+
+
+def _ping():
+    return os.getpid()
+
+
+def _address_space():
+    # RLIMIT_AS counts memory the forked worker already has mapped
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * resource.getpagesize()
+
+
+def _apply_limits(memory_limit):
+    resource.setrlimit(resource.RLIMIT_CPU, (CPU_LIMIT, CPU_LIMIT + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (OUTPUT_LIMIT, OUTPUT_LIMIT))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+def _exec_python(source_path):
+    sys.stdin = io.TextIOWrapper(io.FileIO(0, closefd=False))
+    sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False))
+    sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False))
+
+    exit_code = 0
+    try:
+        with open(source_path) as f:
+            code = compile(f.read(), "main.py", "exec")
+        exec(code, {"__name__": "__main__", "__builtins__": __builtins__})
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except OSError:
+            exit_code = exit_code or 1
+    os._exit(exit_code)
+
+
+def _run_case(prepared, workdir, idx, stdin_data, check=None):
+    language, target = prepared
+    in_path = os.path.join(workdir, f"in_{idx}")
+    out_path = os.path.join(workdir, f"out_{idx}")
+    err_path = os.path.join(workdir, f"err_{idx}")
+    with open(in_path, "w") as f:
+        f.write(stdin_data)
+
+    in_fd = os.open(in_path, os.O_RDONLY)
+    out_fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    err_fd = os.open(err_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    memory_limit = MEMORY_LIMIT + (_address_space() if language == "python" else 0)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            # relative paths in the submission land in its own run directory
+            os.chdir(workdir)
+            os.dup2(in_fd, 0)
+            os.dup2(out_fd, 1)
+            os.dup2(err_fd, 2)
+            _apply_limits(memory_limit)
+            # python ignores these; the submission should die on them instead
+            signal.signal(signal.SIGXFSZ, signal.SIG_DFL)
+            signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+            if language == "python":
+                _exec_python(target)
+            else:
+                os.execv(target, [target])
+        finally:
+            os._exit(127)
+
+    for fd in (in_fd, out_fd, err_fd):
+        os.close(fd)
+
+    # wall-clock timeout: cpu rlimit alone misses sleeping/blocked programs
+    deadline = time.monotonic() + WALL_LIMIT
+    delay = 0.0005
+    timed_out = False
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        if time.monotonic() >= deadline:
+            timed_out = True
+            os.killpg(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 0.01)
+
+    streamed = check is not None and check.streams
+    with open(out_path, errors="replace") as f:
+        stdout = f.read(OUTPUT_PREVIEW if streamed else OUTPUT_LIMIT)
+    with open(err_path, errors="replace") as f:
+        stderr = f.read(OUTPUT_LIMIT)
+
+    if timed_out:
+        return {"stdout": stdout, "stderr": stderr, "status": TIME_LIMIT}
+
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        if sig in (signal.SIGXCPU, signal.SIGKILL):
+            return {"stdout": stdout, "stderr": stderr, "status": TIME_LIMIT}
+        if sig == signal.SIGXFSZ:
+            return {"stdout": stdout, "stderr": "Output limit exceeded", "status": RUNTIME_OTHER}
+        if sig == signal.SIGSEGV:
+            return {"stdout": stdout, "stderr": stderr, "status": RUNTIME_SIGSEGV}
+        return {"stdout": stdout, "stderr": stderr or f"Killed by signal {sig}", "status": RUNTIME_OTHER}
+
+    if os.WEXITSTATUS(status) != 0:
+        return {"stdout": stdout, "stderr": stderr, "status": RUNTIME_NZEC}
+    if streamed:
+        return {"stdout": stdout, "stderr": stderr, "status": ACCEPTED, "passed": check.matches_file(out_path)}
+    return {"stdout": stdout, "stderr": stderr, "status": ACCEPTED}
+
+
+def _prepare(language, code, workdir):
+    # compile once; every case of this run reuses the result
+    source_path = os.path.join(workdir, SOURCE_FILES[language])
+    with open(source_path, "w") as f:
+        f.write(code)
+
+    if language == "python":
+        return True, (language, source_path), None
+
+    try:
+        proc = subprocess.run(
+            COMPILERS[language], cwd=workdir, capture_output=True, text=True, timeout=COMPILE_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        return False, None, "Compilation timed out"
+    except FileNotFoundError:
+        return False, None, f"No compiler available for {language}"
+
+    if proc.returncode != 0:
+        return False, None, proc.stderr or proc.stdout
+    return True, (language, os.path.join(workdir, "main")), None
+
+
+# ---------------------------
+#  event loop side
+# ---------------------------
+class LocalExecutor(Executor):
+    name = "local"
+
+    def __init__(self, workers=LOCAL_WORKERS):
+        self.workers = workers
+        self.capacity = workers
+        self.pool = None
+
+    async def start(self):
+        if self.pool is not None:
+            return
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_warm_worker,
+        )
+        # the pool spawns lazily; push one job per worker so they're all up
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _ping) for _ in range(self.workers)))
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def run(self, testcases, code, language, duel_key=None, on_result=None, fail_fast=False):
+        await self.start()
+        loop = asyncio.get_running_loop()
+
+        async def work(report):
+            if language not in SOURCE_FILES:
+                for idx, case in enumerate(testcases):
+                    await report(idx, error_result(case, f"{language} is not supported by the local runner", "Error"))
+                return
+
+            workdir = tempfile.mkdtemp(prefix="lcduel-")
+            try:
+                ok, prepared, compile_output = await loop.run_in_executor(self.pool, _prepare, language, code, workdir)
+                if not ok:
+                    outcome = {"compile_output": compile_output, "status": COMPILATION_ERROR}
+                    for idx, case in enumerate(testcases):
+                        await report(idx, build_result(case, outcome))
+                    return
+
+                async def one(idx, case):
+                    try:
+                        outcome = await loop.run_in_executor(
+                            self.pool, _run_case, prepared, workdir, idx, case["input"].strip(), check_for(case),
+                        )
+                    except Exception as e:
+                        outcome = {"stderr": str(e), "status": INTERNAL_ERROR}
+                    await report(idx, build_result(case, outcome))
+
+                await asyncio.gather(*(one(idx, case) for idx, case in enumerate(testcases)))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        return await collect(testcases, work, on_result=on_result, fail_fast=fail_fast)
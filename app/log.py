@@ -0,0 +1,156 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+from app import metrics
+
+#---------------------------------------------------------
+# structured logging that never blocks the event loop
+#
+# records go onto a bounded in-memory queue and a background thread does
+# the actual writing; when the queue is full the record is dropped (and
+# counted, as lcduel_log_dropped_total) instead of making the caller wait.
+#
+#   log = get_logger("duels")
+#   log.info("duel ended", duel="a|b", winner="a")
+#
+# LOG_LEVEL         minimum level written (INFO)
+# LOG_FORMAT        "text" or "json" (one object per line)
+# LOG_SAMPLE_LEVEL  records at or below this level are sampled... (DEBUG)
+# LOG_SAMPLE_RATE   ...and kept with this probability (1.0 = keep all)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE_LEVEL = os.getenv("LOG_SAMPLE_LEVEL", "DEBUG").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT = "lcduel"
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        stamp = time.strftime("%H:%M:%S", time.localtime(record.created))
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        line = f"{stamp} {record.levelname:<7} [{record.name}] {record.getMessage()}"
+        if fields:
+            line += " " + fields
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class _Sampler(logging.Filter):
+    def __init__(self, level, rate):
+        super().__init__()
+        self.level = level
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > self.level or self.rate >= 1.0 or random.random() < self.rate
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+        self.plain = logging.Formatter()
+
+    def prepare(self, record):
+        # resolve args and the traceback here, on the caller's thread, but
+        # leave the layout to the formatter on the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.plain.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+
+
+def _setup():
+    global _handler
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(_JsonFormatter() if LOG_FORMAT == "json" else _TextFormatter())
+
+    _handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(_Sampler(logging.getLevelName(LOG_SAMPLE_LEVEL), LOG_SAMPLE_RATE))
+    listener = logging.handlers.QueueListener(_handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger(ROOT)
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_handler)
+    root.propagate = False
+
+
+def dropped():
+    # records lost to a full queue since startup
+    return _handler.dropped if _handler is not None else 0
+
+
+class Logger:
+    # logging.Logger with keyword fields: log.warning("msg", key=value, ...)
+    __slots__ = ("logger",)
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+
+def get_logger(name):
+    if _handler is None:
+        _setup()
+    return Logger(logging.getLogger(f"{ROOT}.{name}"))
+
+
+metrics.Counter("lcduel_log_dropped_total", "Log records dropped because the log queue was full", fn=dropped)
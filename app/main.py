@@ -1,25 +1,79 @@
-from fastapi import FastAPI, WebSocket, Request
+from fastapi import BackgroundTasks, Depends, FastAPI, Header, WebSocket, Request
 from pydantic import BaseModel
 from app import matchmaker
 from app.models import JoinRequest
 from app import problems
-from app.websocket.endpoint import websocket_endpoints
-import requests
+from app.websocket.endpoint import (
+    websocket_endpoints, duel_key_for, duel_timers, extend_duel, finish, manager, pause_duel, recover_duels,
+    resume_duel, run_seconds,
+)
+from app import runner, result_cache
+from app.state import get_backend
+from app.websocket import code_sync, spectators
+from app.websocket.session import verdict
+from app.executor import get_executor
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import SessionLocal, Problem
-import subprocess
-import tempfile
-import os 
-import json
-from datetime import datetime
-import httpx
-from dotenv import load_dotenv
-import base64
+from app.database import async_engine, get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import os
+import secrets
+import time
+from contextlib import asynccontextmanager
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-
-app = FastAPI(title="LeetCode Duel")
-load_dotenv()
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app import metrics
+from app.admission import Overloaded, RateLimited, admission
+from app import duels
+from app.duels import history_id
+from app.history import history
+from app.leaderboard import leaderboard
+from app.log import get_logger
+from app.warmup import warmup
+
+log = get_logger("app")
+
+# the /admin routes are off unless this is set; callers send it as X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # shared state (STATE_BACKEND=redis) lets several workers serve one game
+    await get_backend().start()
+    await manager.start()
+    await spectators.start()
+    await code_sync.start()
+    # problems rewritten by an ingest run: drop this worker's copies
+    await runner.start()
+    # one timer wheel for every duel deadline, including ones from before a restart
+    duel_timers.start()
+    # duel results and submissions are written in batches in the background
+    history.start()
+    # ranks and player stats as other workers change them; snapshots
+    await leaderboard.start()
+    # state backend only, no DB
+    log.info("recovered running duels", count=await recover_duels())
+    # DB pool, Judge0 client (or local workers), the leaderboard snapshot,
+    # problem index and the hottest problems, in the background; GET /ready
+    # says when it's done
+    warmup.start()
+    ticker = asyncio.create_task(matchmaker.run_ticker())
+    yield
+    await warmup.close()
+    ticker.cancel()
+    await duel_timers.close()
+    await manager.close()
+    await get_executor().close()
+    await problems.close()
+    # whatever history is still buffered goes out before the pool closes
+    await history.close()
+    await leaderboard.close()
+    await async_engine.dispose()
+    await get_backend().close()
+
+
+app = FastAPI(title="LeetCode Duel", lifespan=lifespan)
 
 
 app.add_middleware(
@@ -33,11 +87,7 @@ app.add_middleware(
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     body = await request.body()
-    print("="*50)
-    print("[VALIDATION ERROR]")
-    print(f"Errors: {exc.errors()}")
-    print(f"Request body: {body.decode()}")
-    print("="*50)
+    log.warning("validation error", path=request.url.path, errors=exc.errors(), body=body.decode(errors="replace"))
     return JSONResponse(
         status_code=422,
         content={"detail": exc.errors()},
@@ -49,17 +99,22 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 def home():
     return {"message": "Welcome to LeetCode Duel!"}
 
+@app.get("/ready")
+def ready():
+    # 503 until the startup warm-up is done ("/" only says the process is up)
+    status = warmup.status()
+    return status if status["ready"] else JSONResponse(status_code=503, content=status)
+
 @app.post("/join")
-def join_queue(req: JoinRequest):
-    matchmaking = matchmaker.add_player(req.username)
-    print(req.username)
+async def join_queue(req: JoinRequest):
+    matchmaking = await matchmaker.join(req.username, req.difficulty, req.tag)
     if matchmaking:
-        return {"status": "matched", "players": matchmaking}
+        return {"status": "matched", "players": matchmaking["players"]}
     return {"status": "waiting"}
 
 @app.get("/problem")
-def get_problems():
-    return problems.get_problem_for_match()
+async def get_problems(difficulty: str | None = None, tag: str | None = None, db: AsyncSession = Depends(get_db)):
+    return await problems.get_problem_for_match(difficulty, tag, db=db)
 
 @app.websocket("/ws/{username}")
 async def websocket_route(websocket: WebSocket, username: str):
@@ -70,166 +125,128 @@ class RunRequest(BaseModel):
     slug: str
     code: str
     language: str | None = "python"
+    username: str | None = None
 
 #---------------------------------------------------------
 # api to handle submission
-RAPIDAPI_HOST = "judge0-ce.p.rapidapi.com"
-RAPIDAPI_URL = f"https://{RAPIDAPI_HOST}/submissions"
-RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY")
-
-import httpx
-import base64
-import json
-
 @app.post("/run")
-async def run_code(req: RunRequest):
+async def run_code(req: RunRequest, request: Request, background: BackgroundTasks, db: AsyncSession = Depends(get_db)):
+    started = time.perf_counter()
     problem_slug = req.slug
     code = req.code
     language = req.language
 
-    db = SessionLocal()
-    problem = db.query(Problem).filter(Problem.slug == problem_slug).first()
-    db.close()
-
-    if not problem:
+    # all of the problem's cases go to Judge0 at once; the per-duel limit
+    # keeps one duel from hogging the quota
+    in_duel = await duel_key_for(req.username)
+    duel_key = in_duel or req.username
+    # anonymous runs are rate limited per client address
+    user = req.username or f"ip:{request.client.host if request.client else 'unknown'}"
+    try:
+        async with admission.admit(user, duel_key):
+            results = await runner.run_submission(problem_slug, code, language, duel_key=duel_key, db=db)
+    except (RateLimited, Overloaded) as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": str(e), "retry_after": round(e.retry_after, 1)},
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        )
+
+    if results is None:
         return {"error": "problem not found"}
-    
-    # Language ID mapping for Judge0
-    language_ids = {
-        "python": 71,  # Python 3
-        "javascript": 63,  # Node.js
-        "cpp": 54,  # C++ (GCC 9.2.0)
-        "java": 62,  # Java
-        "c": 50,  # C (GCC 9.2.0)
-    }
-    
-    language_id = language_ids.get(language, 71)  # Default to Python
-    
-    results = []
-
-    async with httpx.AsyncClient() as client:
-        for idx, case in enumerate(problem.testcases):
-            input_data = case["input"].strip()
-            expected_output = case["expected_output"].strip()
-
-            # Don't modify user code - they handle everything
-            user_code = code
-
-            # DON'T use base64 encoding - use plain text
-            submission_payload = {
-                "language_id": language_id,
-                "source_code": user_code,  # Plain text
-                "stdin": input_data,  # Plain text
-                "redirect_stderr_to_stdout": False,
-            }
-
-            headers = {
-                "Content-Type": "application/json",
-                "X-RapidAPI-Key": RAPIDAPI_KEY,
-                "X-RapidAPI-Host": RAPIDAPI_HOST,
-            }
-
-            # Create submission WITHOUT base64_encoded parameter
-            try:
-                response = await client.post(
-                    f"{RAPIDAPI_URL}?base64_encoded=false&wait=true",  # ← Changed to false
-                    json=submission_payload,
-                    headers=headers,
-                    timeout=30.0
-                )
-
-                if response.status_code != 200 and response.status_code != 201:
-                    results.append({
-                        "input": input_data,
-                        "expected": expected_output,
-                        "output": None,
-                        "passed": False,
-                        "error": f"Submission failed with status {response.status_code}",
-                        "status": "Submission Error"
-                    })
-                    continue
-
-                result = response.json()
-                
-                # NO base64 decoding needed - Judge0 returns plain text
-                stdout = (result.get("stdout") or "").strip()
-                stderr = (result.get("stderr") or "").strip()
-                compile_output = (result.get("compile_output") or "").strip()
-                
-                # Check status
-                status_id = result.get("status", {}).get("id")
-                status_desc = result.get("status", {}).get("description", "Unknown")
-                
-                # Status IDs: 3 = Accepted
-                execution_success = status_id == 3
-                
-                # Parse output for comparison
-                actual_output = stdout
-                
-                # Try to parse both as JSON for comparison
-                try:
-                    expected_parsed = json.loads(expected_output)
-                    actual_parsed = json.loads(actual_output)
-                    passed = expected_parsed == actual_parsed
-                except (json.JSONDecodeError, ValueError):
-                    # Fall back to string comparison
-                    passed = actual_output == expected_output
-
-                # Only mark as passed if execution succeeded AND output matches
-                passed = execution_success and passed
-
-                error_message = None
-                if not execution_success:
-                    error_message = stderr or compile_output or status_desc
-                elif not passed:
-                    error_message = "Output mismatch"
-
-                results.append({
-                    "input": input_data,
-                    "expected": expected_output,
-                    "output": actual_output,
-                    "passed": passed,
-                    "error": error_message,
-                    "status": status_desc,
-                })
-
-            except httpx.TimeoutException:
-                results.append({
-                    "input": input_data,
-                    "expected": expected_output,
-                    "output": None,
-                    "passed": False,
-                    "error": "Execution timeout",
-                    "status": "Timeout",
-                })
-            except Exception as e:
-                results.append({
-                    "input": input_data,
-                    "expected": expected_output,
-                    "output": None,
-                    "passed": False,
-                    "error": str(e),
-                    "status": "Error",
-                })
 
     all_passed = all(r["passed"] for r in results)
+    run_seconds.labels("http").observe(time.perf_counter() - started)
+    # recorded after the response has gone out
+    background.add_task(record_run, req, in_duel, results)
     return {"all_passed": all_passed, "results": results}
 
 
+async def record_run(req, duel_key, results):
+    if duel_key:
+        # kept with the duel, for a player who reconnects
+        await duels.set_verdict(duel_key, req.username, verdict(results))
+    history.record_run(req.username, await history_id(duel_key), req.slug, req.language, req.code, results, "http")
+
+
+@app.get("/duels/live")
+async def live_duels():
+    # running duels, most watched first, for picking one to spectate
+    return await spectators.live_duels()
+
+
+@app.get("/leaderboard")
+def get_leaderboard(difficulty: str | None = None, offset: int = 0, limit: int = 50):
+    # global board by default, or one difficulty's; at most 100 entries a page
+    return leaderboard.page(difficulty, offset, limit)
+
+
+@app.get("/players/{username}/stats")
+def player_stats(username: str):
+    stats = leaderboard.stats(username)
+    if stats is None:
+        return JSONResponse(status_code=404, content={"error": "No finished duels for this player"})
+    return stats
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(await metrics.render(), media_type="text/plain; version=0.0.4")
 
 
-#-----------------------------------------------------------------------------------------
-#helper func
-async def finalize_duel(duel_key):
-    # This will run automatically after both finish OR timer ends
-    p1, p2 = duel_key
-    print(f"Finalizing duel between {p1} and {p2}")
+@app.get("/stats/cache")
+def cache_stats():
+    return result_cache.cache.stats()
 
-    # TODO: Check their test results
-    # TODO: Call AI judge if both passed
-    # TODO: Broadcast result via WebSocket
 
-    print("Duel finished!")
+
+
+#---------------------------------------------------------
+# admin: a running duel's clock (overtime, pause, resume). both players and
+# the duel's spectators get the new clock straight away
+class OvertimeRequest(BaseModel):
+    seconds: float = 60
+
+
+def _forbidden(token):
+    if not ADMIN_TOKEN or not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        return JSONResponse(status_code=403, content={"error": "Admin token required"})
+    return None
+
+
+async def _clock(username, change):
+    duel_key = await duel_key_for(username)
+    result = await change(duel_key) if duel_key else None
+    if result is None:
+        return JSONResponse(status_code=409, content={"error": "No duel in that state for this player"})
+    return result
+
+
+@app.post("/admin/duels/{username}/overtime")
+async def duel_overtime(username: str, req: OvertimeRequest, x_admin_token: str | None = Header(None)):
+    if denied := _forbidden(x_admin_token):
+        return denied
+    if req.seconds <= 0:
+        return JSONResponse(status_code=422, content={"error": "seconds must be positive"})
+    result = await _clock(username, lambda duel_key: extend_duel(duel_key, req.seconds))
+    return result if isinstance(result, JSONResponse) else {"deadline": result}
+
+
+@app.post("/admin/duels/{username}/pause")
+async def duel_pause(username: str, x_admin_token: str | None = Header(None)):
+    if denied := _forbidden(x_admin_token):
+        return denied
+    result = await _clock(username, pause_duel)
+    return result if isinstance(result, JSONResponse) else {"paused": result}
+
+
+@app.post("/admin/duels/{username}/resume")
+async def duel_resume(username: str, x_admin_token: str | None = Header(None)):
+    if denied := _forbidden(x_admin_token):
+        return denied
+    result = await _clock(username, resume_duel)
+    return result if isinstance(result, JSONResponse) else {"deadline": result}
+
 
 @app.post("/finish")
 async def finish_duel(payload: dict):
@@ -239,14 +256,9 @@ async def finish_duel(payload: dict):
     if not username or not opponent:
         return {"error": "Missing username or opponent"}
 
-    duel_key = tuple(sorted([username, opponent]))
-    duel = duel_states.setdefault(duel_key, {"finished": set(), "start": datetime.utcnow(), "duration": 600})
-
-    duel["finished"].add(username)
-
-    # If both finished, trigger evaluation
-    if len(duel["finished"]) == 2:
-        await finalize_duel(duel_key)
+    # same path as the socket's "finish:<opponent>", whichever worker holds the duel
+    if not await finish(username, opponent):
+        return {"error": "No active duel"}
 
     return {"message": f"{username} marked as finished"}
     
@@ -1,19 +1,450 @@
-from typing import List, Optional
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional
 
-queue: List[str] = []
-matches: List[List[str]] = []
-def add_player(username: str) -> Optional[List[str]]:
-    if username in queue:
+from app import metrics
+from app.log import get_logger
+from app.state import get_backend
+
+#---------------------------------------------------------
+# skill-rated matchmaking, shared by POST /join and the websocket "join"
+#
+# waiting players are grouped by their filters (difficulty, tag), and within
+# a group sit in rating buckets (BUCKET_WIDTH wide), each an
+# insertion-ordered dict so the oldest waiter is first and cancel is O(1).
+# a lookup only visits the groups whose filters fit the player's, so
+# everyone it looks at is a possible opponent; in each, the sorted list of
+# non-empty bucket ids is searched with bisect. a player's acceptable
+# rating gap starts at BASE_WINDOW and widens the longer they wait; a pair
+# is acceptable when the gap fits either player's window.
+#
+# newcomers are matched on enqueue. the ticker only re-checks players whose
+# window has just grown past another bucket, and those already at
+# MAX_WINDOW every MAX_WINDOW_RECHECK seconds, so a tick costs about the
+# same with ten or ten thousand players waiting.
+#
+# with a shared state backend (STATE_BACKEND=redis) the queue, ratings and
+# unclaimed matches live there instead, so players on different workers
+# can meet; see SharedMatchQueue.
+
+DEFAULT_RATING = 1200.0
+K_FACTOR = 32
+
+BUCKET_WIDTH = 50
+BASE_WINDOW = 100
+WINDOW_GROWTH = 50  # rating points per second waited
+MAX_WINDOW = 1000
+TICK_INTERVAL = 0.5
+# how deep into each bucket to look (all of a group's players are compatible)
+SCAN_PER_BUCKET = 4
+MAX_WINDOW_RECHECK = 5.0  # seconds
+# unclaimed matches for players without a socket (POST /join pollers)
+UNCLAIMED_TTL = 60.0
+# shared queue: candidates fetched per lookup, due re-checks handled per tick
+SHARED_SCAN = 64
+SHARED_TICK_BATCH = 200
+
+QUEUE_KEY = "lcduel:queue"  # zset username -> rating
+ENTRIES_KEY = "lcduel:queue:entries"  # hash username -> entry json
+RECHECKS_KEY = "lcduel:queue:rechecks"  # zset username -> next re-check time
+RATINGS_KEY = "lcduel:ratings"
+
+_backend = get_backend()
+
+log = get_logger("matchmaker")
+
+match_wait = metrics.Histogram(
+    "lcduel_match_wait_seconds", "Time a player spent queued before being matched",
+    buckets=(0.01, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+ratings: Dict[str, float] = {}
+
+
+def get_rating(username: str) -> float:
+    return ratings.get(username, DEFAULT_RATING)
+
+
+async def fetch_rating(username: str) -> float:
+    # with a shared backend another worker may have updated it
+    if _backend.shared:
+        value = await _backend.hget(RATINGS_KEY, username)
+        if value is not None:
+            ratings[username] = float(value)
+    return get_rating(username)
+
+
+def elo_delta(r1: float, r2: float, score1: float) -> float:
+    # player 1's change; score1 is 1 for a win, 0.5 for a draw, 0 for a loss
+    expected1 = 1 / (1 + 10 ** ((r2 - r1) / 400))
+    return K_FACTOR * (score1 - expected1)
+
+
+async def record_result(player1: str, player2: str, winner: Optional[str]):
+    # Elo update; winner None means a draw
+    r1, r2 = await fetch_rating(player1), await fetch_rating(player2)
+    score1 = 0.5 if winner is None else (1.0 if winner == player1 else 0.0)
+    delta = elo_delta(r1, r2, score1)
+    ratings[player1] = r1 + delta
+    ratings[player2] = r2 - delta
+    if _backend.shared:
+        await _backend.hset(RATINGS_KEY, {player1: ratings[player1], player2: ratings[player2]})
+    return {player1: delta, player2: -delta}
+
+
+class _Entry:
+    __slots__ = ("username", "rating", "joined_at", "difficulty", "tag", "bucket", "group")
+
+    def __init__(self, username, rating, joined_at, difficulty, tag):
+        self.username = username
+        self.rating = rating
+        self.joined_at = joined_at
+        self.difficulty = difficulty
+        self.tag = tag
+        self.bucket = int(rating // BUCKET_WIDTH)
+        # filters as compared: lowercased, None for "any"
+        self.group = ((difficulty or "").lower() or None, (tag or "").lower() or None)
+
+    def window(self, now):
+        return min(MAX_WINDOW, BASE_WINDOW + WINDOW_GROWTH * (now - self.joined_at))
+
+    def dumps(self):
+        return json.dumps([self.rating, self.joined_at, self.difficulty, self.tag])
+
+    @classmethod
+    def loads(cls, username, data):
+        return cls(username, *json.loads(data))
+
+
+def _compatible_groups(a, b):
+    return all(x is None or y is None or x == y for x, y in zip(a, b))
+
+
+def _compatible(a, b):
+    return _compatible_groups(a.group, b.group)
+
+
+def _recheck_delay(entry, now):
+    # until the window reaches one more bucket, or a slower poll once it can't
+    if entry.window(now) >= MAX_WINDOW:
+        return MAX_WINDOW_RECHECK
+    return BUCKET_WIDTH / WINDOW_GROWTH
+
+
+def _pair(entry, other, now):
+    # the longer waiter's filters win
+    match_wait.observe(max(0.0, now - entry.joined_at))
+    match_wait.observe(max(0.0, now - other.joined_at))
+    first, second = (other, entry) if other.joined_at <= entry.joined_at else (entry, other)
+    return {
+        "players": [entry.username, other.username],
+        "difficulty": first.difficulty or second.difficulty,
+        "tag": first.tag or second.tag,
+    }
+
+
+class _Group:
+    # the waiting players with one set of filters, in rating buckets
+    __slots__ = ("buckets", "bucket_ids")
+
+    def __init__(self):
+        self.buckets: Dict[int, OrderedDict] = {}
+        self.bucket_ids: List[int] = []
+
+    def add(self, entry):
+        bucket = self.buckets.get(entry.bucket)
+        if bucket is None:
+            bucket = self.buckets[entry.bucket] = OrderedDict()
+            insort(self.bucket_ids, entry.bucket)
+        bucket[entry.username] = entry
+
+    def remove(self, entry):
+        bucket = self.buckets[entry.bucket]
+        del bucket[entry.username]
+        if not bucket:
+            del self.buckets[entry.bucket]
+            self.bucket_ids.pop(bisect_left(self.bucket_ids, entry.bucket))
+
+    def near(self, rating):
+        # the first SCAN_PER_BUCKET of every bucket within MAX_WINDOW
+        lo = bisect_left(self.bucket_ids, int((rating - MAX_WINDOW) // BUCKET_WIDTH))
+        for bucket_id in itertools.islice(self.bucket_ids, lo, None):
+            if bucket_id * BUCKET_WIDTH > rating + MAX_WINDOW:
+                break
+            yield from itertools.islice(self.buckets[bucket_id].values(), SCAN_PER_BUCKET)
+
+
+class MatchQueue:
+    def __init__(self):
+        self.entries: Dict[str, _Entry] = {}
+        self.groups: Dict[tuple, _Group] = {}
+        # (next re-check time, seq, username) with lazy deletion
+        self.rechecks = []
+        self.seq = itertools.count()
+
+    def __contains__(self, username):
+        return username in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _insert(self, entry):
+        self.entries[entry.username] = entry
+        group = self.groups.get(entry.group)
+        if group is None:
+            group = self.groups[entry.group] = _Group()
+        group.add(entry)
+        self._schedule(entry, entry.joined_at)
+
+    def _remove(self, entry):
+        del self.entries[entry.username]
+        group = self.groups[entry.group]
+        group.remove(entry)
+        if not group.buckets:
+            del self.groups[entry.group]
+
+    def _schedule(self, entry, now):
+        heapq.heappush(self.rechecks, (now + _recheck_delay(entry, now), next(self.seq), entry.username))
+
+    def _find(self, entry, now):
+        window = entry.window(now)
+        best, best_gap = None, None
+        for key, group in self.groups.items():
+            if not _compatible_groups(entry.group, key):
+                continue
+            for other in group.near(entry.rating):
+                if other is entry:
+                    continue
+                gap = abs(entry.rating - other.rating)
+                if gap > max(window, other.window(now)):
+                    continue
+                if best is None or gap < best_gap or (gap == best_gap and other.joined_at < best.joined_at):
+                    best, best_gap = other, gap
+        return best
+
+    def _pair(self, entry, other, now):
+        return _pair(entry, other, now)
+
+    def enqueue(self, username, difficulty=None, tag=None, now=None):
+        if username in self.entries:
+            return None
+        now = time.monotonic() if now is None else now
+        entry = _Entry(username, get_rating(username), now, difficulty, tag)
+
+        other = self._find(entry, now)
+        if other is not None:
+            self._remove(other)
+            return self._pair(entry, other, now)
+
+        self._insert(entry)
         return None
-    
-    if queue:
-        opponent = queue.pop(0)
-        match = [username, opponent]
-        matches.append(match)
-        return match
-    else:
-        queue.append(username)
+
+    def cancel(self, username):
+        entry = self.entries.get(username)
+        if entry is None:
+            return False
+        self._remove(entry)
+        return True
+
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        matches = []
+        while self.rechecks and self.rechecks[0][0] <= now:
+            _, _, username = heapq.heappop(self.rechecks)
+            entry = self.entries.get(username)
+            if entry is None:
+                continue
+            other = self._find(entry, now)
+            if other is None:
+                self._schedule(entry, now)
+                continue
+            self._remove(entry)
+            self._remove(other)
+            matches.append(self._pair(entry, other, now))
+        return matches
+
+
+class SharedMatchQueue:
+    # the same matching rules over the state backend. ratings live in a
+    # sorted set, so a lookup is one range query around the player's rating.
+    # ZREM only succeeds for one caller, which is how workers claim a
+    # waiting player without a lock. joined_at is wall-clock time here since
+    # workers don't share a monotonic clock.
+
+    async def _entries(self, usernames):
+        values = await _backend.hmget(ENTRIES_KEY, usernames)
+        return [_Entry.loads(name, data) for name, data in zip(usernames, values) if data]
+
+    async def _find(self, entry, now):
+        candidates = await _backend.zrangebyscore(
+            QUEUE_KEY, entry.rating - MAX_WINDOW, entry.rating + MAX_WINDOW, limit=SHARED_SCAN,
+        )
+        others = await self._entries([name for name, _ in candidates if name != entry.username])
+        fits = [
+            other for other in others
+            if _compatible(entry, other) and abs(entry.rating - other.rating) <= max(entry.window(now), other.window(now))
+        ]
+        fits.sort(key=lambda other: (abs(entry.rating - other.rating), other.joined_at))
+        for other in fits:
+            if await _backend.zrem(QUEUE_KEY, other.username):
+                await _backend.hdel(ENTRIES_KEY, other.username)
+                await _backend.zrem(RECHECKS_KEY, other.username)
+                return other
+        return None
+
+    async def _schedule(self, entry, now):
+        await _backend.zadd(RECHECKS_KEY, {entry.username: now + _recheck_delay(entry, now)})
+
+    async def enqueue(self, username, difficulty=None, tag=None, now=None):
+        if await _backend.hget(ENTRIES_KEY, username) is not None:
+            return None
+        now = time.time() if now is None else now
+        entry = _Entry(username, await fetch_rating(username), now, difficulty, tag)
+
+        other = await self._find(entry, now)
+        if other is not None:
+            return _pair(entry, other, now)
+
+        await _backend.hset(ENTRIES_KEY, {username: entry.dumps()})
+        await _backend.zadd(QUEUE_KEY, {username: entry.rating})
+        await self._schedule(entry, now)
         return None
-    
-    
-    
+
+    async def cancel(self, username):
+        removed = await _backend.zrem(QUEUE_KEY, username)
+        await _backend.hdel(ENTRIES_KEY, username)
+        await _backend.zrem(RECHECKS_KEY, username)
+        return bool(removed)
+
+    async def tick(self, now=None):
+        # every worker ticks; ZREM on the re-check decides who handles each one
+        now = time.time() if now is None else now
+        matches = []
+        due = await _backend.zrangebyscore(RECHECKS_KEY, float("-inf"), now, limit=SHARED_TICK_BATCH)
+        for username, _ in due:
+            if not await _backend.zrem(RECHECKS_KEY, username):
+                continue
+            entries = await self._entries([username])
+            if not entries:
+                continue
+            entry = entries[0]
+            # take ourselves out first so nobody else pairs us meanwhile
+            if not await _backend.zrem(QUEUE_KEY, username):
+                continue
+            other = await self._find(entry, now)
+            if other is None:
+                await _backend.zadd(QUEUE_KEY, {username: entry.rating})
+                await self._schedule(entry, now)
+                continue
+            await _backend.hdel(ENTRIES_KEY, username)
+            matches.append(_pair(entry, other, now))
+        return matches
+
+
+queue = SharedMatchQueue() if _backend.shared else MatchQueue()
+
+
+async def _queued():
+    # with a shared backend this counts every worker's players
+    if _backend.shared:
+        return await _backend.zcard(QUEUE_KEY)
+    return len(queue)
+
+
+metrics.Gauge("lcduel_queued_players", "Players waiting for a match", fn=_queued)
+
+# matches for players who may be polling POST /join rather than on a socket:
+# every player of a ticker match, and the waiting side of one made on enqueue
+unclaimed: Dict[str, tuple] = {}
+
+_handlers = []
+
+
+def on_match(handler):
+    # handler(match) is awaited for every match, however it was found
+    _handlers.append(handler)
+    return handler
+
+
+async def _dispatch(match):
+    for handler in _handlers:
+        try:
+            await handler(match)
+        except Exception:
+            log.exception("match handler failed", players="|".join(match["players"]))
+
+
+async def _hold(match, now, players=None):
+    for player in players or match["players"]:
+        if _backend.shared:
+            await _backend.set(f"lcduel:unclaimed:{player}", json.dumps(match), ttl=UNCLAIMED_TTL)
+        else:
+            unclaimed[player] = (match, now)
+
+
+async def release(username: str):
+    # returns the match waiting for this player, if any, and forgets it
+    if not _backend.shared:
+        claimed = unclaimed.pop(username, None)
+        return claimed[0] if claimed else None
+
+    key = f"lcduel:unclaimed:{username}"
+    data = await _backend.get(key)
+    if data and await _backend.delete(key):
+        return json.loads(data)
+    return None
+
+
+async def join(username: str, difficulty: str = None, tag: str = None):
+    claimed = await release(username)
+    if claimed:
+        return claimed
+
+    if _backend.shared:
+        match = await queue.enqueue(username, difficulty, tag)
+    else:
+        match = queue.enqueue(username, difficulty, tag)
+    if match:
+        # the newcomer gets the match as this call's answer; the player who
+        # was waiting hears about it on their next poll (or their socket)
+        waiting = [player for player in match["players"] if player != username]
+        await _hold(match, time.monotonic(), waiting)
+        await _dispatch(match)
+    return match
+
+
+async def cancel(username: str):
+    await release(username)
+    if _backend.shared:
+        return await queue.cancel(username)
+    return queue.cancel(username)
+
+
+async def run_ticker():
+    while True:
+        await asyncio.sleep(TICK_INTERVAL)
+        try:
+            if _backend.shared:
+                matches = await queue.tick()
+            else:
+                matches = queue.tick()
+        except Exception:
+            log.exception("tick failed")
+            continue
+
+        now = time.monotonic()
+        for match in matches:
+            await _hold(match, now)
+            await _dispatch(match)
+
+        # oldest first, so stop at the first one still fresh
+        while unclaimed:
+            player, (_, matched_at) = next(iter(unclaimed.items()))
+            if now - matched_at <= UNCLAIMED_TTL:
+                break
+            del unclaimed[player]
@@ -0,0 +1,174 @@
+import inspect
+import math
+from bisect import bisect_left
+
+#---------------------------------------------------------
+# Prometheus metrics, served as text by GET /metrics
+#
+# recording is a dict lookup and an add, so it's fine on the hot path.
+# counters and gauges can also be given a function instead, which is
+# called (or awaited) at scrape time; that's how sizes that already exist
+# somewhere (open sockets, cache hit counts) are exported without keeping
+# a second copy up to date.
+#
+#   runs = Histogram("lcduel_run_seconds", "...", ["via"], buckets=RUN_BUCKETS)
+#   runs.labels("ws").observe(1.2)
+#   errors = Counter("lcduel_judge0_errors_total", "...", ["reason"])
+#   errors.labels("429").inc()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn  # value (or {labels: value}) computed at scrape time
+        self.children = {}
+        if not self.labelnames and fn is None:
+            self.children[()] = self._child()
+        REGISTRY.append(self)
+
+    def _child(self):
+        return _Value()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            child = self.children[values] = self._child()
+        return child
+
+    async def _samples(self):
+        # [(suffix, label values, extra labels, value)]
+        if self.fn is not None:
+            value = self.fn()
+            if inspect.isawaitable(value):
+                value = await value
+            if not self.labelnames:
+                return [("", (), (), value)]
+            # labeled: the function returns {label value(s): value}
+            return [
+                ("", values if isinstance(values, tuple) else (values,), (), v)
+                for values, v in value.items()
+            ]
+        return [("", values, (), child.value) for values, child in self.children.items()]
+
+    async def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in await self._samples():
+            lines.append(f"{self.name}{suffix}{_labels(self.labelnames, values, extra)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def dec(self, amount=1):
+        self.children[()].dec(amount)
+
+    def set(self, value):
+        self.children[()].set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _child(self):
+        return _Buckets(self.bounds)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    async def _samples(self):
+        samples = []
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), child.counts):
+                cumulative += count
+                samples.append(("_bucket", values, (("le", _number(bound)),), cumulative))
+            samples.append(("_sum", values, (), child.sum))
+            samples.append(("_count", values, (), child.count))
+        return samples
+
+
+async def render():
+    lines = []
+    for metric in REGISTRY:
+        try:
+            lines.extend(await metric.render())
+        except Exception as e:
+            # one broken callback shouldn't take the whole scrape down
+            lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+    return "\n".join(lines) + "\n"
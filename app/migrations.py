@@ -0,0 +1,31 @@
+from sqlalchemy import text
+
+from app.database import engine, Base
+
+# idempotent schema changes for databases created before a column/index
+# existed; Base.metadata.create_all only creates missing tables
+MIGRATIONS = [
+    "ALTER TABLE problems ADD COLUMN IF NOT EXISTS description TEXT",
+    "ALTER TABLE problems ADD COLUMN IF NOT EXISTS link VARCHAR",
+    "ALTER TABLE problems ADD COLUMN IF NOT EXISTS checker VARCHAR",
+    # unique slug: drop duplicate rows first, keeping the oldest
+    "DELETE FROM problems a USING problems b WHERE a.slug = b.slug AND a.id > b.id",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_problems_slug ON problems (slug)",
+    "ALTER TABLE problems ALTER COLUMN testcases TYPE JSONB USING testcases::jsonb",
+    # difficulty / tag filters
+    "CREATE INDEX IF NOT EXISTS ix_problems_difficulty ON problems (lower(difficulty))",
+    "CREATE INDEX IF NOT EXISTS ix_problems_tags ON problems USING GIN (string_to_array(lower(tags), ','))",
+    "ANALYZE problems",
+]
+
+
+def migrate():
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in MIGRATIONS:
+            conn.execute(text(statement))
+    print(f"Applied {len(MIGRATIONS)} migrations")
+
+
+if __name__ == "__main__":
+    migrate()
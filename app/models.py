@@ -1,4 +1,6 @@
 from pydantic import BaseModel
 
 class JoinRequest(BaseModel):
-    username: str
\ No newline at end of file
+    username: str
+    difficulty: str | None = None
+    tag: str | None = None
\ No newline at end of file
@@ -0,0 +1,192 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlalchemy import event, select
+
+from app.database import Problem, use_session
+
+#---------------------------------------------------------
+# in-process selection index: problem ids bucketed by difficulty and tag
+#
+# picking a problem is random.choice on the matching bucket, so it costs the
+# same whatever the catalog size. only (id, slug, difficulty, tags) are ever
+# read from the DB, never the testcases blobs. a refresh rebuilds the buckets
+# off to the side and swaps them in, so re-ingested tags/difficulties and
+# deleted rows show up too, not just new ids.
+#
+# which problems each player has had is kept for the SEEN_USERS most recent
+# players, SEEN_PER_USER problems each.
+
+REFRESH_INTERVAL = 60.0  # seconds
+SEEN_USERS = int(os.getenv("SEEN_USERS", "50000"))
+SEEN_PER_USER = int(os.getenv("SEEN_PER_USER", "200"))
+# how many random draws to spend looking for a problem neither player has seen
+UNSEEN_ATTEMPTS = 16
+
+
+class _Bucket:
+    # list + position map: O(1) add, remove and random pick
+    __slots__ = ("ids", "pos")
+
+    def __init__(self):
+        self.ids = []
+        self.pos = {}
+
+    def add(self, problem_id):
+        if problem_id in self.pos:
+            return
+        self.pos[problem_id] = len(self.ids)
+        self.ids.append(problem_id)
+
+    def remove(self, problem_id):
+        idx = self.pos.pop(problem_id, None)
+        if idx is None:
+            return
+        last = self.ids.pop()
+        if last != problem_id:
+            self.ids[idx] = last
+            self.pos[last] = idx
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _split_tags(tags):
+    return [tag.strip() for tag in (tags or "").split(",") if tag.strip()]
+
+
+class ProblemIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slugs = {}  # id -> slug
+        self.keys = {}  # id -> bucket keys it's in
+        self.buckets = {}  # (difficulty|None, tag|None) -> _Bucket
+        self.refreshed_at = 0.0
+
+    def add(self, problem_id, slug, difficulty, tags):
+        difficulty = (difficulty or "").lower() or None
+        tags = [tag.lower() for tag in _split_tags(tags)]
+        keys = [(None, None), (difficulty, None)]
+        for tag in tags:
+            keys.append((None, tag))
+            keys.append((difficulty, tag))
+
+        with self.lock:
+            self._remove(problem_id)
+            self.slugs[problem_id] = slug
+            self.keys[problem_id] = keys
+            for key in keys:
+                self.buckets.setdefault(key, _Bucket()).add(problem_id)
+
+    def remove(self, problem_id):
+        with self.lock:
+            self._remove(problem_id)
+
+    def _remove(self, problem_id):
+        for key in self.keys.pop(problem_id, ()):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.remove(problem_id)
+                if not bucket:
+                    del self.buckets[key]
+        self.slugs.pop(problem_id, None)
+
+    async def refresh(self, db=None):
+        # picks keep using the old buckets until the new ones are complete
+        async with use_session(db) as session:
+            rows = (await session.execute(
+                select(Problem.id, Problem.slug, Problem.difficulty, Problem.tags)
+            )).all()
+
+        fresh = ProblemIndex()
+        for row in rows:
+            fresh.add(row.id, row.slug, row.difficulty, row.tags)
+        with self.lock:
+            self.slugs, self.keys, self.buckets = fresh.slugs, fresh.keys, fresh.buckets
+        self.refreshed_at = time.monotonic()
+        return len(rows)
+
+    def stale(self):
+        return time.monotonic() - self.refreshed_at > REFRESH_INTERVAL
+
+    def pick(self, difficulty=None, tag=None, exclude=()):
+        # returns (id, slug) or None if nothing matches the filters;
+        # exclude is a list of id sets (one per player) to avoid
+        key = ((difficulty or "").lower() or None, (tag or "").lower() or None)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if not bucket:
+                return None
+            problem_id = random.choice(bucket.ids)
+            # rejection sampling keeps this O(1); once nearly everything in
+            # the bucket has been seen we give up on freshness instead of scanning
+            for _ in range(UNSEEN_ATTEMPTS):
+                if not any(problem_id in ids for ids in exclude):
+                    break
+                problem_id = random.choice(bucket.ids)
+            return problem_id, self.slugs[problem_id]
+
+    def __len__(self):
+        return len(self.slugs)
+
+
+index = ProblemIndex()
+
+
+class _Recent:
+    # the last SEEN_PER_USER problem ids, in order and as a set for lookups
+    __slots__ = ("order", "ids")
+
+    def __init__(self):
+        self.order = deque()
+        self.ids = set()
+
+    def add(self, problem_id):
+        if problem_id in self.ids:
+            return
+        self.order.append(problem_id)
+        self.ids.add(problem_id)
+        if len(self.order) > SEEN_PER_USER:
+            self.ids.discard(self.order.popleft())
+
+
+# username -> problems they've been matched on, least recently matched first
+_seen = OrderedDict()
+
+
+def seen_by(*usernames):
+    return [_seen[username].ids for username in usernames if username in _seen]
+
+
+def record_seen(usernames, problem_id):
+    for username in usernames:
+        recent = _seen.get(username)
+        if recent is None:
+            recent = _seen[username] = _Recent()
+        else:
+            _seen.move_to_end(username)
+        recent.add(problem_id)
+    while len(_seen) > SEEN_USERS:
+        _seen.popitem(last=False)
+
+
+# ---------------------------
+#  keep the index in sync with rows written by this process
+# ---------------------------
+@event.listens_for(Problem, "after_insert")
+def _problem_inserted(mapper, connection, target):
+    index.add(target.id, target.slug, target.difficulty, target.tags)
+
+
+@event.listens_for(Problem, "after_update")
+def _problem_updated(mapper, connection, target):
+    if target.id in index.slugs:
+        index.add(target.id, target.slug, target.difficulty, target.tags)
+
+
+@event.listens_for(Problem, "after_delete")
+def _problem_deleted(mapper, connection, target):
+    index.remove(target.id)
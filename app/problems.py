@@ -1,44 +1,202 @@
-import random
-import requests
-from app.database import SessionLocal, Problem
+import asyncio
+import os
+from collections import OrderedDict
 
-def get_problem_for_match():
-    db = SessionLocal()
+from sqlalchemy import select
 
-    # get all problems
-    problems = db.query(Problem).all()
-    if not problems:
-        db.close()
-        return {"error": "No problems found in database"}
+from app.database import Problem, use_session
+from app.log import get_logger
+from app.problem_index import index, seen_by, record_seen
 
-    chosen = random.choice(problems)
-    db.close()
+PROBLEM_API_URL = "https://alfa-leetcode-api.onrender.com/select"
+PROBLEM_API_TIMEOUT = 10.0
+PENDING_DESCRIPTION = "Loading description..."
 
-    url = f"https://alfa-leetcode-api.onrender.com/select?titleSlug={chosen.slug}"
-    print(f"Fetching: {url}") 
+# hot problem statements, slug -> payload sent to players
+HOT_PROBLEMS = int(os.getenv("HOT_PROBLEMS", "256"))
+_hot = OrderedDict()
 
-    try:
-        res = requests.get(url, timeout=10)
-        data = res.json()
-
-        if res.status_code == 200:
-            return {
-                "slug": chosen.slug, 
-                "title": data.get("questionTitle", chosen.title),
-                "difficulty": data.get("difficulty", chosen.difficulty),
-                "tags": [tag["name"] for tag in data.get("topicTags", [])],
-                "description": data.get("question", "No description available"),
-                "link": data.get("link", f"https://leetcode.com/problems/{chosen.slug}/")
-            }
-        else:
-            return {
-                "slug": chosen.slug,  
-                "error": f"API error {res.status_code}", 
-                "details": data
-            }
+# slug -> task filling a statement that isn't stored yet
+_filling = {}
+
+# the index refresh in flight, shared by everyone who finds the index stale
+_refreshing = None
+
+_http = None
+
+log = get_logger("problems")
+
+
+def _get_http():
+    global _http
+    if _http is None:
+        import httpx  # only once a statement has to be fetched
+
+        _http = httpx.AsyncClient(timeout=PROBLEM_API_TIMEOUT)
+    return _http
+
+
+async def close():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+
+def _remember(payload):
+    _hot[payload["slug"]] = payload
+    _hot.move_to_end(payload["slug"])
+    while len(_hot) > HOT_PROBLEMS:
+        _hot.popitem(last=False)
+
+
+def forget(slug):
+    _hot.pop(slug, None)
+
+
+def to_payload(problem):
+    return {
+        "slug": problem.slug,
+        "title": problem.title,
+        "difficulty": problem.difficulty,
+        "tags": [tag for tag in (problem.tags or "").split(",") if tag],
+        "description": problem.description or PENDING_DESCRIPTION,
+        "link": problem.link or f"https://leetcode.com/problems/{problem.slug}/",
+    }
+
+
+def statement_fields(slug, data):
+    # Problem columns from an alfa-leetcode-api /select response; title,
+    # difficulty and tags only when the response has them
+    fields = {
+        "description": data.get("question") or "No description available",
+        "link": data.get("link") or f"https://leetcode.com/problems/{slug}/",
+    }
+    if data.get("questionTitle"):
+        fields["title"] = data["questionTitle"]
+    if data.get("difficulty"):
+        fields["difficulty"] = data["difficulty"]
+    tags = [tag["name"] for tag in data.get("topicTags") or []]
+    if tags:
+        fields["tags"] = ",".join(tags)
+    return fields
+
+
+def apply_statement(problem, data):
+    # copy an alfa-leetcode-api /select response onto a Problem row
+    for column, value in statement_fields(problem.slug, data).items():
+        setattr(problem, column, value)
+
+
+# ---------------------------
+#  DB helpers (async session from the request, or a fresh one)
+# ---------------------------
+async def _load_problem(slug, db=None):
+    async with use_session(db) as session:
+        problem = await session.scalar(select(Problem).where(Problem.slug == slug).limit(1))
+        return to_payload(problem) if problem else None
 
+
+async def _store_statement(slug, data):
+    async with use_session() as session:
+        problem = await session.scalar(select(Problem).where(Problem.slug == slug).limit(1))
+        if not problem:
+            return None
+        apply_statement(problem, data)
+        await session.commit()
+        return to_payload(problem)
+
+
+# ---------------------------
+#  statements
+# ---------------------------
+async def get_statement(slug, db=None):
+    # local only: hot LRU, then the DB. a missing statement comes back with
+    # "pending": True and can be filled with fill_statement()
+    payload = _hot.get(slug)
+    if payload is not None:
+        _hot.move_to_end(slug)
+        return payload
+
+    payload = await _load_problem(slug, db)
+    if payload is None:
+        return None
+    if payload["description"] == PENDING_DESCRIPTION:
+        return {**payload, "pending": True}
+    _remember(payload)
+    return payload
+
+
+async def _fetch_and_store(slug):
+    log.debug("fetching statement", slug=slug)
+    try:
+        res = await _get_http().get(PROBLEM_API_URL, params={"titleSlug": slug})
+        if res.status_code != 200:
+            log.warning("statement fetch failed", slug=slug, status=res.status_code)
+            return None
+        payload = await _store_statement(slug, res.json())
     except Exception as e:
-        return {
-            "slug": chosen.slug, 
-            "error": str(e)
-        }
\ No newline at end of file
+        log.warning("statement fetch failed", slug=slug, error=repr(e))
+        return None
+
+    if payload:
+        _remember(payload)
+    return payload
+
+
+async def fill_statement(slug):
+    # concurrent matches on the same unstored problem share one fetch
+    task = _filling.get(slug)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_and_store(slug))
+        _filling[slug] = task
+        task.add_done_callback(lambda t: _filling.pop(slug, None))
+    return await asyncio.shield(task)
+
+
+def _refreshed(task):
+    global _refreshing
+    _refreshing = None
+    if not task.cancelled() and task.exception() is not None:
+        log.warning("index refresh failed", error=repr(task.exception()))
+
+
+def _start_refresh():
+    # runs on its own session: it can outlive the request that started it
+    global _refreshing
+    if _refreshing is None:
+        _refreshing = asyncio.ensure_future(index.refresh())
+        _refreshing.add_done_callback(_refreshed)
+    return _refreshing
+
+
+async def refresh_index():
+    return await asyncio.shield(_start_refresh())
+
+
+async def get_problem_for_match(difficulty=None, tag=None, players=(), db=None):
+    # O(1) pick from the in-process index, preferring a problem none of
+    # the players has had before
+    if not len(index):
+        await refresh_index()
+    elif index.stale():
+        _start_refresh()
+
+    picked = index.pick(difficulty, tag, exclude=seen_by(*players))
+    if not picked:
+        if difficulty or tag:
+            return {"error": f"No problems found for difficulty={difficulty} tag={tag}"}
+        return {"error": "No problems found in database"}
+
+    problem_id, slug = picked
+    record_seen(players, problem_id)
+
+    payload = await get_statement(slug, db)
+    if payload is None:
+        # deleted by another process since we indexed it
+        index.remove(problem_id)
+        return await get_problem_for_match(difficulty, tag, players, db)
+    if payload.get("pending"):
+        # let the match start now; the statement arrives later
+        asyncio.ensure_future(fill_statement(slug))
+    return payload
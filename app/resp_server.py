@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import fnmatch
+
+from app.state import InMemoryBackend, RedisError, _encode, _read_reply
+
+#---------------------------------------------------------
+# tiny stand-in for a Redis server, backed by InMemoryBackend
+#
+# speaks just the commands app/state.py uses, so several workers (and the
+# benchmarks) can share state without installing Redis:
+#   python -m app.resp_server --port 6390
+#   STATE_BACKEND=redis REDIS_URL=redis://localhost:6390/0 uvicorn ...
+
+
+def _reply(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RedisError):
+        return b"-%s\r\n" % str(value).encode()
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(_reply(item) for item in value)
+    data = str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def _parse_score(value):
+    if value in ("-inf", "+inf", "inf"):
+        return float(value.replace("+", ""))
+    return float(value)
+
+
+class RespServer:
+    def __init__(self):
+        self.store = InMemoryBackend()
+        self.subscribers = {}  # pattern -> set of writers
+
+    async def handle(self, reader, writer):
+        queued = None  # commands between MULTI and EXEC
+        try:
+            while True:
+                try:
+                    command = await _read_reply(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    break
+                if not isinstance(command, list) or not command:
+                    continue
+                name, args = command[0].upper(), command[1:]
+                if name == "MULTI":
+                    queued = []
+                    writer.write(b"+OK\r\n")
+                elif name == "EXEC" and queued is not None:
+                    # the store never yields, so the whole batch runs at once
+                    replies = [await self._run(queued_name, queued_args, writer) for queued_name, queued_args in queued]
+                    queued = None
+                    writer.write(b"*%d\r\n" % len(replies) + b"".join(replies))
+                elif queued is not None:
+                    queued.append((name, args))
+                    writer.write(b"+QUEUED\r\n")
+                else:
+                    writer.write(await self._run(name, args, writer))
+                await writer.drain()
+        finally:
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
+
+    async def _run(self, name, args, writer):
+        try:
+            return await self.dispatch(name, args, writer)
+        except Exception as e:
+            return b"-ERR %s\r\n" % str(e).encode()
+
+    async def dispatch(self, name, args, writer):
+        store = self.store
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name in ("SELECT", "AUTH"):
+            return b"+OK\r\n"
+        if name == "GET":
+            return _reply(await store.get(args[0]))
+        if name == "SET":
+            key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+            ttl = None
+            if "PX" in options:
+                ttl = int(args[2 + options.index("PX") + 1]) / 1000
+            elif "EX" in options:
+                ttl = int(args[2 + options.index("EX") + 1])
+            ok = await store.set(key, value, ttl=ttl, nx="NX" in options)
+            return b"+OK\r\n" if ok else _reply(None)
+        if name == "DEL":
+            return _reply(await store.delete(*args))
+        if name == "HSET":
+            return _reply(await store.hset(args[0], dict(zip(args[1::2], args[2::2]))))
+        if name == "HGET":
+            return _reply(await store.hget(args[0], args[1]))
+        if name == "HEXISTS":
+            return _reply(await store.hget(args[0], args[1]) is not None)
+        if name == "HMGET":
+            return _reply(await store.hmget(args[0], args[1:]))
+        if name == "HGETALL":
+            flat = []
+            for field, value in (await store.hgetall(args[0])).items():
+                flat += [field, value]
+            return _reply(flat)
+        if name == "HDEL":
+            return _reply(await store.hdel(args[0], *args[1:]))
+        if name == "HINCRBYFLOAT":
+            return _reply(repr(await store.hincrbyfloat(args[0], args[1], float(args[2]))))
+        if name == "ZADD":
+            return _reply(await store.zadd(args[0], {m: float(s) for s, m in zip(args[1::2], args[2::2])}))
+        if name == "ZREM":
+            return _reply(await store.zrem(args[0], *args[1:]))
+        if name == "ZCARD":
+            return _reply(await store.zcard(args[0]))
+        if name == "ZRANGEBYSCORE":
+            options = [a.upper() for a in args[3:]]
+            limit = int(args[3 + options.index("LIMIT") + 2]) if "LIMIT" in options else None
+            items = await store.zrangebyscore(args[0], _parse_score(args[1]), _parse_score(args[2]), limit)
+            flat = []
+            for member, score in items:
+                flat += [member] + ([repr(score)] if "WITHSCORES" in options else [])
+            return _reply(flat)
+        if name == "PUBLISH":
+            channel, message = args
+            receivers = 0
+            for pattern, writers in self.subscribers.items():
+                if fnmatch.fnmatchcase(channel, pattern):
+                    frame = _encode("pmessage", pattern, channel, message)
+                    for subscriber in writers:
+                        subscriber.write(frame)
+                        receivers += 1
+            return _reply(receivers)
+        if name in ("PSUBSCRIBE", "SUBSCRIBE"):
+            out = b""
+            for i, pattern in enumerate(args, 1):
+                self.subscribers.setdefault(pattern, set()).add(writer)
+                out += _reply([name.lower(), pattern, i])
+            return out
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+
+async def serve(host="127.0.0.1", port=6390):
+    server = await asyncio.start_server(RespServer().handle, host, port)
+    print(f"RESP stand-in listening on {host}:{port}")
+    return server
+
+
+async def _main(host, port):
+    server = await serve(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(_main(args.host, args.port))
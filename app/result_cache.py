@@ -0,0 +1,145 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+
+from app.database import Problem
+
+#---------------------------------------------------------
+# verdict cache for repeated runs of unchanged code
+#
+# entries are per test case and keyed by
+#   (slug, hash(slug, language, normalized source), hash(case input + expected + checker))
+# so a verdict is only served for the same case judged the same way; rows
+# for a problem are also dropped as soon as its testcases or checker column
+# is updated here, or another process announces it changed (runner.forget).
+
+CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "20000"))
+CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "900"))  # seconds
+
+# these depend on Judge0 / the box, not on the code, so they're never cached
+UNCACHEABLE_STATUSES = {
+    "Submission Error", "Timeout", "Error", "Unavailable", "Skipped",
+    "Internal Error", "Time Limit Exceeded",
+}
+
+
+def normalize_source(code):
+    # trailing whitespace and line endings don't change what the code does
+    lines = [line.rstrip() for line in code.replace("\r\n", "\n").split("\n")]
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines)
+
+
+def source_key(slug, language, code):
+    digest = hashlib.sha256()
+    for part in (slug, language or "", normalize_source(code)):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def case_key(case):
+    digest = hashlib.sha256()
+    digest.update(case["input"].strip().encode())
+    digest.update(b"\0")
+    digest.update(case["expected_output"].strip().encode())
+    check = case.get("check")
+    if check is not None:
+        digest.update(b"\0")
+        digest.update(f"{check.mode}:{check.tolerance}:{check.custom}".encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, result)
+        self.by_slug = {}  # slug -> set of keys, for invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, slug, src_key, case):
+        key = (slug, src_key, case_key(case))
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, slug, src_key, case, result):
+        if result["status"] in UNCACHEABLE_STATUSES:
+            return
+        key = (slug, src_key, case_key(case))
+        self.entries[key] = (time.monotonic() + self.ttl, result)
+        self.entries.move_to_end(key)
+        self.by_slug.setdefault(slug, set()).add(key)
+        while len(self.entries) > self.maxsize:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, slug):
+        for key in self.by_slug.pop(slug, ()):
+            self.entries.pop(key, None)
+        self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.by_slug.clear()
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        keys = self.by_slug.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_slug[key[0]]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            # every hit is one test case we didn't send to the executor
+            "executions_saved": self.hits,
+        }
+
+
+cache = ResultCache()
+
+
+# ---------------------------
+#  drop a problem's verdicts when its test cases or checker change
+# ---------------------------
+@event.listens_for(Problem, "after_update")
+def _problem_updated(mapper, connection, target):
+    state = inspect(target)
+    if (state.attrs.testcases.history.has_changes() or state.attrs.slug.history.has_changes()
+            or state.attrs.checker.history.has_changes()):
+        cache.invalidate(target.slug)
+        for old_slug in state.attrs.slug.history.deleted:
+            cache.invalidate(old_slug)
+
+
+@event.listens_for(Problem, "after_delete")
+def _problem_deleted(mapper, connection, target):
+    cache.invalidate(target.slug)
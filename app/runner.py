@@ -0,0 +1,159 @@
+import json
+import os
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect, select
+
+from app import checker, metrics, problems
+from app.executor import get_executor, error_result
+from app.database import Problem, use_session
+from app.log import get_logger
+from app.result_cache import cache, source_key
+from app.state import get_backend
+
+# test cases of problems in (or just out of) a duel, slug -> list, each with
+# its parsed expected output (app/checker.py); filled at duel start so the
+# first run doesn't touch the DB
+PRELOADED_PROBLEMS = int(os.getenv("PRELOADED_PROBLEMS", "512"))
+_testcases = OrderedDict()
+
+# slugs whose rows were rewritten by another process (fetch_problems, or
+# anything else that calls announce_changes), to every worker
+CHANGES_CHANNEL = "lcduel:problem-changes"
+
+log = get_logger("runner")
+
+testcase_cache = metrics.Counter("lcduel_testcase_cache_total", "Test case lookups by outcome", ["result"])
+metrics.Counter(
+    "lcduel_result_cache_total", "Per-case verdict cache lookups by outcome", ["result"],
+    fn=lambda: {"hit": cache.hits, "miss": cache.misses},
+)
+
+
+async def load_testcases(slug, db=None):
+    # None when the problem doesn't exist
+    testcases = _testcases.get(slug)
+    if testcases is not None:
+        _testcases.move_to_end(slug)
+        testcase_cache.labels("hit").inc()
+        return testcases
+    testcase_cache.labels("miss").inc()
+
+    async with use_session(db) as session:
+        row = (await session.execute(
+            select(Problem.id, Problem.testcases, Problem.checker).where(Problem.slug == slug).limit(1)
+        )).first()
+        # hand the connection back before judging, which can take seconds
+        await session.rollback()
+    if not row:
+        return None
+
+    # expected outputs are parsed here, once per load, not per run
+    try:
+        testcases = checker.prepare(row.testcases or [], row.checker)
+    except ValueError as e:
+        log.warning("bad checker, using auto", slug=slug, error=str(e))
+        testcases = checker.prepare(row.testcases or [])
+    _testcases[slug] = testcases
+    while len(_testcases) > PRELOADED_PROBLEMS:
+        _testcases.popitem(last=False)
+    return testcases
+
+
+async def preload(slug):
+    try:
+        await load_testcases(slug)
+    except Exception as e:
+        log.warning("preloading failed", slug=slug, error=repr(e))
+
+
+async def run_submission(slug, code, language, duel_key=None, on_start=None, on_result=None, fail_fast=False, db=None):
+    # shared by POST /run and the websocket "run" message;
+    # returns None when the problem doesn't exist
+    testcases = await load_testcases(slug, db)
+    if testcases is None:
+        return None
+
+    if on_start:
+        await on_start(len(testcases))
+
+    # serve unchanged code's verdicts from the cache, only run the rest
+    src_key = source_key(slug, language, code)
+    results = [cache.get(slug, src_key, case) for case in testcases]
+    pending = [idx for idx, result in enumerate(results) if result is None]
+
+    reported = set()
+    for idx, result in enumerate(results):
+        if result is None:
+            continue
+        reported.add(idx)
+        if on_result:
+            await on_result(idx, result)
+        if fail_fast and not result["passed"]:
+            # a cached failure already decides the run
+            for other in range(len(testcases)):
+                if other not in reported:
+                    results[other] = error_result(testcases[other], "Skipped after an earlier failure", "Skipped")
+            return results
+
+    if pending:
+        async def report(sub_idx, result):
+            if on_result:
+                await on_result(pending[sub_idx], result)
+
+        fresh = await get_executor().run(
+            [testcases[idx] for idx in pending], code, language,
+            duel_key=duel_key, on_result=report, fail_fast=fail_fast,
+        )
+        for idx, result in zip(pending, fresh):
+            results[idx] = result
+            cache.put(slug, src_key, testcases[idx], result)
+
+    return results
+
+
+# ---------------------------
+#  drop preloaded cases when a problem changes
+# ---------------------------
+@event.listens_for(Problem, "after_update")
+def _problem_updated(mapper, connection, target):
+    state = inspect(target)
+    if (state.attrs.testcases.history.has_changes() or state.attrs.slug.history.has_changes()
+            or state.attrs.checker.history.has_changes()):
+        _testcases.pop(target.slug, None)
+        for old_slug in state.attrs.slug.history.deleted:
+            _testcases.pop(old_slug, None)
+
+
+@event.listens_for(Problem, "after_delete")
+def _problem_deleted(mapper, connection, target):
+    _testcases.pop(target.slug, None)
+
+
+# ---------------------------
+#  ... and when another process changed it
+# ---------------------------
+def forget(slugs):
+    # preloaded cases, verdicts and statements of these problems
+    for slug in slugs:
+        _testcases.pop(slug, None)
+        cache.invalidate(slug)
+        problems.forget(slug)
+
+
+async def announce_changes(slugs):
+    # the writer calls this once its rows are committed; with a shared
+    # backend (STATE_BACKEND=redis) every worker drops its copies
+    slugs = list(slugs)
+    forget(slugs)
+    backend = get_backend()
+    if slugs and backend.shared:
+        await backend.publish(CHANGES_CHANNEL, json.dumps(slugs))
+
+
+async def _on_changes(channel, message):
+    forget(json.loads(message))
+
+
+async def start():
+    await get_backend().subscribe(CHANGES_CHANNEL, _on_changes)
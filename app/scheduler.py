@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from app.log import get_logger
+
+#---------------------------------------------------------
+# hashed timer wheel: one task owns every duel deadline
+#
+# deadlines are rounded to RESOLUTION-second ticks and dropped into
+# slot (tick % SLOTS), so schedule, cancel and reschedule are dict
+# operations. each tick only looks at its own slot; anything parked there
+# for a later lap of the wheel stays put. deadlines are wall-clock
+# (time.time()) so they can be persisted and recovered after a restart.
+# overtime and pause are a reschedule and a cancel (app/websocket/endpoint.py),
+# with the seconds left kept in the duel record.
+
+RESOLUTION = 1.0  # seconds
+SLOTS = 4096
+
+log = get_logger("scheduler")
+
+
+class TimerWheel:
+    def __init__(self, callback, resolution=RESOLUTION, slots=SLOTS):
+        self.callback = callback  # awaited with the key once it's due
+        self.resolution = resolution
+        self.slots = [{} for _ in range(slots)]
+        self.where = {}  # key -> slot index
+        self.cursor = None  # last tick handled
+        self.task = None
+
+    def _tick(self, deadline):
+        return int(deadline // self.resolution)
+
+    def _now_tick(self):
+        if self.cursor is None:
+            self.cursor = self._tick(time.time()) - 1
+        return self.cursor
+
+    def schedule(self, key, deadline):
+        # also used to reschedule; past deadlines fire on the next tick
+        self.cancel(key)
+        tick = max(self._tick(deadline), self._now_tick() + 1)
+        idx = tick % len(self.slots)
+        self.slots[idx][key] = (tick, deadline)
+        self.where[key] = idx
+
+    def cancel(self, key):
+        idx = self.where.pop(key, None)
+        if idx is None:
+            return None
+        return self.slots[idx].pop(key)[1]
+
+    def deadline(self, key):
+        idx = self.where.get(key)
+        return None if idx is None else self.slots[idx][key][1]
+
+    def __len__(self):
+        return len(self.where)
+
+    def _expire(self, tick):
+        slot = self.slots[tick % len(self.slots)]
+        due = [key for key, (at, _) in slot.items() if at <= tick]
+        for key in due:
+            del slot[key]
+            del self.where[key]
+            asyncio.create_task(self._fire(key))
+
+    async def _fire(self, key):
+        try:
+            await self.callback(key)
+        except Exception:
+            log.exception("timer failed", key=key)
+
+    async def _run(self):
+        while True:
+            now_tick = self._tick(time.time())
+            # after a long stall one lap of the wheel covers every slot
+            cursor = max(self._now_tick(), now_tick - len(self.slots))
+            while cursor < now_tick:
+                cursor += 1
+                self.cursor = cursor
+                self._expire(cursor)
+            await asyncio.sleep(max(0.0, (self.cursor + 1) * self.resolution - time.time()))
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
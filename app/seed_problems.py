@@ -88,6 +88,7 @@ def seed_problems():
         Problem(
             title="Group Anagrams",
             slug="group-anagrams",
+            checker="unordered",
             difficulty="Medium",
             tags="Hash Map",
             testcases=[
@@ -98,6 +99,7 @@ def seed_problems():
         Problem(
             title="3Sum",
             slug="3sum",
+            checker="unordered",
             difficulty="Medium",
             tags="Two Pointers",
             testcases=[
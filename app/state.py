@@ -0,0 +1,446 @@
+import asyncio
+import fnmatch
+import os
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from app.log import get_logger
+
+#---------------------------------------------------------
+# shared state + pub/sub for running more than one uvicorn worker
+#
+# STATE_BACKEND=memory (default): everything lives in this process.
+# STATE_BACKEND=redis: REDIS_URL (redis://host:port/db) holds duel records,
+#   the matchmaking queue and ratings, and carries socket deliveries between
+#   workers. any server speaking the Redis protocol works, including the
+#   stand-in in app/resp_server.py.
+#
+# the interface is a small subset of Redis commands so both backends
+# behave the same way:
+#   get/set(ttl)/delete      key/value, delete returns how many keys it removed
+#   hset/hget/hmget/hgetall/hdel/hincrbyfloat
+#   hset_existing            hset into a hash only while it has a given
+#                            field, so a write racing a delete can't leave
+#                            a stub behind; False if nothing was written
+#   zadd/zrem/zrangebyscore  zrem returns 1 only for the caller that removed
+#                            the member, which makes it a safe claim
+#   zcard                    members in a sorted set, without reading them
+#   publish/subscribe
+
+
+class StateBackend:
+    shared = False
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+log = get_logger("state")
+
+
+# ---------------------------
+#  in-process backend
+# ---------------------------
+class InMemoryBackend(StateBackend):
+    def __init__(self):
+        self.values = {}  # key -> (value, expires_at | None)
+        self.hashes = {}
+        self.zsets = {}
+        self.handlers = {}  # channel -> [handler]
+
+    def _live(self, key):
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry[0]
+
+    async def get(self, key):
+        return self._live(key)
+
+    async def set(self, key, value, ttl=None, nx=False):
+        if nx and self._live(key) is not None:
+            return False
+        self.values[key] = (str(value), time.monotonic() + ttl if ttl else None)
+        return True
+
+    async def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._live(key) is not None:
+                del self.values[key]
+                removed += 1
+            removed += self.hashes.pop(key, None) is not None
+            removed += self.zsets.pop(key, None) is not None
+        return removed
+
+    async def hset(self, key, mapping):
+        fields = self.hashes.setdefault(key, {})
+        added = sum(1 for field in mapping if field not in fields)
+        fields.update({field: str(value) for field, value in mapping.items()})
+        return added
+
+    async def hset_existing(self, key, mapping, field):
+        if field not in self.hashes.get(key, {}):
+            return False
+        await self.hset(key, mapping)
+        return True
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hmget(self, key, fields):
+        values = self.hashes.get(key, {})
+        return [values.get(field) for field in fields]
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def hdel(self, key, *fields):
+        values = self.hashes.get(key, {})
+        removed = sum(1 for field in fields if values.pop(field, None) is not None)
+        if key in self.hashes and not values:
+            del self.hashes[key]
+        return removed
+
+    async def hincrbyfloat(self, key, field, amount):
+        values = self.hashes.setdefault(key, {})
+        value = float(values.get(field, 0)) + amount
+        values[field] = repr(value)
+        return value
+
+    async def zadd(self, key, mapping):
+        zset = self.zsets.setdefault(key, {})
+        added = sum(1 for member in mapping if member not in zset)
+        zset.update({member: float(score) for member, score in mapping.items()})
+        return added
+
+    async def zrem(self, key, *members):
+        zset = self.zsets.get(key, {})
+        removed = sum(1 for member in members if zset.pop(member, None) is not None)
+        if key in self.zsets and not zset:
+            del self.zsets[key]
+        return removed
+
+    async def zrangebyscore(self, key, low, high, limit=None):
+        zset = self.zsets.get(key, {})
+        items = sorted((score, member) for member, score in zset.items() if low <= score <= high)
+        if limit is not None:
+            items = items[:limit]
+        return [(member, score) for score, member in items]
+
+    async def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    async def publish(self, channel, message):
+        receivers = 0
+        for pattern, handlers in self.handlers.items():
+            if fnmatch.fnmatchcase(channel, pattern):
+                for handler in handlers:
+                    await handler(channel, message)
+                    receivers += 1
+        return receivers
+
+    async def subscribe(self, channel, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+
+# ---------------------------
+#  Redis protocol (RESP2) backend
+# ---------------------------
+class RedisError(Exception):
+    pass
+
+
+def _encode(*args):
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, float):
+            data = repr(arg).encode()
+        else:
+            data = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+async def _read_reply(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("redis connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2].decode()
+    if kind == b"*":
+        size = int(rest)
+        if size < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(size)]
+    raise RedisError(f"bad reply: {line!r}")
+
+
+# the SUBSCRIBE connection reconnects after a drop, waiting this long
+# (doubling up to the cap) between attempts. messages published while it's
+# down are lost, as with any Redis pub/sub.
+RECONNECT_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
+
+
+class RedisBackend(StateBackend):
+    # one pipelined command connection (replies come back in order, so
+    # concurrent callers just queue a future each) plus one connection
+    # dedicated to SUBSCRIBE
+    shared = True
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.password = parsed.password
+        self.reader = self.writer = None
+        self.pending = deque()
+        self.read_task = None
+        self.connect_lock = asyncio.Lock()
+        self.handlers = {}
+        self.sub_writer = None
+        self.sub_task = None
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        for command in ([("AUTH", self.password)] if self.password else []) + [("SELECT", self.db)]:
+            writer.write(_encode(*command))
+            await writer.drain()
+            reply = await _read_reply(reader)
+            if isinstance(reply, RedisError):
+                raise reply
+        return reader, writer
+
+    async def start(self):
+        async with self.connect_lock:
+            if self.writer is None:
+                self.reader, self.writer = await self._open()
+                self.read_task = asyncio.create_task(self._read_loop())
+
+    async def close(self):
+        for task in (self.read_task, self.sub_task):
+            if task:
+                task.cancel()
+        for writer in (self.writer, self.sub_writer):
+            if writer:
+                writer.close()
+        self.reader = self.writer = self.sub_writer = None
+        self.read_task = self.sub_task = None
+
+    async def _read_loop(self):
+        error = ConnectionError("redis connection lost")
+        try:
+            while True:
+                reply = await _read_reply(self.reader)
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_result(reply)
+        except asyncio.CancelledError:
+            error = ConnectionError("redis backend closed")
+            raise
+        except (OSError, asyncio.IncompleteReadError) as e:
+            error = ConnectionError(f"redis connection lost: {e}")
+        finally:
+            # fail everyone still waiting; the next command reconnects
+            while self.pending:
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+            self.reader = self.writer = None
+
+    async def execute(self, *args):
+        return (await self.execute_many(args))[0]
+
+    async def execute_many(self, *commands):
+        # written in one go, so nothing else on the connection lands between
+        # them (what makes MULTI ... EXEC safe on a shared connection)
+        if self.writer is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in commands]
+        self.pending.extend(futures)
+        self.writer.write(b"".join(_encode(*args) for args in commands))
+        await self.writer.drain()
+        replies = await asyncio.gather(*futures)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def transaction(self, *commands):
+        # MULTI ... EXEC: the commands' replies, run with nothing in between
+        replies = await self.execute_many(("MULTI",), *commands, ("EXEC",))
+        if replies[-1] is None:
+            raise RedisError("transaction aborted")
+        for reply in replies[-1]:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies[-1]
+
+    async def get(self, key):
+        return await self.execute("GET", key)
+
+    async def set(self, key, value, ttl=None, nx=False):
+        args = ["SET", key, value]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        if nx:
+            args.append("NX")
+        return await self.execute(*args) == "OK"
+
+    async def delete(self, *keys):
+        return await self.execute("DEL", *keys)
+
+    async def hset(self, key, mapping):
+        args = ["HSET", key]
+        for field, value in mapping.items():
+            args += [field, value]
+        return await self.execute(*args)
+
+    async def hset_existing(self, key, mapping, field):
+        # write, then check: if the hash had just been deleted, the write
+        # made a stub of only these fields, so take them out again
+        args = ["HSET", key]
+        for name, value in mapping.items():
+            args += [name, value]
+        _, exists = await self.transaction(args, ("HEXISTS", key, field))
+        if not exists:
+            await self.execute("HDEL", key, *mapping)
+        return bool(exists)
+
+    async def hget(self, key, field):
+        return await self.execute("HGET", key, field)
+
+    async def hmget(self, key, fields):
+        if not fields:
+            return []
+        return await self.execute("HMGET", key, *fields)
+
+    async def hgetall(self, key):
+        flat = await self.execute("HGETALL", key)
+        return dict(zip(flat[::2], flat[1::2]))
+
+    async def hdel(self, key, *fields):
+        return await self.execute("HDEL", key, *fields)
+
+    async def hincrbyfloat(self, key, field, amount):
+        return float(await self.execute("HINCRBYFLOAT", key, field, float(amount)))
+
+    async def zadd(self, key, mapping):
+        args = ["ZADD", key]
+        for member, score in mapping.items():
+            args += [float(score), member]
+        return await self.execute(*args)
+
+    async def zrem(self, key, *members):
+        return await self.execute("ZREM", key, *members)
+
+    async def zrangebyscore(self, key, low, high, limit=None):
+        args = ["ZRANGEBYSCORE", key, _score(low), _score(high), "WITHSCORES"]
+        if limit is not None:
+            args += ["LIMIT", 0, limit]
+        flat = await self.execute(*args)
+        return [(member, float(score)) for member, score in zip(flat[::2], flat[1::2])]
+
+    async def zcard(self, key):
+        return await self.execute("ZCARD", key)
+
+    async def publish(self, channel, message):
+        return await self.execute("PUBLISH", channel, message)
+
+    async def subscribe(self, channel, handler):
+        new = channel not in self.handlers
+        self.handlers.setdefault(channel, []).append(handler)
+        if self.sub_task is None:
+            # the first subscription connects straight away, so a bad
+            # REDIS_URL fails startup instead of the background loop
+            reader = await self._subscribe_all()
+            self.sub_task = asyncio.create_task(self._sub_loop(reader))
+        elif new and self.sub_writer is not None:
+            self.sub_writer.write(_encode("PSUBSCRIBE", channel))
+            await self.sub_writer.drain()
+        # else: reconnecting; _subscribe_all will include it
+
+    async def _subscribe_all(self):
+        reader, writer = await self._open()
+        writer.write(_encode("PSUBSCRIBE", *self.handlers))
+        await writer.drain()
+        self.sub_writer = writer
+        return reader
+
+    async def _sub_loop(self, reader):
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                while True:
+                    reply = await _read_reply(reader)
+                    delay = RECONNECT_DELAY
+                    # ["pmessage", pattern, channel, data]
+                    if isinstance(reply, list) and reply and reply[0] == "pmessage":
+                        for handler in self.handlers.get(reply[1], ()):
+                            try:
+                                await handler(reply[2], reply[3])
+                            except Exception:
+                                log.exception("subscription handler failed", channel=reply[2])
+            except (OSError, asyncio.IncompleteReadError, RedisError) as e:
+                log.warning("subscription connection lost, reconnecting", error=repr(e))
+            if self.sub_writer is not None:
+                self.sub_writer.close()
+                self.sub_writer = None
+
+            while True:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                try:
+                    reader = await self._subscribe_all()
+                except (OSError, RedisError) as e:
+                    log.warning("subscription reconnect failed", error=repr(e), retry_in=delay)
+                    continue
+                log.info("subscriptions restored", channels=len(self.handlers))
+                break
+
+
+def _score(value):
+    if value == float("-inf"):
+        return "-inf"
+    if value == float("inf"):
+        return "+inf"
+    return float(value)
+
+
+# ---------------------------
+#  backend selection
+# ---------------------------
+backend = None
+
+
+def get_backend():
+    global backend
+    if backend is None:
+        if os.getenv("STATE_BACKEND", "memory") == "redis":
+            backend = RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        else:
+            backend = InMemoryBackend()
+    return backend
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+from app import duels, metrics, problems, runner
+from app.leaderboard import leaderboard
+from app.database import DB_POOL_SIZE, Duel, async_engine, use_session
+from app.executor import get_executor
+from app.log import get_logger
+from app.problem_index import index
+
+#---------------------------------------------------------
+# startup warm-up, and the readiness GET /ready reports
+#
+# the lifespan starts it in the background and the worker answers straight
+# away, but /ready says 503 until every phase is done, so a rolling deploy
+# only sends it players once it's warm:
+#   database     WARMUP_CONNECTIONS pooled connections opened
+#   executor     the Judge0 client with a live connection, or the local workers
+#   leaderboard  player stats from the last snapshot (ratings wait for it)
+#   index        the problem catalog index
+#   problems     test cases (parsed for their checker) and statements of the
+#                WARMUP_PROBLEMS hottest problems: the ones in running duels,
+#                then the most played over WARMUP_WINDOW_HOURS, then any from
+#                the catalog. a statement that was never stored is fetched
+#                from the problem API now, not at someone's first match
+#
+# a phase that fails (the DB isn't up yet) is retried every RETRY_DELAY
+# seconds; one problem that can't be preloaded just stays cold.
+
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", str(min(DB_POOL_SIZE, 5))))
+WARMUP_PROBLEMS = int(os.getenv("WARMUP_PROBLEMS", "64"))
+WARMUP_WINDOW_HOURS = float(os.getenv("WARMUP_WINDOW_HOURS", "168"))
+FETCH_CONCURRENCY = 4  # statement fetches in flight at once
+RETRY_DELAY = 5.0
+
+log = get_logger("warmup")
+
+
+async def _database():
+    # held all at once so each is a new connection; they go back to the pool
+    # together, open, and the ping on checkout is all the first request pays
+    async with AsyncExitStack() as stack:
+        await asyncio.gather(*(
+            stack.enter_async_context(async_engine.connect()) for _ in range(WARMUP_CONNECTIONS)
+        ))
+
+
+async def hottest(limit):
+    slugs = []
+    for duel_key, _ in await duels.pending():
+        duel = await duels.get(duel_key)
+        if duel and duel.get("slug"):
+            slugs.append(duel["slug"])
+        if len(slugs) >= limit:
+            return slugs[:limit]
+
+    since = datetime.now(timezone.utc) - timedelta(hours=WARMUP_WINDOW_HOURS)
+    async with use_session() as session:
+        played = await session.scalars(
+            select(Duel.slug)
+            .where(Duel.ended_at >= since, Duel.slug.isnot(None))
+            .group_by(Duel.slug)
+            .order_by(func.count().desc())
+            .limit(limit)
+        )
+        slugs.extend(played)
+
+    # a new deploy with no history yet: whatever the catalog has
+    with index.lock:
+        slugs.extend(index.slugs.values())
+    return list(dict.fromkeys(slugs))[:limit]
+
+
+async def _problem(slug, gate, fetches):
+    try:
+        async with gate:
+            await runner.preload(slug)
+            payload = await problems.get_statement(slug)
+        if payload and payload.get("pending"):
+            async with fetches:
+                await problems.fill_statement(slug)
+    except Exception as e:
+        log.warning("warming problem failed", slug=slug, error=repr(e))
+
+
+async def _problems():
+    # no more DB sessions at once than connections were opened
+    gate = asyncio.Semaphore(WARMUP_CONNECTIONS)
+    fetches = asyncio.Semaphore(FETCH_CONCURRENCY)
+    slugs = await hottest(WARMUP_PROBLEMS)
+    await asyncio.gather(*(_problem(slug, gate, fetches) for slug in slugs))
+    return len(slugs)
+
+
+class Warmup:
+    def __init__(self):
+        self.ready = False
+        self.phase = None  # the one running
+        self.phases = {}  # finished phase -> seconds
+        self.problems = 0
+        self.seconds = None
+        self.task = None
+
+    async def _phase(self, name, work):
+        self.phase = name
+        started = time.perf_counter()
+        result = await work()
+        self.phases[name] = round(time.perf_counter() - started, 3)
+        return result
+
+    async def run(self):
+        started = time.perf_counter()
+        phases = (
+            ("database", _database),
+            ("executor", get_executor().start),
+            ("leaderboard", leaderboard.load),
+            ("index", problems.refresh_index),
+            ("problems", _problems),
+        )
+        while True:
+            try:
+                for name, work in phases:
+                    if name not in self.phases:
+                        result = await self._phase(name, work)
+                        if name == "problems":
+                            self.problems = result
+                break
+            except Exception:
+                log.exception("warm-up failed, retrying", phase=self.phase)
+                await asyncio.sleep(RETRY_DELAY)
+        self.phase = None
+        self.seconds = round(time.perf_counter() - started, 3)
+        self.ready = True
+        log.info("warm", seconds=self.seconds, problems=self.problems, phases=self.phases)
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "phase": self.phase,
+            "seconds": self.seconds,
+            "phases": self.phases,
+            "problems": self.problems,
+        }
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        # draining: not ready any more
+        self.ready = False
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+warmup = Warmup()
+
+metrics.Gauge("lcduel_ready", "1 once the startup warm-up is done", fn=lambda: int(warmup.ready))
+metrics.Gauge(
+    "lcduel_warmup_seconds", "Time each startup warm-up phase took", ["phase"],
+    fn=lambda: dict(warmup.phases),
+)
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import time
+from typing import Dict
+
+from app import duels
+from app.duels import duel_key_for
+from app.log import get_logger
+from app.state import get_backend
+from app.websocket import spectators
+from app.websocket.manager import manager
+
+#---------------------------------------------------------
+# live code sync: editors send diffs, not buffers
+#
+# client -> server, on every editor change:
+#   {"type": "code", "seq": n, "ops": [[pos, delete_count, insert_text], ...]}
+# ops apply in order to the text as left by the previous op. seq counts up
+# by one per message; on a gap the server answers
+#   {"type": "code", "event": "resync"}
+# and the client sends its whole buffer once: {"type": "code", "seq": n, "text": "..."}
+#
+# the server applies ops to its copy of the player's code, coalesces
+# everything that arrives within FLUSH_INTERVAL (a burst of keystrokes
+# usually collapses into one insert) and forwards that to the opponent as
+#   {"type": "code", "player", "rev", "ops"} or {"type": "code", "player", "rev", "text"}
+# and to spectators as a "code" duel event. the full text goes out instead
+# of ops every FULL_EVERY revisions so late or lossy viewers heal, and is
+# saved to the duel record every SNAPSHOT_INTERVAL seconds (and when the
+# player disconnects, so a resume gets their latest code).
+
+FLUSH_INTERVAL = 0.15  # seconds
+SNAPSHOT_INTERVAL = 10.0  # seconds
+FULL_EVERY = 50  # revisions
+MAX_CODE_LENGTH = 64 * 1024
+RESEND_CHANNEL = "lcduel:code-resend"  # username whose full text someone needs
+
+log = get_logger("code")
+_backend = get_backend()
+
+
+class _Doc:
+    __slots__ = ("username", "duel_key", "text", "seq", "rev", "pending", "full", "flush", "snapshot_at")
+
+    def __init__(self, username, duel_key):
+        self.username = username
+        self.duel_key = duel_key
+        self.text = ""
+        self.seq = 0
+        self.rev = 0
+        self.pending = []
+        self.full = True  # nothing sent yet, so the first flush is the whole text
+        self.flush = None
+        self.snapshot_at = 0.0
+
+
+docs: Dict[str, _Doc] = {}
+
+
+def apply_ops(text, ops):
+    # raises ValueError on anything malformed or out of range
+    for op in ops:
+        pos, delete, insert = op
+        if not isinstance(pos, int) or not isinstance(delete, int) or not isinstance(insert, str):
+            raise ValueError(f"bad op {op!r}")
+        if pos < 0 or delete < 0 or pos + delete > len(text):
+            raise ValueError(f"op {op!r} out of range")
+        text = text[:pos] + insert + text[pos + delete:]
+    if len(text) > MAX_CODE_LENGTH:
+        raise ValueError("code too long")
+    return text
+
+
+def coalesce(ops):
+    # merge ops that continue each other: typing forward, backspacing, and
+    # backspacing over text just typed
+    merged = []
+    for pos, delete, insert in ops:
+        if merged:
+            last = merged[-1]
+            end = last[0] + len(last[2])
+            if delete == 0 and pos == end:
+                last[2] += insert
+                continue
+            if not insert and last[2] and pos + delete == end and delete <= len(last[2]):
+                last[2] = last[2][:len(last[2]) - delete]
+                continue
+            if not insert and not last[2] and pos + delete == last[0]:
+                last[0] = pos
+                last[1] += delete
+                continue
+            if not insert and not last[2] and pos == last[0]:
+                last[1] += delete
+                continue
+        merged.append([pos, delete, insert])
+    return [op for op in merged if op[1] or op[2]]
+
+
+async def handle(username, message):
+    doc = docs.get(username)
+    if doc is None:
+        doc = docs[username] = _Doc(username, await duel_key_for(username))
+
+    seq = message.get("seq")
+    try:
+        if "text" in message:
+            text = message["text"]
+            if not isinstance(text, str) or len(text) > MAX_CODE_LENGTH:
+                raise ValueError("bad text")
+            # clients send the whole buffer when a duel starts, so pick the duel up here
+            doc.duel_key = await duel_key_for(username)
+            doc.text = text
+            doc.pending = []
+            doc.full = True
+        elif seq != doc.seq + 1:
+            raise ValueError(f"expected seq {doc.seq + 1}, got {seq}")
+        else:
+            ops = message.get("ops") or []
+            doc.text = apply_ops(doc.text, ops)
+            doc.pending.extend(ops)
+    except (ValueError, TypeError) as e:
+        log.debug("resync", user=username, reason=str(e))
+        await manager.send_to_user(username, json.dumps({"type": "code", "event": "resync"}))
+        return
+    doc.seq = seq if isinstance(seq, int) else doc.seq
+
+    if doc.duel_key and doc.flush is None:
+        doc.flush = asyncio.get_running_loop().call_later(
+            FLUSH_INTERVAL, lambda: asyncio.create_task(_flush(doc)),
+        )
+
+
+async def _flush(doc):
+    doc.flush = None
+    if docs.get(doc.username) is not doc:
+        return
+    if await duel_key_for(doc.username) != doc.duel_key:
+        # the duel ended; keep the text but stop forwarding it
+        doc.duel_key = None
+        doc.pending = []
+        return
+    ops, doc.pending = coalesce(doc.pending), []
+    if not ops and not doc.full:
+        return
+
+    doc.rev += 1
+    if doc.full or doc.rev % FULL_EVERY == 0:
+        doc.full = False
+        body = {"text": doc.text}
+    else:
+        body = {"ops": ops}
+
+    opponent = next((p for p in doc.duel_key if p != doc.username), None)
+    await manager.send_to_user(opponent, json.dumps({
+        "type": "code", "player": doc.username, "rev": doc.rev, **body
+    }))
+    await spectators.publish(doc.duel_key, "code", player=doc.username, rev=doc.rev, **body)
+
+    now = time.monotonic()
+    if now - doc.snapshot_at >= SNAPSHOT_INTERVAL:
+        doc.snapshot_at = now
+        await duels.set_code(doc.duel_key, doc.username, doc.text)
+
+
+async def save(username):
+    # disconnect: the latest text goes into the duel record for a resume
+    doc = docs.get(username)
+    if doc is not None and doc.duel_key and await duel_key_for(username) == doc.duel_key:
+        await duels.set_code(doc.duel_key, username, doc.text)
+
+
+def latest(username, duel):
+    # this worker's copy if it has one, else the last snapshot in the record
+    doc = docs.get(username)
+    if doc is not None and doc.duel_key:
+        return doc.text
+    return duel["code"].get(username)
+
+
+async def resend(username):
+    # someone needs a fresh copy of this player's code: the next flush sends
+    # the full text, from whichever worker has the player's socket
+    doc = docs.get(username)
+    if doc is None or not doc.duel_key:
+        if _backend.shared:
+            await _backend.publish(RESEND_CHANNEL, username)
+        return
+    doc.full = True
+    if doc.flush is None:
+        doc.flush = asyncio.get_running_loop().call_later(
+            FLUSH_INTERVAL, lambda: asyncio.create_task(_flush(doc)),
+        )
+
+
+async def _on_resend(channel, username):
+    doc = docs.get(username)
+    if doc is not None and doc.duel_key:
+        await resend(username)
+
+
+async def start():
+    await _backend.subscribe(RESEND_CHANNEL, _on_resend)
+
+
+def reset(username, duel_key=None):
+    # new duel or disconnect: start the next document from scratch
+    doc = docs.pop(username, None)
+    if doc is not None and doc.flush is not None:
+        doc.flush.cancel()
+    if duel_key is not None:
+        docs[username] = _Doc(username, duel_key)
@@ -1,106 +1,410 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from app.websocket.manager import ConnectionManager
-from app import matchmaker, problems
+from app.websocket.manager import manager
+from app.websocket import code_sync, session, spectators
+from app import duels, matchmaker, metrics, problems, runner
+from app.admission import Overloaded, RateLimited, admission
+from app.duels import duel_key_for
+from app.history import history
+from app.leaderboard import leaderboard
+from app.log import get_logger
+from app.scheduler import TimerWheel
 import json
 import asyncio
-from datetime import datetime
+import time
 
-manager = ConnectionManager()
-active_duels = {}
-waiting_user = None
+# sockets are per worker; duel records live in the state backend (app/duels.py)
+run_tasks = {}  # username -> judging task in flight
+pending_ratings = set()  # results waiting for the leaderboard to load
+
+log = get_logger("duels")
+
+RUN_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+run_seconds = metrics.Histogram("lcduel_run_seconds", "Run submitted until its last verdict", ["via"], buckets=RUN_BUCKETS)
 
 
 # ---------------------------
-#  HELPER: end duel after 10 minutes
+#  HELPER: end duels when their clock runs out
 # ---------------------------
-async def end_duel_after_time(duel_key):
-    await asyncio.sleep(active_duels[duel_key]["duration"])
+async def duel_expired(duel_key):
+    # the persisted record is the source of truth: another worker may have
+    # paused or extended this duel since the timer was set
+    duel = await duels.get(duel_key)
+    if duel is None or duel["paused"] is not None:
+        return
+    if duel["deadline"] > time.time() + duel_timers.resolution:
+        duel_timers.schedule(duel_key, duel["deadline"])
+        return
     await finalize_duel(duel_key)
 
 
+duel_timers = TimerWheel(duel_expired)
+
+
+async def recover_duels():
+    # rebuild timers for duels that were running before a restart
+    recovered = await duels.pending()
+    for duel_key, deadline in recovered:
+        duel_timers.schedule(duel_key, deadline)
+    return len(recovered)
+
+
+async def announce_clock(duel_key, deadline=None, paused=None):
+    # a duel's clock changed: both players and its spectators get
+    # {"type": "clock", "deadline", "paused"} (paused = seconds left while stopped)
+    await manager.broadcast(list(duel_key), json.dumps({"type": "clock", "deadline": deadline, "paused": paused}))
+    await spectators.publish(duel_key, "clock", deadline=deadline, paused=paused)
+
+
+async def extend_duel(duel_key, seconds):
+    # overtime
+    duel = await duels.get(duel_key)
+    if duel is None or duel["paused"] is not None:
+        return None
+    deadline = await duels.set_deadline(duel_key, duel["deadline"] + seconds)
+    if deadline is None:
+        return None
+    duel_timers.schedule(duel_key, deadline)
+    await announce_clock(duel_key, deadline=deadline)
+    return deadline
+
+
+async def pause_duel(duel_key):
+    duel = await duels.get(duel_key)
+    if duel is None or duel["paused"] is not None:
+        return None
+    remaining = max(0.0, duel["deadline"] - time.time())
+    if not await duels.pause(duel_key, remaining):
+        return None
+    duel_timers.cancel(duel_key)
+    await announce_clock(duel_key, paused=remaining)
+    return remaining
+
+
+async def resume_duel(duel_key):
+    duel = await duels.get(duel_key)
+    if duel is None or duel["paused"] is None:
+        return None
+    deadline = await duels.set_deadline(duel_key, time.time() + duel["paused"])
+    if deadline is None:
+        return None
+    duel_timers.schedule(duel_key, deadline)
+    await announce_clock(duel_key, deadline=deadline)
+    return deadline
+
+
 async def finalize_duel(duel_key):
-    duel = active_duels.get(duel_key)
-    if not duel:
+    duel_timers.cancel(duel_key)
+    duel = await duels.get(duel_key)
+    # only one worker gets to announce the result
+    if not duel or not await duels.claim(duel_key):
         return
 
-    player1, player2 = duel_key
     if duel["finished"]:
         winner = list(duel["finished"])[0] if len(duel["finished"]) == 1 else "draw"
     else:
         winner = "none"
 
-    await manager.broadcast(list(duel_key), json.dumps({
+    message = json.dumps({
         "type": "result",
         "winner": winner,
         "message": f"Duel ended! Winner: {winner}"
+    })
+    await manager.broadcast(list(duel_key), message)
+    await session.keep_outcome(duel_key, message)
+    history.record_duel(duel_key, duel, winner)
+
+    if winner in duel_key or winner == "draw":
+        decided = winner if winner in duel_key else None
+        if leaderboard.loaded.is_set():
+            await rate(duel_key, duel.get("difficulty"), decided)
+        else:
+            # ratings and records carry on from the leaderboard snapshot; until
+            # the warm-up has loaded it, they wait in the background rather
+            # than holding up the finishing player's socket or request
+            task = asyncio.create_task(rate(duel_key, duel.get("difficulty"), decided))
+            pending_ratings.add(task)
+            task.add_done_callback(pending_ratings.discard)
+
+    await spectators.publish(duel_key, "result", winner=winner)
+    log.info("duel ended", duel="|".join(duel_key), winner=winner)
+
+
+async def rate(duel_key, difficulty, decided):
+    # Elo and leaderboard for a decided duel (decided None: a draw)
+    await leaderboard.loaded.wait()
+    try:
+        deltas = await matchmaker.record_result(*duel_key, decided)
+        await leaderboard.record(duel_key, difficulty, decided, deltas)
+    except Exception:
+        log.exception("rating failed", duel="|".join(duel_key))
+
+
+async def finish(username, opponent):
+    # a player says they're done; once both are, the duel ends early
+    duel_key = tuple(sorted([username, opponent]))
+    duel = await duels.mark_finished(duel_key, username)
+    if duel is None:
+        return False
+    await spectators.publish(duel_key, "finish", player=username)
+
+    if len(duel["finished"]) == 2:
+        await finalize_duel(duel_key)
+    return True
+
+
+# ---------------------------
+#  HELPER: send the statement once it's been fetched
+# ---------------------------
+async def deliver_statement(duel_key, slug):
+    payload = await problems.fill_statement(slug)
+    if not payload or await duels.get(duel_key) is None:
+        return
+    await duels.update_problem(duel_key, payload)
+
+    await manager.broadcast(list(duel_key), json.dumps({
+        "type": "statement",
+        **payload
     }))
 
-    print(f"[DUEL ENDED] {duel_key} winner: {winner}")
-    del active_duels[duel_key]
+
+# ---------------------------
+#  HELPER: judge a run in the background, streaming verdicts
+# ---------------------------
+async def stream_run(username, message):
+    started = time.perf_counter()
+    run_id = message.get("run_id")
+    duel_key = await duel_key_for(username)
+    opponent = next((p for p in duel_key if p != username), None) if duel_key else None
+    progress = {"total": 0, "done": 0, "passed": 0}
+
+    async def send_progress():
+        if not opponent:
+            return
+        await duels.set_progress(duel_key, username, progress)
+        await spectators.publish(duel_key, "progress", player=username, **progress)
+        await manager.send_to_user(opponent, json.dumps({
+            "type": "progress",
+            "player": username,
+            "passed": progress["passed"],
+            "done": progress["done"],
+            "total": progress["total"],
+            "message": f"{username}: {progress['passed']}/{progress['total']} passing"
+        }))
+
+    async def on_start(total):
+        progress["total"] = total
+        await manager.send_to_user(username, json.dumps({
+            "type": "run",
+            "event": "start",
+            "run_id": run_id,
+            "total": total
+        }))
+        await send_progress()
+
+    async def on_result(idx, result):
+        progress["done"] += 1
+        if result["passed"]:
+            progress["passed"] += 1
+        await manager.send_to_user(username, json.dumps({
+            "type": "run",
+            "event": "case",
+            "run_id": run_id,
+            "index": idx,
+            "total": progress["total"],
+            **result
+        }))
+        await send_progress()
+
+    async def on_queued(position):
+        await manager.send_to_user(username, json.dumps({
+            "type": "run",
+            "event": "queued",
+            "run_id": run_id,
+            "position": position,
+            "message": f"queued, position {position}"
+        }))
+
+    try:
+        async with admission.admit(username, duel_key, on_queued=on_queued):
+            results = await runner.run_submission(
+                message.get("slug"),
+                message.get("code", ""),
+                message.get("language") or "python",
+                duel_key=duel_key or username,
+                on_start=on_start,
+                on_result=on_result,
+                fail_fast=bool(message.get("fail_fast")),
+            )
+    except (RateLimited, Overloaded) as e:
+        await manager.send_to_user(username, json.dumps({
+            "type": "run",
+            "event": "rejected",
+            "run_id": run_id,
+            "error": str(e),
+            "retry_after": round(e.retry_after, 1)
+        }))
+        return
+
+    if results is None:
+        await manager.send_to_user(username, json.dumps({
+            "type": "run",
+            "event": "error",
+            "run_id": run_id,
+            "error": "problem not found"
+        }))
+        return
+
+    await manager.send_to_user(username, json.dumps({
+        "type": "run",
+        "event": "done",
+        "run_id": run_id,
+        "all_passed": all(r["passed"] for r in results),
+        "results": results
+    }))
+    run_seconds.labels("ws").observe(time.perf_counter() - started)
+    if duel_key:
+        await duels.set_verdict(duel_key, username, session.verdict(results, run_id))
+    # the player already has the verdict; this only queues the rows
+    history.record_run(
+        username, await duels.history_id(duel_key), message.get("slug"),
+        message.get("language") or "python", message.get("code", ""), results, "ws",
+    )
+
+
+def start_run(username, message):
+    # a new run replaces one still in flight for the same player
+    previous = run_tasks.pop(username, None)
+    if previous:
+        previous.cancel()
+
+    task = asyncio.create_task(stream_run(username, message))
+    run_tasks[username] = task
+
+    def cleanup(t):
+        if run_tasks.get(username) is t:
+            del run_tasks[username]
+        if not t.cancelled() and t.exception():
+            log.error("run failed", user=username, error=repr(t.exception()))
+
+    task.add_done_callback(cleanup)
+
+
+# ---------------------------
+#  HELPER: start a duel for every match the matchmaker makes
+# ---------------------------
+@matchmaker.on_match
+async def start_duel(match):
+    username, opponent = match["players"]
+
+    # get a random problem (async: other sockets keep running meanwhile)
+    problem = await problems.get_problem_for_match(match["difficulty"], match["tag"], players=(username, opponent))
+
+    duel_key = tuple(sorted([username, opponent]))
+    deadline = await duels.create(
+        duel_key, problem.get("slug"), duels.DUEL_DURATION,
+        title=problem.get("title"), difficulty=problem.get("difficulty"), problem=problem,
+    )
+    duel_timers.schedule(duel_key, deadline)
+    # test cases into memory now, so the first run skips the DB
+    if problem.get("slug"):
+        asyncio.create_task(runner.preload(problem["slug"]))
+    await spectators.publish(
+        duel_key, "start",
+        slug=problem.get("slug"), title=problem.get("title"),
+        difficulty=problem.get("difficulty"), deadline=deadline,
+    )
+
+    # Send same problem to both players
+    for player, other in ((username, opponent), (opponent, username)):
+        code_sync.reset(player, duel_key)
+        if await manager.is_online(player):
+            # told over the socket, nothing left to claim via POST /join
+            await matchmaker.release(player)
+        await manager.send_to_user(player, json.dumps({
+            "type": "problem",
+            "opponent": other,
+            **problem
+        }))
+
+    if problem.get("pending"):
+        asyncio.create_task(deliver_statement(duel_key, problem["slug"]))
+
+    log.info("matched", players=f"{username}|{opponent}", slug=problem.get("slug"))
 
 
 # ---------------------------
 #  MAIN WEBSOCKET ENDPOINT
 # ---------------------------
 async def websocket_endpoints(websocket: WebSocket, username: str):
-    global waiting_user
-
-    await manager.connect(username, websocket)
-    print(f"{username} connected")
+    # /ws/<username>?token=<token from an earlier "session" message> resumes
+    conn = await manager.connect(username, websocket)
+    token, resuming = await session.open_session(username, websocket.query_params.get("token"))
+    await manager.send_to_user(username, json.dumps({"type": "session", "token": token}))
+    if resuming:
+        restored = await session.resume(username)
+        log.info("reconnected", user=username, restored=restored)
 
     try:
         while True:
             data = await websocket.receive_text()
+            manager.touch(username)
+
+            # structured messages are JSON objects with a "type":
+            #   {"type": "join", "difficulty", "tag"}
+            #   {"type": "run", "slug", "code", "language", "fail_fast"}
+            #   {"type": "code", "seq", "ops" | "text"}  live editor diffs (code_sync.py)
+            #   {"type": "spectate", "players": [a, b]}  watch someone else's duel
+            #   {"type": "unspectate"}
+            #   {"type": "pong"}  reply to the server's heartbeat ping
+            message = None
+            if data.startswith("{"):
+                try:
+                    message = json.loads(data)
+                except ValueError:
+                    message = {}
+
+            if message is not None and message.get("type") == "pong":
+                continue
 
-            if data == "join":
-                # if no one waiting yet, store this player
-                if waiting_user is None:
-                    waiting_user = username
+            if data == "join" or (message is not None and message.get("type") == "join"):
+                if await duel_key_for(username):
                     await manager.send_to_user(username, json.dumps({
                         "type": "status",
-                        "message": "⏳ Waiting for opponent..."
+                        "message": "You're still in a duel; reconnect with your session token to resume it"
                     }))
-                else:
-                    # found an opponent
-                    opponent = waiting_user
-                    waiting_user = None
-
-                    # get a random problem
-                    problem = problems.get_problem_for_match()
-
-                    duel_key = tuple(sorted([username, opponent]))
-                    active_duels[duel_key] = {
-                        "start": datetime.utcnow(),
-                        "duration": 600,  # 10 minutes
-                        "finished": set()
-                    }
-
-                    asyncio.create_task(end_duel_after_time(duel_key))
+                    continue
 
-                    # Send same problem to both players
+                message = message or {}
+                match = await matchmaker.join(username, message.get("difficulty"), message.get("tag"))
+                if not match:
                     await manager.send_to_user(username, json.dumps({
-                        "type": "problem",
-                        "opponent": opponent,
-                        **problem
-                    }))
-                    await manager.send_to_user(opponent, json.dumps({
-                        "type": "problem",
-                        "opponent": username,
-                        **problem
+                        "type": "status",
+                        "message": "⏳ Waiting for opponent..."
                     }))
 
-                    print(f"[MATCHED] {username} vs {opponent}")
-
             elif data.startswith("finish:"):
                 opponent = data.split(":")[1]
-                duel_key = tuple(sorted([username, opponent]))
-
-                if duel_key in active_duels:
-                    active_duels[duel_key]["finished"].add(username)
+                await finish(username, opponent)
 
-                    # if both finished early, finalize now
-                    if len(active_duels[duel_key]["finished"]) == 2:
-                        await finalize_duel(duel_key)
+            elif message is not None:
+                if message.get("type") == "code":
+                    await code_sync.handle(username, message)
+                elif message.get("type") == "run":
+                    start_run(username, message)
+                elif message.get("type") == "spectate":
+                    players = message.get("players") or []
+                    if len(players) != 2 or not await spectators.watch(username, players):
+                        await manager.send_to_user(username, json.dumps({
+                            "type": "status",
+                            "message": "That duel isn't running"
+                        }))
+                elif message.get("type") == "unspectate":
+                    await spectators.unwatch(username)
+                else:
+                    await manager.send_to_user(username, json.dumps({
+                        "type": "status",
+                        "message": f"Unknown message: {message.get('type')}"
+                    }))
 
             else:
                 await manager.send_to_user(username, json.dumps({
@@ -108,6 +412,18 @@ async def websocket_endpoints(websocket: WebSocket, username: str):
                     "message": f"You said: {data}"
                 }))
 
-    except WebSocketDisconnect:
-        manager.disconnect(username)
-        print(f"{username} disconnected")
+    except (WebSocketDisconnect, asyncio.CancelledError):
+        # CancelledError: the manager dropped a slow, silent or replaced socket
+        manager.disconnect(username, websocket)
+        if conn.replaced:
+            # the player is back on a newer socket, which keeps their state
+            return
+        await matchmaker.cancel(username)
+        await spectators.unwatch(username)
+        # the duel carries on; a reconnect picks it up from the record
+        await code_sync.save(username)
+        code_sync.reset(username)
+        task = run_tasks.pop(username, None)
+        if task:
+            task.cancel()
+        await manager.forget(username)
@@ -1,26 +1,220 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+
 from fastapi import WebSocket
 from typing import Dict, List
 
+from app import metrics
+from app.log import get_logger
+from app.state import get_backend
+
+# messages for users whose socket lives on another worker go out on this
+# channel; every worker delivers the ones addressed to its own sockets
+DELIVER_CHANNEL = "lcduel:deliver"
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# every socket gets its own outbound queue and writer task, so a broadcast
+# only enqueues and one slow client can't hold up anyone else
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE", "256"))  # high-water mark
+SEND_TIMEOUT = 10.0  # seconds a single send may take
+CLOSE_TIMEOUT = 2.0
+# sockets quiet for HEARTBEAT_INTERVAL get {"type": "ping"}; no traffic at
+# all for another HEARTBEAT_TIMEOUT and they're closed
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "20"))
+
+SLOW_CONSUMER = 1013  # "try again later"
+HEARTBEAT_FAILED = 1001
+REPLACED = 4001  # the same user connected again; clients shouldn't reconnect on this
+
+log = get_logger("ws")
+
+broadcast_seconds = metrics.Histogram(
+    "lcduel_broadcast_seconds", "Time to hand one message to its recipients' queues (or the deliver channel)",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1),
+)
+dropped_sockets = metrics.Counter("lcduel_ws_dropped_total", "Sockets closed for being slow or silent", ["reason"])
+
+
+class _Connection:
+    __slots__ = ("username", "websocket", "queue", "writer", "reader", "last_seen", "closed", "replaced")
+
+    def __init__(self, username, websocket):
+        self.username = username
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.writer = None
+        # the task running the endpoint's receive loop, cancelled on drop so
+        # a half-dead client doesn't leave it waiting forever
+        self.reader = asyncio.current_task()
+        self.last_seen = time.monotonic()
+        self.closed = False
+        # a newer socket for the same user took over; the player's duel,
+        # queue entry and code belong to that one now
+        self.replaced = False
+
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.active_connections: Dict[str, _Connection] = {}
         self.matches: List[List[str]] = []
+        self.backend = get_backend()
+        self.heartbeat_task = None
+
+    async def start(self):
+        if self.backend.shared:
+            await self.backend.subscribe(DELIVER_CHANNEL, self._deliver)
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def close(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+
+    async def _deliver(self, channel, data):
+        payload = json.loads(data)
+        if "replace" in payload:
+            # the user connected on another worker
+            conn = self.active_connections.get(payload["replace"])
+            if conn is not None and payload["by"] != WORKER_ID:
+                self._replace(conn)
+            return
+        for user in payload["users"]:
+            conn = self.active_connections.get(user)
+            if conn is not None:
+                self._enqueue(conn, payload["message"])
 
     async def connect(self, username: str, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections[username] = websocket
-        print(f"{username} connected")
+        conn = _Connection(username, websocket)
+        conn.writer = asyncio.create_task(self._writer(conn))
+        old = self.active_connections.get(username)
+        self.active_connections[username] = conn
+        if old is not None:
+            self._replace(old)
+        if self.backend.shared:
+            previous = await self.backend.get(f"lcduel:online:{username}")
+            await self.backend.set(f"lcduel:online:{username}", WORKER_ID)
+            if previous is not None and previous != WORKER_ID:
+                await self.backend.publish(DELIVER_CHANNEL, json.dumps({"replace": username, "by": WORKER_ID}))
+        log.debug("connected", user=username, replaced=old is not None)
+        return conn
+
+    def disconnect(self, username: str, websocket: WebSocket = None):
+        conn = self.active_connections.get(username)
+        # a newer socket for the same user stays
+        if conn is None or (websocket is not None and conn.websocket is not websocket):
+            return
+        self.active_connections.pop(username)
+        self._close(conn)
+        log.debug("disconnected", user=username)
 
-    def disconnect(self, username: str):
+    def _close(self, conn):
+        conn.closed = True
+        conn.writer.cancel()
+
+    def _replace(self, conn):
+        # close the old socket without touching the player's state
+        conn.replaced = True
+        asyncio.create_task(self._drop(conn, REPLACED, "replaced"))
+
+    async def forget(self, username: str):
+        # drop the presence record, unless another worker has taken it over
+        if self.backend.shared and await self.backend.get(f"lcduel:online:{username}") == WORKER_ID:
+            await self.backend.delete(f"lcduel:online:{username}")
+
+    async def is_online(self, username: str):
         if username in self.active_connections:
-            self.active_connections.pop(username)
-            print(f"{username} disconnected")
+            return True
+        if self.backend.shared:
+            return await self.backend.get(f"lcduel:online:{username}") is not None
+        return False
+
+    def touch(self, username: str):
+        # any inbound frame counts as a heartbeat
+        conn = self.active_connections.get(username)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+
+    def send_local(self, users, message: str):
+        # already-serialized message to sockets on this worker; nothing is
+        # re-encoded per recipient
+        for user in users:
+            conn = self.active_connections.get(user)
+            if conn is not None:
+                self._enqueue(conn, message)
 
     async def send_to_user(self, username: str, message: str):
-        if username in self.active_connections:
-            await self.active_connections[username].send_text(message)
+        await self.broadcast([username], message)
 
     async def broadcast(self, users: List[str], message: str):
+        started = time.perf_counter()
+        remote = []
         for user in users:
-            if user in self.active_connections:
-                await self.active_connections[user].send_text(message)
+            conn = self.active_connections.get(user)
+            if conn is not None:
+                self._enqueue(conn, message)
+            else:
+                remote.append(user)
+
+        if remote and self.backend.shared:
+            await self.backend.publish(DELIVER_CHANNEL, json.dumps({"users": remote, "message": message}))
+        broadcast_seconds.observe(time.perf_counter() - started)
+
+    # ---------------------------
+    #  per-connection send path
+    # ---------------------------
+    def _enqueue(self, conn, message):
+        if conn.closed:
+            return
+        try:
+            conn.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            log.warning("not keeping up, dropping", user=conn.username, queued=SEND_QUEUE_SIZE)
+            asyncio.create_task(self._drop(conn, SLOW_CONSUMER, "slow consumer"))
+
+    async def _writer(self, conn):
+        try:
+            while True:
+                message = await conn.queue.get()
+                await asyncio.wait_for(conn.websocket.send_text(message), SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("send failed", user=conn.username, error=repr(e))
+            asyncio.create_task(self._drop(conn, SLOW_CONSUMER, "send failed"))
+
+    async def _drop(self, conn, code, reason):
+        if conn.closed:
+            return
+        dropped_sockets.labels(reason).inc()
+        self.disconnect(conn.username, conn.websocket)
+        self._close(conn)
+        try:
+            await asyncio.wait_for(conn.websocket.close(code=code, reason=reason), CLOSE_TIMEOUT)
+        except Exception:
+            pass
+        if conn.reader is not None and not conn.reader.done():
+            conn.reader.cancel()
+
+    async def _heartbeat(self):
+        ping = json.dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL / 2)
+            now = time.monotonic()
+            for conn in list(self.active_connections.values()):
+                idle = now - conn.last_seen
+                if idle > HEARTBEAT_INTERVAL + HEARTBEAT_TIMEOUT:
+                    log.info("missed heartbeats, closing", user=conn.username)
+                    asyncio.create_task(self._drop(conn, HEARTBEAT_FAILED, "heartbeat timeout"))
+                elif idle >= HEARTBEAT_INTERVAL:
+                    self._enqueue(conn, ping)
+
+
+manager = ConnectionManager()
+
+metrics.Gauge("lcduel_open_sockets", "WebSockets open on this worker", fn=lambda: len(manager.active_connections))
@@ -0,0 +1,104 @@
+import json
+import os
+import secrets
+
+from app import duels
+from app.duels import duel_key_for
+from app.state import get_backend
+from app.websocket import code_sync
+from app.websocket.manager import manager
+
+#---------------------------------------------------------
+# reconnects: session tokens and duel snapshots
+#
+# every socket is sent {"type": "session", "token"} once it's open. a client
+# that comes back with /ws/<username>?token=<token> is the same player
+# reconnecting, and gets their duel back in one message
+#   {"type": "resume", "opponent", "problem", "deadline", "paused",
+#    "finished", "progress", "code", "opponent_code", "verdict"}
+# built from the duel record alone: no DB query, no problem API call. if
+# the duel ended while they were away they get its "result" instead. a
+# connection without a valid token starts a new session with nothing
+# restored.
+#
+#   lcduel:session:<username>  the current token, for SESSION_TTL seconds
+#   lcduel:outcome:<username>  a result the player missed, OUTCOME_TTL seconds
+
+SESSION_TTL = int(os.getenv("WS_SESSION_TTL", "3600"))  # seconds
+OUTCOME_TTL = 600  # seconds
+
+_backend = get_backend()
+
+
+def _session_id(username):
+    return f"lcduel:session:{username}"
+
+
+def _outcome_id(username):
+    return f"lcduel:outcome:{username}"
+
+
+async def open_session(username, token=None):
+    # (token to hand out, whether the given one was valid)
+    current = await _backend.get(_session_id(username))
+    valid = bool(token and current and secrets.compare_digest(token, current))
+    if not valid:
+        current = secrets.token_urlsafe(18)
+    await _backend.set(_session_id(username), current, ttl=SESSION_TTL)
+    return current, valid
+
+
+def verdict(results, run_id=None):
+    # what's kept of a run for a resume: per-case pass/status, no outputs
+    passed = sum(1 for r in results if r["passed"])
+    return {
+        "run_id": run_id,
+        "all_passed": passed == len(results),
+        "passed": passed,
+        "total": len(results),
+        "cases": [{"passed": r["passed"], "status": r["status"]} for r in results],
+    }
+
+
+async def snapshot(username):
+    # the "resume" message for a player in a duel, else None
+    duel_key = await duel_key_for(username)
+    duel = await duels.get(duel_key) if duel_key else None
+    if duel is None:
+        return None
+    opponent = next((p for p in duel_key if p != username), username)
+    return {
+        "type": "resume",
+        "opponent": opponent,
+        "problem": {**duel["problem"], "opponent": opponent},
+        "deadline": duel["deadline"],
+        "paused": duel["paused"],
+        "finished": sorted(duel["finished"]),
+        "progress": duel["progress"],
+        "code": code_sync.latest(username, duel),
+        "opponent_code": code_sync.latest(opponent, duel),
+        "verdict": duel["verdicts"].get(username),
+    }
+
+
+async def resume(username):
+    # after a reconnect with a valid token; returns what was restored
+    message = await snapshot(username)
+    if message is not None:
+        await manager.send_to_user(username, json.dumps(message))
+        # the copy of the opponent's code in the snapshot may be behind
+        await code_sync.resend(message["opponent"])
+        return "duel"
+    outcome = await _backend.get(_outcome_id(username))
+    if outcome is not None:
+        await _backend.delete(_outcome_id(username))
+        await manager.send_to_user(username, outcome)
+        return "result"
+    return None
+
+
+async def keep_outcome(duel_key, message):
+    # the result, for whichever player wasn't there to get it
+    for player in duel_key:
+        if not await manager.is_online(player):
+            await _backend.set(_outcome_id(player), message, ttl=OUTCOME_TTL)
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import time
+from typing import Dict
+
+from app import duels
+from app.state import get_backend
+from app.websocket import code_sync
+from app.websocket.manager import manager
+
+#---------------------------------------------------------
+# spectators: live one-to-many streaming of a duel
+#
+# duel events (start, progress, finish, result) are published once on
+# EVENTS_CHANNEL as an already-serialized frame, and only while someone
+# watches the duel: an unwatched duel costs one HGET per event. a worker
+# keeps a feed only for the duels its own viewers watch, built from the duel
+# record when the first one arrives, and hands the same string to each of
+# them, so adding a viewer costs one queue put per event. a feed goes with the result, when
+# its last viewer leaves, or if the duel is gone EXPIRY_GRACE seconds past
+# its deadline (a result this worker never heard of).
+#
+# a feed holds the duel state as of its last snapshot plus the frames since
+# then; every SNAPSHOT_EVERY events the state is re-serialized into a fresh
+# snapshot. a late joiner gets that snapshot and replays the deltas.
+#
+# frames sent to viewers:
+#   {"type": "spectate", "event": "snapshot", "duel", "seq", "state"}
+#   {"type": "spectate", "event": "start" | "progress" | "code" | "clock" | "finish" | "result", "duel", "seq", ...}
+
+EVENTS_CHANNEL = "lcduel:duel-events"
+SEQ_KEY = "lcduel:duel-events:seq"
+VIEWERS_KEY = "lcduel:viewers"  # duel id -> viewer count across workers
+SNAPSHOT_EVERY = 32
+EXPIRY_GRACE = 30.0  # seconds
+
+_backend = get_backend()
+
+
+def duel_id(duel_key):
+    return "|".join(duel_key)
+
+
+class DuelFeed:
+    def __init__(self, duel, state, seq=0):
+        self.duel = duel
+        self.state = state
+        self.seq = seq
+        self.viewers = set()
+        self.snapshot = None
+        self.deltas = []
+        self.expiry = None  # loop timer, see _schedule_expiry
+        self._snapshot()
+
+    def _snapshot(self):
+        self.snapshot = json.dumps({
+            "type": "spectate",
+            "event": "snapshot",
+            "duel": self.duel,
+            "seq": self.seq,
+            "state": self.state,
+        })
+        self.deltas = []
+
+    def apply(self, seq, event, frame):
+        state = self.state
+        kind = event["event"]
+        if kind == "start":
+            state.update({key: event[key] for key in ("slug", "title", "difficulty", "deadline") if key in event})
+        elif kind == "progress":
+            state["progress"][event["player"]] = {
+                key: event[key] for key in ("passed", "done", "total")
+            }
+        elif kind == "code":
+            # code events carry ops against the previous rev, or the full text
+            player = event["player"]
+            if "text" in event:
+                state["code"][player] = event["text"]
+            elif player in state["code"]:
+                try:
+                    state["code"][player] = code_sync.apply_ops(state["code"][player], event["ops"])
+                except ValueError:
+                    # missed a rev; wait for the next full text
+                    del state["code"][player]
+        elif kind == "clock":
+            state["deadline"], state["paused"] = event["deadline"], event["paused"]
+        elif kind == "finish":
+            if event["player"] not in state["finished"]:
+                state["finished"].append(event["player"])
+        elif kind == "result":
+            state["result"] = event["winner"]
+
+        self.seq = max(self.seq, seq)
+        self.deltas.append(frame)
+        if len(self.deltas) >= SNAPSHOT_EVERY:
+            self._snapshot()
+
+
+def _empty_state(duel):
+    return {
+        "players": duel.split("|"),
+        "slug": None,
+        "title": None,
+        "difficulty": None,
+        "deadline": None,
+        "paused": None,
+        "progress": {},
+        "code": {},
+        "finished": [],
+        "result": None,
+    }
+
+
+feeds: Dict[str, DuelFeed] = {}
+watching: Dict[str, str] = {}  # viewer username -> duel id
+
+
+# ---------------------------
+#  publishing side (called wherever the event happens)
+# ---------------------------
+async def publish(duel_key, event, **fields):
+    duel = duel_id(duel_key)
+    if not await _backend.hget(VIEWERS_KEY, duel):
+        # nobody watches it anywhere; a first viewer starts from the record
+        if event == "result":
+            await _backend.hdel(SEQ_KEY, duel)
+        return
+    seq = int(await _backend.hincrbyfloat(SEQ_KEY, duel, 1))
+    frame = json.dumps({"type": "spectate", "event": event, "duel": duel, "seq": seq, **fields})
+    if event == "result":
+        await _backend.hdel(SEQ_KEY, duel)
+    await _backend.publish(EVENTS_CHANNEL, frame)
+
+
+def _schedule_expiry(feed):
+    # check on the duel once its deadline (plus grace) has passed; while
+    # it's paused or hasn't started, every EXPIRY_GRACE seconds
+    if feed.expiry is not None:
+        feed.expiry.cancel()
+    delay = EXPIRY_GRACE
+    if feed.state["deadline"] is not None and feed.state["paused"] is None:
+        delay += max(0.0, feed.state["deadline"] - time.time())
+    feed.expiry = asyncio.get_running_loop().call_later(
+        delay, lambda: asyncio.create_task(_expire(feed)),
+    )
+
+
+async def _expire(feed):
+    if feeds.get(feed.duel) is not feed:
+        return
+    record = await duels.get(tuple(feed.duel.split("|")))
+    if record is None:
+        await _drop(feed)
+        return
+    # overtime or a pause this worker missed
+    feed.state["deadline"], feed.state["paused"] = record["deadline"], record["paused"]
+    _schedule_expiry(feed)
+
+
+async def _drop(feed):
+    if feeds.get(feed.duel) is feed:
+        del feeds[feed.duel]
+    if feed.expiry is not None:
+        feed.expiry.cancel()
+    for viewer in feed.viewers:
+        watching.pop(viewer, None)
+    if feed.viewers:
+        await _backend.hdel(VIEWERS_KEY, feed.duel)
+
+
+async def _on_event(channel, frame):
+    # parsed once per worker, never re-encoded
+    event = json.loads(frame)
+    feed = feeds.get(event["duel"])
+    if feed is None:
+        # nobody watches it here
+        return
+    feed.apply(event["seq"], event, frame)
+    manager.send_local(feed.viewers, frame)
+
+    if event["event"] == "result":
+        await _drop(feed)
+    elif event["event"] == "clock":
+        _schedule_expiry(feed)
+
+
+async def start():
+    await _backend.subscribe(EVENTS_CHANNEL, _on_event)
+
+
+# ---------------------------
+#  viewer side
+# ---------------------------
+async def _load_feed(duel_key):
+    # this worker saw no events for the duel yet (it started elsewhere or
+    # before a restart): rebuild the state from the duel record
+    duel = duel_id(duel_key)
+    record = await duels.get(duel_key)
+    if record is None:
+        return None
+    state = _empty_state(duel)
+    state.update({
+        "slug": record["slug"],
+        "title": record["title"],
+        "difficulty": record["difficulty"],
+        "deadline": record["deadline"],
+        "paused": record["paused"],
+        "progress": record["progress"],
+        "code": record["code"],
+        "finished": sorted(record["finished"]),
+    })
+    seq = int(float(await _backend.hget(SEQ_KEY, duel) or 0))
+    feed = feeds.get(duel)
+    if feed is None:
+        feed = feeds[duel] = DuelFeed(duel, state, seq)
+        _schedule_expiry(feed)
+    return feed
+
+
+async def watch(username, duel_key):
+    duel_key = tuple(sorted(duel_key))
+    # first, so switching from this same duel doesn't drop its feed under us
+    await unwatch(username)
+    duel = duel_id(duel_key)
+    # counted before the record is read, so anything publish() skips as
+    # unwatched is already in the record we build the feed from
+    await _backend.hincrbyfloat(VIEWERS_KEY, duel, 1)
+    feed = feeds.get(duel) or await _load_feed(duel_key)
+    if feed is None:
+        await _uncount(duel)
+        return False
+
+    feed.viewers.add(username)
+    watching[username] = feed.duel
+    manager.send_local([username], feed.snapshot)
+    for frame in feed.deltas:
+        manager.send_local([username], frame)
+    return True
+
+
+async def unwatch(username):
+    duel = watching.pop(username, None)
+    if duel is None:
+        return
+    feed = feeds.get(duel)
+    if feed is not None:
+        feed.viewers.discard(username)
+        if not feed.viewers:
+            await _drop(feed)
+        await _uncount(duel)
+
+
+async def _uncount(duel):
+    if await _backend.hincrbyfloat(VIEWERS_KEY, duel, -1) <= 0:
+        await _backend.hdel(VIEWERS_KEY, duel)
+
+
+async def live_duels(limit=50):
+    # running duels, most watched first
+    running = await _backend.zrangebyscore(duels.DEADLINES_KEY, time.time(), float("inf"))
+    counts = await _backend.hmget(VIEWERS_KEY, [member for member, _ in running])
+    rows = [
+        {"players": member.split("|"), "deadline": deadline, "viewers": int(float(count or 0))}
+        for (member, deadline), count in zip(running, counts)
+    ]
+    rows.sort(key=lambda row: -row["viewers"])
+    return rows[:limit]
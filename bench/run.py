@@ -0,0 +1,361 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from websockets.asyncio.client import connect
+
+from bench.stats import LagMonitor, summarize
+
+#---------------------------------------------------------
+# end-to-end benchmark: python -m bench.run [--clients 2000] [--out file.json]
+#
+# starts bench/server.py in a subprocess (stubbed Judge0 and problem API,
+# nothing touches the network) and drives simulated players through
+#   connect -> join -> match -> run -> finish -> result
+# every client connects first, then they all join at once.
+#
+#   match    join sent until the "problem" message arrives
+#   verdict  run sent until its "done" event (or the POST /run response),
+#            including retries after a rejection by admission control
+#   result   the duel's second finish sent until each player gets "result"
+#
+# before the load, "boot" records how long the server took to answer "/"
+# and GET /ready from the moment it was started, then times one duel
+# between two players on the just-warmed server (its first requests).
+#
+# latencies are reported as p50/p90/p99 in ms, plus throughput and the
+# event-loop lag of both the server and this driver (if the driver's lag is
+# high, its own numbers are inflated). the report is written as JSON;
+# --baseline prints the change against an earlier report.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONNECT_CONCURRENCY = 200
+STARTUP_TIMEOUT = 30.0
+
+
+class Run:
+    def __init__(self):
+        self.samples = {"connect": [], "match": [], "verdict": [], "result": []}
+        self.errors = {}
+        self.finished_at = {}  # duel key -> {player: time their finish was sent}
+        self.duels = set()
+        self.runs = 0
+        self.passed = 0
+        self.rejected = 0  # runs turned away (and retried) by admission control
+        self.messages = 0
+
+    def error(self, phase, e):
+        key = f"{phase}: {type(e).__name__}"
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+class Player:
+    def __init__(self, name, url, run, timeout):
+        self.name = name
+        self.url = url
+        self.run = run
+        self.timeout = timeout
+        self.ws = None
+        self.inbox = asyncio.Queue()
+        self.reader = None
+
+    async def connect(self):
+        started = time.perf_counter()
+        self.ws = await connect(f"{self.url}/ws/{self.name}", ping_interval=None, max_size=None, open_timeout=60)
+        self.run.samples["connect"].append(time.perf_counter() - started)
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        async for data in self.ws:
+            self.run.messages += 1
+            message = json.loads(data) if data.startswith("{") else {"type": None}
+            if message.get("type") == "ping":
+                await self.ws.send(json.dumps({"type": "pong"}))
+            else:
+                self.inbox.put_nowait((time.perf_counter(), message))
+
+    async def expect(self, predicate):
+        async with asyncio.timeout(self.timeout):
+            while True:
+                received, message = await self.inbox.get()
+                if predicate(message):
+                    return received, message
+
+    async def duel(self, http, run_via):
+        phase = "match"
+        try:
+            sent = time.perf_counter()
+            await self.ws.send(json.dumps({"type": "join"}))
+            received, problem = await self.expect(lambda m: m.get("type") == "problem")
+            self.run.samples["match"].append(received - sent)
+            opponent, slug = problem["opponent"], problem["slug"]
+
+            phase = "verdict"
+            # unique code per player so the result cache doesn't answer for Judge0;
+            # a run turned away by admission control is retried after retry_after
+            code = f"# {slug} {self.name}\nprint(solve())\n"
+            sent = time.perf_counter()
+            while True:
+                if run_via == "http":
+                    response = await http.post("/run", json={"slug": slug, "code": code, "username": self.name})
+                    received, done = time.perf_counter(), response.json()
+                    if response.status_code == 429:
+                        done["event"] = "rejected"
+                else:
+                    await self.ws.send(json.dumps({"type": "run", "run_id": self.name, "slug": slug, "code": code}))
+                    received, done = await self.expect(
+                        lambda m: m.get("type") == "run" and m.get("event") in ("done", "error", "rejected")
+                    )
+                if done.get("event") != "rejected":
+                    break
+                self.run.rejected += 1
+                await asyncio.sleep(done.get("retry_after") or 1)
+            self.run.samples["verdict"].append(received - sent)
+            self.run.runs += 1
+            self.run.passed += bool(done.get("all_passed"))
+
+            phase = "result"
+            duel_key = tuple(sorted((self.name, opponent)))
+            self.run.finished_at.setdefault(duel_key, {})[self.name] = time.perf_counter()
+            await self.ws.send(f"finish:{opponent}")
+            received, _ = await self.expect(lambda m: m.get("type") == "result")
+            both = self.run.finished_at[duel_key]
+            if len(both) == 2:
+                self.run.samples["result"].append(received - max(both.values()))
+            self.run.duels.add(duel_key)
+        except Exception as e:
+            self.run.error(phase, e)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.ws is not None:
+            await self.ws.close()
+
+
+# ---------------------------
+#  server process
+# ---------------------------
+def start_server(args, workdir):
+    command = [
+        sys.executable, "-m", "bench.server",
+        "--port", str(args.port),
+        "--db", os.path.join(workdir, "bench.sqlite"),
+        "--judge-latency", str(args.judge_latency),
+        "--problem-latency", str(args.problem_latency),
+    ]
+    env = {**os.environ, "PYTHONPATH": ROOT, "WS_HEARTBEAT_INTERVAL": "3600"}
+    log = open(os.path.join(workdir, "server.log"), "w")
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT), log.name
+
+
+async def wait_for(http, server, path, deadline):
+    # the status code once the path answers something other than 503
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("benchmark server exited during startup")
+        try:
+            status = (await http.get(path)).status_code
+            if status != 503:
+                return status
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.02)
+    raise RuntimeError("benchmark server did not come up")
+
+
+async def wait_ready(http, server, started):
+    # seconds from starting the server until it answered, and until it was
+    # ready (the same, on a revision without GET /ready)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    await wait_for(http, server, "/", deadline)
+    listening = time.perf_counter() - started
+    await wait_for(http, server, "/ready", deadline)
+    return {"listening_s": round(listening, 3), "ready_s": round(time.perf_counter() - started, 3)}
+
+
+# ---------------------------
+#  benchmark
+# ---------------------------
+async def first_duel(http, args):
+    # one duel on a server nobody has used yet; the slower player's time per phase
+    run = Run()
+    pair = [Player(f"boot{i}", f"ws://127.0.0.1:{args.port}", run, args.timeout) for i in range(2)]
+    try:
+        for player in pair:
+            await player.connect()
+        await asyncio.gather(*(p.duel(http, args.run_via) for p in pair))
+    finally:
+        await asyncio.gather(*(p.close() for p in pair), return_exceptions=True)
+    if run.errors:
+        raise RuntimeError(f"first duel failed: {run.errors}")
+    return {phase: round(max(samples) * 1000, 2) for phase, samples in run.samples.items() if samples}
+
+
+async def benchmark(args, boot):
+    base = f"http://127.0.0.1:{args.port}"
+    run = Run()
+    players = [Player(f"bench{i}", f"ws://127.0.0.1:{args.port}", run, args.timeout) for i in range(args.clients)]
+    client_lag = LagMonitor()
+
+    async with httpx.AsyncClient(base_url=base, timeout=args.timeout,
+                                 limits=httpx.Limits(max_connections=CONNECT_CONCURRENCY)) as http:
+        boot["first_ms"] = await first_duel(http, args)
+        await http.get("/bench/lag", params={"reset": True})
+
+        gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+        async def connect_one(player):
+            async with gate:
+                try:
+                    await player.connect()
+                except Exception as e:
+                    run.error("connect", e)
+
+        await asyncio.gather(*(connect_one(p) for p in players))
+        connected = [p for p in players if p.ws is not None]
+        print(f"{len(connected)}/{len(players)} clients connected")
+
+        await http.get("/bench/lag", params={"reset": True})
+        client_lag.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(p.duel(http, args.run_via) for p in connected))
+        wall = time.perf_counter() - started
+        client_lag.stop()
+        server_lag = (await http.get("/bench/lag")).json()
+        upstream = (await http.get("/bench/stubs")).json()
+
+        await asyncio.gather(*(p.close() for p in connected), return_exceptions=True)
+
+    return {
+        "boot": boot,
+        "latency_ms": {phase: summarize(samples) for phase, samples in run.samples.items()},
+        "throughput": {
+            "wall_s": round(wall, 3),
+            "duels_per_s": round(len(run.duels) / wall, 2),
+            "runs_per_s": round(run.runs / wall, 2),
+            "messages_per_s": round(run.messages / wall, 2),
+        },
+        "event_loop_lag_ms": {"server": server_lag, "client": summarize(client_lag.samples)},
+        "counts": {
+            "clients": args.clients,
+            "connected": len(connected),
+            "duels": len(run.duels),
+            "runs": run.runs,
+            "runs_passed": run.passed,
+            "runs_rejected": run.rejected,
+            "messages": run.messages,
+            "upstream_requests": upstream,
+        },
+        "errors": run.errors,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    print(f"\nvs {baseline.get('meta', {}).get('revision')} ({baseline.get('meta', {}).get('timestamp')})")
+    for phase, now in report["latency_ms"].items():
+        before = baseline.get("latency_ms", {}).get(phase, {})
+        for stat in ("p50", "p99"):
+            if stat in now and before.get(stat):
+                change = (now[stat] - before[stat]) / before[stat] * 100
+                print(f"  {phase:8} {stat}: {before[stat]:9.2f} -> {now[stat]:9.2f} ms ({change:+.1f}%)")
+    for key, now in report["throughput"].items():
+        before = baseline.get("throughput", {}).get(key)
+        if before:
+            print(f"  {key:15}: {before:9.2f} -> {now:9.2f} ({(now - before) / before * 100:+.1f}%)")
+    boot, before = report["boot"], baseline.get("boot", {})
+    for key in ("listening_s", "ready_s"):
+        if before.get(key):
+            print(f"  {key:15}: {before[key]:9.3f} -> {boot[key]:9.3f} s ({(boot[key] - before[key]) / before[key] * 100:+.1f}%)")
+    for phase, now in boot["first_ms"].items():
+        then = before.get("first_ms", {}).get(phase)
+        if then:
+            print(f"  first {phase:9}: {then:9.2f} -> {now:9.2f} ms ({(now - then) / then * 100:+.1f}%)")
+
+
+def print_report(report):
+    boot = report["boot"]
+    first = "  ".join(f"{phase}={ms:.2f}ms" for phase, ms in boot["first_ms"].items())
+    print(f"  boot: listening {boot['listening_s']}s, ready {boot['ready_s']}s; first duel {first}")
+    for phase, stats in report["latency_ms"].items():
+        if stats["count"]:
+            print(f"  {phase:8} n={stats['count']:<6} p50={stats['p50']:>9.2f}ms  p99={stats['p99']:>9.2f}ms  max={stats['max']:>9.2f}ms")
+    print(f"  throughput: {report['throughput']}")
+    lag = report["event_loop_lag_ms"]
+    print(f"  loop lag p99: server {lag['server'].get('p99')}ms, driver {lag['client'].get('p99')}ms")
+    if report["errors"]:
+        print(f"  errors: {report['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark")
+    parser.add_argument("--clients", type=int, default=2000, help="simulated players (two per duel)")
+    parser.add_argument("--run-via", choices=("ws", "http"), default="ws", help="socket 'run' or POST /run")
+    parser.add_argument("--judge-latency", type=float, default=0.05, help="seconds the Judge0 stub takes per run")
+    parser.add_argument("--problem-latency", type=float, default=0.2, help="seconds the problem API stub takes")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-step timeout, seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--out", help="where to write the JSON report (default bench/results/<time>.json)")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="lcduel-bench-") as workdir:
+        started = time.perf_counter()
+        server, log_path = start_server(args, workdir)
+        try:
+            async def go():
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}") as http:
+                    boot = await wait_ready(http, server, started)
+                return await benchmark(args, boot)
+
+            report = asyncio.run(go())
+        except Exception:
+            print(open(log_path).read()[-4000:])
+            raise
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "clients": args.clients,
+            "run_via": args.run_via,
+            "judge_latency": args.judge_latency,
+            "problem_latency": args.problem_latency,
+        },
+        **report,
+    }
+    out = args.out or os.path.join(ROOT, "bench", "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"report written to {out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import os
+
+#---------------------------------------------------------
+# the app as the benchmark sees it: python -m bench.server --db <path>
+#
+# a fresh sqlite catalog seeded from app/seed_problems.py, in-memory state,
+# Judge0 and the problem API replaced by bench/stubs.py. two extra routes
+# for the driver:
+#   GET /bench/lag?reset=1   event-loop lag since the last reset
+#   GET /bench/stubs         requests the stubs have served
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app against stubbed upstreams")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--db", required=True, help="sqlite file to create (overwritten)")
+    parser.add_argument("--judge-latency", type=float, default=0.05)
+    parser.add_argument("--problem-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # before anything from app/ is imported: engines and backends read these
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    os.environ["STATE_BACKEND"] = "memory"
+    os.environ["EXECUTOR"] = "judge0"
+    os.environ.setdefault("RAPIDAPI_KEY", "bench")
+
+    from sqlalchemy import select
+
+    from app.database import Base, Problem, engine
+    from app.seed_problems import seed_problems
+
+    Base.metadata.create_all(engine)
+    seed_problems()
+    with engine.connect() as conn:
+        answers = {
+            (row.slug, case["input"].strip()): case["expected_output"].strip()
+            for row in conn.execute(select(Problem.slug, Problem.testcases))
+            for case in row.testcases or []
+        }
+
+    from bench import stubs
+    from bench.stats import LagMonitor, summarize
+
+    judge, api = stubs.install(answers, args.judge_latency, args.problem_latency)
+    monitor = LagMonitor()
+
+    from app.main import app
+
+    @app.get("/bench/lag")
+    async def lag(reset: bool = False):
+        if monitor.task is None:
+            monitor.start()
+        samples = monitor.samples
+        if reset:
+            monitor.reset()
+        return summarize(samples)
+
+    @app.get("/bench/stubs")
+    async def stub_counts():
+        return {"judge0": judge.requests, "problem_api": api.requests}
+
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", backlog=4096)
+
+
+if __name__ == "__main__":
+    main()
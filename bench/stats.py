@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+#---------------------------------------------------------
+# latency summaries and an event-loop lag probe, shared by the benchmark
+# server and driver
+
+
+def summarize(samples):
+    # seconds in, milliseconds out
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50": pct(0.50),
+        "p90": pct(0.90),
+        "p99": pct(0.99),
+        "max": round(ordered[-1] * 1000, 2),
+    }
+
+
+class LagMonitor:
+    # sleeps INTERVAL at a time and records how late it wakes up: anything
+    # above zero is time the loop spent busy with something else
+    INTERVAL = 0.01
+
+    def __init__(self):
+        self.samples = []
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def reset(self):
+        self.samples = []
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.INTERVAL
+            await asyncio.sleep(self.INTERVAL)
+            self.samples.append(max(0.0, time.perf_counter() - expected))
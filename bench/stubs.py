@@ -0,0 +1,90 @@
+import asyncio
+import itertools
+import json
+import time
+
+import httpx
+
+#---------------------------------------------------------
+# offline stand-ins for Judge0 and the alfa-leetcode-api, plugged into the
+# app's httpx clients as transports so no request leaves the process
+#
+# the Judge0 stub answers with each case's expected output, so a benchmark
+# run passes like a correct submission would (bench code starts with
+# "# <slug>", answers are looked up by (slug, stdin)). it keeps Judge0's
+# shape: batch submit returns tokens, polling reports "Processing" until
+# `latency` has passed, wait=true sleeps for `latency`.
+
+
+class Judge0Stub:
+    def __init__(self, answers, latency=0.05):
+        self.answers = answers  # (slug, stdin) -> stdout
+        self.latency = latency
+        self.tokens = {}  # token -> (ready_at, submission)
+        self.counter = itertools.count()
+        self.requests = 0
+
+    def _finished(self, submission):
+        slug = submission["source_code"].split("\n", 1)[0].lstrip("# ").split(" ")[0]
+        return {
+            "stdout": self.answers.get((slug, submission["stdin"]), ""),
+            "stderr": None,
+            "compile_output": None,
+            "status": {"id": 3, "description": "Accepted"},
+        }
+
+    async def handle(self, request):
+        self.requests += 1
+        if request.url.path.endswith("/batch") and request.method == "POST":
+            ready_at = time.monotonic() + self.latency
+            tokens = []
+            for submission in json.loads(request.content)["submissions"]:
+                token = f"b{next(self.counter)}"
+                self.tokens[token] = (ready_at, submission)
+                tokens.append({"token": token})
+            return httpx.Response(201, json=tokens)
+
+        if request.url.path.endswith("/batch"):
+            now = time.monotonic()
+            submissions = []
+            for token in request.url.params["tokens"].split(","):
+                ready_at, submission = self.tokens[token]
+                if now < ready_at:
+                    submissions.append({"token": token, "status": {"id": 2, "description": "Processing"}})
+                else:
+                    del self.tokens[token]
+                    submissions.append({"token": token, **self._finished(submission)})
+            return httpx.Response(200, json={"submissions": submissions})
+
+        if request.method == "POST":
+            await asyncio.sleep(self.latency)
+            return httpx.Response(201, json=self._finished(json.loads(request.content)))
+        return httpx.Response(404)
+
+
+class ProblemApiStub:
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.requests = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        slug = request.url.params.get("titleSlug", "")
+        return httpx.Response(200, json={
+            "questionTitle": slug.replace("-", " ").title(),
+            "question": f"<p>Benchmark statement for {slug}.</p>",
+            "link": f"https://leetcode.com/problems/{slug}/",
+            "topicTags": [],
+        })
+
+
+def install(answers, judge_latency=0.05, problem_latency=0.2):
+    # call before the app starts: the lifespan keeps an existing Judge0 client
+    from app import judge0, problems
+
+    judge = Judge0Stub(answers, judge_latency)
+    api = ProblemApiStub(problem_latency)
+    judge0.client = judge0.Judge0Client(transport=httpx.MockTransport(judge.handle))
+    problems._http = httpx.AsyncClient(transport=httpx.MockTransport(api.handle))
+    return judge, api
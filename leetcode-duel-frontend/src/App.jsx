@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import Editor from "@monaco-editor/react";
 
 // Default code templates for each language
@@ -47,9 +47,71 @@ function App() {
   const [code, setCode] = useState(CODE_TEMPLATES.python);
   const [output, setOutput] = useState("");
   const [isRunning, setIsRunning] = useState(false);
+  const [failFast, setFailFast] = useState(false);
+  const [opponentProgress, setOpponentProgress] = useState("");
+  const [opponentCode, setOpponentCode] = useState("");
+  // live code sync: our edits go out as [pos, deleteCount, text] ops
+  const codeSeq = useRef(0);
+  const codeRef = useRef(code);
+  codeRef.current = code;
+  // last revision of the opponent's code we have; null = wait for a full text
+  const opponentRev = useRef(0);
+  const problemRef = useRef(problem);
+  problemRef.current = problem;
+  // reconnect after a dropped socket, backing off, unless we closed it
+  const manualClose = useRef(false);
+  const retryDelay = useRef(1000);
+
+  // apply ops from the server to the opponent's copy
+  const applyOps = (text, ops) =>
+    ops.reduce(
+      (acc, [pos, del, ins]) => acc.slice(0, pos) + ins + acc.slice(pos + del),
+      text
+    );
+
+  const sendFullCode = (socket, text) => {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ type: "code", seq: codeSeq.current, text }));
+    }
+  };
+
+  const handleCodeChange = (value, event) => {
+    setCode(value);
+    if (!ws || ws.readyState !== WebSocket.OPEN || !opponent || !event) return;
+    // monaco reports offsets against the text before the change, so apply
+    // the later offsets first
+    const ops = [...event.changes]
+      .sort((a, b) => b.rangeOffset - a.rangeOffset)
+      .map((c) => [c.rangeOffset, c.rangeLength, c.text]);
+    codeSeq.current += 1;
+    ws.send(JSON.stringify({ type: "code", seq: codeSeq.current, ops }));
+  };
+
+  // --- Format run results ---
+  const formatResults = (results) =>
+    results
+      .map((r, i) => {
+        const lines = [
+          `Test Case #${i + 1}`,
+          `Input: ${r.input}`,
+          `Expected: ${r.expected}`,
+          `Output: ${r.output || "null"}`,
+          `Status: ${r.status}`,
+          `Passed: ${r.passed ? "✅" : "❌"}`,
+        ];
+
+        if (r.error) {
+          lines.push(`Error: ${r.error}`);
+        }
+
+        return lines.join("\n");
+      })
+      .join("\n\n" + "=".repeat(50) + "\n\n");
 
   // --- Timer State ---
   const [timeLeft, setTimeLeft] = useState(600); // 10 minutes
+  // the server stopped the clock (an admin paused the duel)
+  const clockPaused = useRef(false);
 
   // Timer countdown
   useEffect(() => {
@@ -57,6 +119,7 @@ function App() {
 
     const timer = setInterval(() => {
       setTimeLeft((prev) => {
+        if (clockPaused.current) return prev;
         if (prev <= 1) {
           handleTimeUp();
           return 0;
@@ -90,9 +153,14 @@ function App() {
       return alert("Please enter a username first!");
     }
 
-    const socket = new WebSocket(`ws://127.0.0.1:8000/ws/${username}`);
+    // the token from our last connection lets the server hand our duel back
+    manualClose.current = false;
+    const token = sessionStorage.getItem(`lcduel:token:${username}`);
+    const query = token ? `?token=${encodeURIComponent(token)}` : "";
+    const socket = new WebSocket(`ws://127.0.0.1:8000/ws/${username}${query}`);
 
     socket.onopen = () => {
+      retryDelay.current = 1000;
       setStatus("✅ Connected! Click 'Join Duel' to find an opponent.");
     };
 
@@ -100,19 +168,128 @@ function App() {
       const data = JSON.parse(event.data);
 
       switch (data.type) {
+        case "ping":
+          socket.send(JSON.stringify({ type: "pong" }));
+          break;
+
         case "status":
           setStatus(data.message);
           break;
 
+        case "session":
+          sessionStorage.setItem(`lcduel:token:${username}`, data.token);
+          break;
+
+        case "resume": {
+          // back after a dropped connection: the duel as the server has it;
+          // code typed here meanwhile wins over the server's copy
+          const restored = problemRef.current
+            ? codeRef.current
+            : data.code ?? CODE_TEMPLATES[language];
+          setProblem(data.problem);
+          setOpponent(data.opponent);
+          setStatus(`🔄 Reconnected! Opponent: ${data.opponent}`);
+          clockPaused.current = data.paused != null;
+          setTimeLeft(
+            Math.max(0, Math.round(data.paused ?? data.deadline - Date.now() / 1000))
+          );
+          setOpponentCode(data.opponent_code || "");
+          opponentRev.current = null;
+          const theirs = data.progress[data.opponent];
+          if (theirs) {
+            setOpponentProgress(`${data.opponent}: ${theirs.passed}/${theirs.total} passing`);
+          }
+          if (data.verdict) {
+            setOutput(
+              `Last run: ${data.verdict.passed}/${data.verdict.total} passing\n` +
+                data.verdict.cases
+                  .map((c, i) => `Test Case #${i + 1}: ${c.passed ? "✅" : "❌"} ${c.status}`)
+                  .join("\n")
+            );
+          }
+          setCode(restored);
+          codeRef.current = restored;
+          codeSeq.current = 0;
+          sendFullCode(socket, restored);
+          break;
+        }
+
         case "problem":
           setProblem(data);
           setOpponent(data.opponent);
           setStatus(`🎯 Match found! Opponent: ${data.opponent}`);
           setTimeLeft(600); // Reset timer
+          clockPaused.current = false;
+          setOpponentCode("");
+          opponentRev.current = 0;
+          codeSeq.current = 0;
+          sendFullCode(socket, codeRef.current);
+          break;
+
+        case "clock":
+          // overtime, pause or resume
+          clockPaused.current = data.paused != null;
+          setTimeLeft(
+            Math.max(0, Math.round(data.paused ?? data.deadline - Date.now() / 1000))
+          );
+          setStatus(clockPaused.current ? "⏸️ Duel paused" : "⏱️ Clock updated");
+          break;
+
+        case "code":
+          if (data.event === "resync") {
+            sendFullCode(socket, codeRef.current);
+          } else if (data.text !== undefined) {
+            setOpponentCode(data.text);
+            opponentRev.current = data.rev;
+          } else if (opponentRev.current !== null && data.rev === opponentRev.current + 1) {
+            setOpponentCode((prev) => applyOps(prev, data.ops));
+            opponentRev.current = data.rev;
+          } else {
+            // missed a revision: ops won't apply until the next full text
+            opponentRev.current = null;
+          }
+          break;
+
+        case "statement":
+          setProblem((prev) =>
+            prev && prev.slug === data.slug ? { ...prev, ...data } : prev
+          );
+          break;
+
+        case "run":
+          if (data.event === "start") {
+            setOutput(`Running 0/${data.total}...`);
+          } else if (data.event === "case") {
+            setOutput((prev) =>
+              prev +
+              `\nTest Case #${data.index + 1}: ${data.passed ? "✅" : "❌"} ${data.status}`
+            );
+          } else if (data.event === "done") {
+            setIsRunning(false);
+            setOutput(
+              data.all_passed
+                ? "✅ All test cases passed! You can click 'Finish' when ready."
+                : formatResults(data.results)
+            );
+          } else if (data.event === "queued") {
+            setOutput(`⏳ Judge is busy: ${data.message}`);
+          } else if (data.event === "rejected") {
+            setIsRunning(false);
+            setOutput(`⚠️ ${data.error}`);
+          } else if (data.event === "error") {
+            setIsRunning(false);
+            setOutput(`❌ Error: ${data.error}`);
+          }
+          break;
+
+        case "progress":
+          setOpponentProgress(data.message);
           break;
 
         case "result":
           alert(data.message);
+          setOpponentProgress("");
+          setOpponentCode("");
           // Reset state after duel ends
           setProblem(null);
           setOpponent("");
@@ -130,9 +307,17 @@ function App() {
       setStatus("❌ Connection error");
     };
 
-    socket.onclose = () => {
-      setStatus("❌ Disconnected");
+    socket.onclose = (event) => {
       setWs(null);
+      if (manualClose.current || event.code === 4001) {
+        // 4001: we connected again from somewhere else
+        setStatus(event.code === 4001 ? "❌ Connected from another tab" : "❌ Disconnected");
+        return;
+      }
+      // dropped: the server keeps our duel, so try again
+      setStatus(`❌ Disconnected, reconnecting in ${retryDelay.current / 1000}s...`);
+      setTimeout(connect, retryDelay.current);
+      retryDelay.current = Math.min(retryDelay.current * 2, 30000);
     };
 
     setWs(socket);
@@ -140,6 +325,7 @@ function App() {
 
   const disconnect = () => {
     if (ws) {
+      manualClose.current = true;
       ws.close();
       setWs(null);
       setStatus("Disconnected");
@@ -164,10 +350,25 @@ function App() {
     setIsRunning(true);
     setOutput("Running...");
 
+    // stream verdicts over the duel socket when we have one
+    if (ws) {
+      ws.send(
+        JSON.stringify({
+          type: "run",
+          slug: problem.slug,
+          code: code,
+          language: language,
+          fail_fast: failFast,
+        })
+      );
+      return;
+    }
+
     const payload = {
       slug: problem.slug,
       code: code,
       language: language,
+      username: username,
     };
 
     try {
@@ -184,26 +385,7 @@ function App() {
       } else if (data.all_passed) {
         setOutput("✅ All test cases passed! You can click 'Finish' when ready.");
       } else {
-        const resultText = data.results
-          .map((r, i) => {
-            const lines = [
-              `Test Case #${i + 1}`,
-              `Input: ${r.input}`,
-              `Expected: ${r.expected}`,
-              `Output: ${r.output || "null"}`,
-              `Status: ${r.status}`,
-              `Passed: ${r.passed ? "✅" : "❌"}`,
-            ];
-            
-            if (r.error) {
-              lines.push(`Error: ${r.error}`);
-            }
-            
-            return lines.join("\n");
-          })
-          .join("\n\n" + "=".repeat(50) + "\n\n");
-        
-        setOutput(resultText);
+        setOutput(formatResults(data.results));
       }
     } catch (error) {
       console.error("Run error:", error);
@@ -274,6 +456,7 @@ function App() {
           <strong style={{ color: timeLeft < 60 ? "#ff4444" : "#4CAF50" }}>
             {formatTime(timeLeft)}
           </strong>
+          {opponentProgress && <span> · {opponentProgress}</span>}
         </div>
       )}
 
@@ -320,6 +503,14 @@ function App() {
             </div>
 
             <div>
+              <label style={styles.label}>
+                <input
+                  type="checkbox"
+                  checked={failFast}
+                  onChange={(e) => setFailFast(e.target.checked)}
+                />{" "}
+                Stop at first failure
+              </label>
               <button
                 onClick={handleRun}
                 disabled={isRunning}
@@ -337,7 +528,7 @@ function App() {
             height="450px"
             language={language}
             value={code}
-            onChange={(value) => setCode(value)}
+            onChange={handleCodeChange}
             theme="vs-dark"
             options={{
               minimap: { enabled: false },
@@ -348,6 +539,13 @@ function App() {
             }}
           />
 
+          {opponentCode && (
+            <details style={styles.outputPanel}>
+              <summary>👀 {opponent}'s code</summary>
+              <pre style={styles.outputText}>{opponentCode}</pre>
+            </details>
+          )}
+
           {/* Output Panel */}
           {output && (
             <div style={styles.outputPanel}>
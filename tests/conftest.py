@@ -0,0 +1,4 @@
+import os
+
+# app.database builds its engines at import; nothing here opens a connection
+os.environ.setdefault("DATABASE_URL", "sqlite://")
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from app import admission as admission_module
+from app.admission import Admission, FairQueue, Overloaded, RateLimited, TokenBuckets
+
+#---------------------------------------------------------
+# token buckets and the fair queue on their own (with explicit clocks),
+# then Admission with a single executor slot
+
+
+def test_bucket_burst_then_refill():
+    buckets = TokenBuckets(rate=0.5, burst=3)
+    assert [buckets.take("a", now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("a", now=0.0) == pytest.approx(2.0)
+    # other keys have their own bucket
+    assert buckets.take("b", now=0.0) == 0.0
+
+    assert buckets.take("a", now=1.0) == pytest.approx(1.0)
+    assert buckets.take("a", now=2.0) == 0.0
+    # never more than the burst, however long it's been
+    assert [buckets.take("a", now=1000.0) for _ in range(4)][-1] > 0
+
+
+def test_bucket_refund():
+    buckets = TokenBuckets(rate=0.0, burst=1)
+    assert buckets.take("a", now=0.0) == 0.0
+    assert buckets.take("a", now=5.0) == float("inf")
+    buckets.refund("a")
+    assert buckets.take("a", now=5.0) == 0.0
+
+
+def test_fair_queue_is_round_robin():
+    queue = FairQueue()
+    for waiter in ("a1", "a2", "a3"):
+        queue.push("a", waiter)
+    queue.push("b", "b1")
+    queue.push("c", "c1")
+
+    assert len(queue) == 5 and queue.pending("a") == 3
+    assert [queue.position("a", w) for w in ("a1", "a2", "a3")] == [1, 4, 5]
+    assert queue.position("b", "b1") == 2
+    assert queue.position("c", "c1") == 3
+
+    queue.remove("a", "a2")
+    assert [queue.pop() for _ in range(len(queue))] == ["a1", "b1", "c1", "a3"]
+    assert not queue.ring
+
+
+def _admission():
+    admission = Admission(slots=1)
+    admission.users = TokenBuckets(100, 100)
+    admission.duels = TokenBuckets(100, 100)
+    return admission
+
+
+def test_rate_limited_before_queueing():
+    async def test():
+        admission = _admission()
+        admission.duels = TokenBuckets(0.0, 1)
+        async with admission.admit("a", "d"):
+            pass
+        with pytest.raises(RateLimited):
+            async with admission.admit("b", "d"):
+                pass
+        # the duel bucket refused, so the player's token went back
+        assert admission.users.buckets["b"][0] == pytest.approx(100)
+    asyncio.run(test())
+
+
+def test_waiters_take_turns_for_the_slot():
+    async def test():
+        admission = _admission()
+        order, positions = [], {}
+        release = asyncio.Event()
+
+        async def run(user, tag):
+            async def queued(position):
+                positions[tag] = position
+
+            async with admission.admit(user, on_queued=queued):
+                order.append(tag)
+                if tag == "first":
+                    await release.wait()
+
+        first = asyncio.create_task(run("a", "first"))
+        await asyncio.sleep(0)
+        waiting = []
+        for user, tag in (("a", "a2"), ("a", "a3"), ("b", "b1")):
+            waiting.append(asyncio.create_task(run(user, tag)))
+            await asyncio.sleep(0)
+        assert admission.running == 1 and len(admission.queue) == 3
+        assert positions == {"a2": 1, "a3": 2, "b1": 2}
+
+        release.set()
+        await asyncio.gather(first, *waiting)
+        assert order == ["first", "a2", "b1", "a3"]
+        assert admission.running == 0 and not admission.queue
+    asyncio.run(test())
+
+
+def test_full_queue_refunds_the_tokens(monkeypatch):
+    monkeypatch.setattr(admission_module, "USER_QUEUE_LIMIT", 1)
+
+    async def test():
+        admission = _admission()
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.admit("a"):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()), asyncio.create_task(hold())]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            async with admission.admit("a"):
+                pass
+        # 3 taken, the turned-away one given back
+        assert admission.users.buckets["a"][0] == pytest.approx(98, abs=0.1)
+        release.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(test())
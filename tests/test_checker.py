@@ -0,0 +1,72 @@
+from app import checker
+from app.checker import Check, prepare
+
+#---------------------------------------------------------
+# one test per checker mode, through Check.matches_text and, for the
+# streamed modes, an output split across chunks
+
+
+def _chunked(check, output, size=3):
+    return check.matches(lambda: (output[i:i + size] for i in range(0, len(output), size)))
+
+
+def test_auto():
+    check = Check("[1, 2]\n")
+    assert check.matches_text("[1, 2]")
+    assert check.matches_text("  [1,2]  ")
+    assert check.matches_text("(1, 2)")
+    assert not check.matches_text("[2, 1]")
+
+    assert Check("true").matches_text("True")
+    assert not Check("1").matches_text("True")
+
+    # tolerance only where the expected number isn't an integer
+    assert Check("0.3333333").matches_text("0.33333333")
+    assert not Check("1").matches_text("1.0000001")
+    assert Check("1").matches_text("1.0")
+    assert not Check("[1, 2]").matches_text("[1, 2.0000001]")
+    assert Check("[0.5, 2]").matches_text("[0.5000000001, 2]")
+    assert _chunked(Check("10 20 30"), "10 20 30\n")
+    assert not _chunked(Check("10 20 30"), "10 20 3")
+
+
+def test_tokens():
+    check = Check("1 2\n3", mode="tokens")
+    assert check.matches_text("1\n2 3")
+    assert not check.matches_text("[1, 2, 3]")
+    assert not Check("0.5", mode="tokens").matches_text("0.5000000001")
+    assert _chunked(check, "1  2 3")
+
+
+def test_float():
+    check = Check("3.14159", mode="float", tolerance=1e-3)
+    assert check.matches_text("3.1416")
+    assert not check.matches_text("3.2")
+    # integers get the tolerance too
+    assert Check("1", mode="float").matches_text("1.0000001")
+    assert not Check("1", mode="float").matches_text("1.1")
+
+
+def test_unordered():
+    check = Check("[[1, 2], [3]]", mode="unordered")
+    assert check.matches_text("[[3], [2, 1]]")
+    assert not check.matches_text("[[3], [2]]")
+    assert Check("b a c", mode="unordered").matches_text("c b a")
+    assert not Check("b a c", mode="unordered").matches_text("c b")
+
+
+def test_exact():
+    check = Check("a  b\n", mode="exact")
+    assert check.matches_text("a  b")
+    assert not check.matches_text("a b")
+
+
+def test_custom():
+    @checker.checker("test-lowercase")
+    def same_lowercase(expected, output):
+        return expected.lower() == output.strip().lower()
+
+    [case] = prepare([{"input": "", "expected_output": "Yes"}], "test-lowercase")
+    assert not case["check"].streams
+    assert case["check"].matches_text("YES\n")
+    assert not case["check"].matches_text("no")
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from app.websocket import code_sync
+from app.websocket.code_sync import apply_ops, coalesce
+
+#---------------------------------------------------------
+# applying editor ops, and coalescing a burst of them without changing
+# the text they produce
+
+
+def test_apply_ops_in_order():
+    text = "def f():\n    pass"
+    assert apply_ops(text, []) == text
+    assert apply_ops(text, [[13, 4, "return 1"], [0, 0, "# x\n"]]) == "# x\ndef f():\n    return 1"
+    # each op sees the text the previous one left
+    assert apply_ops("ab", [[2, 0, "c"], [3, 0, "d"], [0, 1, ""]]) == "bcd"
+
+
+@pytest.mark.parametrize("ops", [
+    [[-1, 0, "x"]],
+    [[1, 2, ""]],
+    [[0, 0, 5]],
+    [["0", 0, "x"]],
+    [[0, 0]],
+])
+def test_apply_ops_rejects_bad_ops(ops):
+    with pytest.raises((ValueError, TypeError)):
+        apply_ops("ab", ops)
+
+
+def test_apply_ops_caps_the_length(monkeypatch):
+    monkeypatch.setattr(code_sync, "MAX_CODE_LENGTH", 4)
+    assert apply_ops("abc", [[3, 0, "d"]]) == "abcd"
+    with pytest.raises(ValueError):
+        apply_ops("abc", [[3, 0, "de"]])
+
+
+def test_typing_and_backspacing_collapse():
+    typed = [[0, 0, "r"], [1, 0, "e"], [2, 0, "t"], [3, 0, "x"], [3, 1, ""]]
+    assert coalesce(typed) == [[0, 0, "ret"]]
+    # backspace, then delete forward from the same place
+    assert coalesce([[5, 1, ""], [4, 1, ""], [4, 2, ""]]) == [[4, 4, ""]]
+    # typed and erased again: nothing left to send
+    assert coalesce([[2, 0, "ab"], [3, 1, ""], [2, 1, ""]]) == []
+    # unrelated edits stay apart
+    assert coalesce([[0, 0, "a"], [9, 0, "b"]]) == [[0, 0, "a"], [9, 0, "b"]]
+
+
+def _random_ops(rng, text, count):
+    # mostly typing and backspacing at a cursor, with the odd jump
+    ops, cursor = [], len(text)
+    for _ in range(count):
+        if rng.random() < 0.1:
+            cursor = rng.randint(0, len(text))
+        roll = rng.random()
+        if roll < 0.6:
+            op = [cursor, 0, rng.choice("ab\n ")]
+        elif roll < 0.8 and cursor:
+            op = [cursor - 1, 1, ""]
+        elif cursor < len(text):
+            op = [cursor, rng.randint(1, len(text) - cursor), ""]
+        else:
+            op = [cursor, 0, "xy"]
+        text = apply_ops(text, [op])
+        cursor = op[0] + len(op[2])
+        ops.append(op)
+    return ops
+
+
+def test_coalesced_ops_give_the_same_text():
+    rng = random.Random(7)
+    for _ in range(300):
+        text = "".join(rng.choice("abc\n") for _ in range(rng.randint(0, 20)))
+        ops = _random_ops(rng, text, rng.randint(1, 30))
+        merged = coalesce([list(op) for op in ops])
+        assert len(merged) <= len(ops)
+        assert apply_ops(text, merged) == apply_ops(text, ops)
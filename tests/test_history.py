@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from sqlalchemy import func, select
+
+from app import database, history as history_module
+from app.database import Base, Duel, Submission, async_engine
+from app.history import MAX_ATTEMPTS, WriteBehind
+
+#---------------------------------------------------------
+# the write-behind buffer against a fresh in-memory SQLite database
+
+
+def _run(test):
+    async def main():
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            await test(WriteBehind())
+        finally:
+            await async_engine.dispose()
+    asyncio.run(main())
+
+
+def _duel(duel_id):
+    return {"id": duel_id, "start": time.time(), "slug": "two-sum"}
+
+
+async def _count(table):
+    async with async_engine.connect() as conn:
+        return await conn.scalar(select(func.count()).select_from(table))
+
+
+def test_a_refused_row_does_not_hold_up_the_rest():
+    async def test(history):
+        history.record_duel(("a", "b"), _duel("d1"), "a")
+        await history.flush()
+
+        # the same duel id again: the DB will always refuse it
+        history.record_duel(("a", "b"), _duel("d1"), "a")
+        history.record_duel(("c", "d"), _duel("d2"), "draw")
+        history.record_run("c", "d2", "two-sum", "python", "print(1)", [{"passed": True, "status": "Accepted"}], "ws")
+        await history.flush()
+        assert await _count(Duel) == 2
+        assert await _count(Submission) == 1 and await _count(database.TestResult) == 1
+        assert history.buffered == 1
+
+        for _ in range(MAX_ATTEMPTS - 1):
+            await history.flush()
+        assert history.buffered == 0 and history.attempts == {}
+        assert history_module.refused.labels("duels").value >= 1
+    _run(test)
+
+
+def test_nul_characters_are_stripped():
+    async def test(history):
+        history.record_run("a", None, "two-sum", "python", "print(1)\x00", [
+            {"passed": False, "status": "Wrong Answer", "output": "1\x002", "error": None},
+        ], "http")
+        await history.flush()
+        async with async_engine.connect() as conn:
+            assert await conn.scalar(select(Submission.code)) == "print(1)"
+            assert await conn.scalar(select(database.TestResult.output)) == "12"
+    _run(test)
+
+
+def test_rows_stay_buffered_while_the_db_is_down(monkeypatch):
+    async def test(history):
+        history.record_duel(("a", "b"), _duel("d1"), "a")
+
+        class Down:
+            def __call__(self):
+                raise ConnectionRefusedError("db down")
+            connect = __call__
+        monkeypatch.setattr(history_module, "AsyncSessionLocal", Down())
+        monkeypatch.setattr(history_module, "async_engine", Down())
+        for _ in range(MAX_ATTEMPTS + 1):
+            try:
+                await history.flush()
+            except ConnectionRefusedError:
+                pass
+        assert history.buffered == 1
+        monkeypatch.undo()
+
+        await history.flush()
+        assert history.buffered == 0 and await _count(Duel) == 1
+    _run(test)
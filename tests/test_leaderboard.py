@@ -0,0 +1,83 @@
+import asyncio
+import bisect
+import random
+
+import pytest
+
+from app import matchmaker
+from app.leaderboard import Board, Leaderboard, SkipList
+
+#---------------------------------------------------------
+# the skip list against a sorted list, then boards and a Leaderboard fed
+# a few duels
+
+
+def test_skip_list_matches_a_sorted_list():
+    rng = random.Random(1)
+    order, expected = SkipList(), []
+    for step in range(5000):
+        if rng.random() < 0.6 or not expected:
+            key = (-round(rng.uniform(800, 2000), 1), f"u{rng.randint(0, 1000)}")
+            if key in expected:
+                continue
+            order.insert(key)
+            bisect.insort(expected, key)
+        else:
+            key = rng.choice(expected)
+            order.remove(key)
+            expected.remove(key)
+        if step % 250 == 0:
+            assert len(order) == len(expected)
+            for key in rng.sample(expected, min(20, len(expected))):
+                assert order.rank(key) == expected.index(key)
+            start = rng.randint(0, len(expected))
+            assert order.slice(start, 37) == expected[start:start + 37]
+    assert order.slice(0, len(expected)) == expected
+
+
+def test_skip_list_misses():
+    order = SkipList()
+    order.insert((-1200.0, "a"))
+    assert order.rank((-1300.0, "a")) is None
+    assert order.slice(1, 10) == [] and order.slice(0, 0) == []
+    with pytest.raises(KeyError):
+        order.remove((-1300.0, "a"))
+
+
+def test_board_ranks_by_rating_then_name():
+    board = Board()
+    board.set("a", 1200)
+    board.set("b", 1300)
+    board.set("c", 1300)
+    board.set("a", 1400)  # moves, not added twice
+    assert len(board) == 3
+    assert board.page(0, 10) == [(1, "a", 1400), (2, "b", 1300), (3, "c", 1300)]
+    assert board.page(1, 1) == [(2, "b", 1300)]
+    assert board.rank("c") == 3 and board.rank("nobody") is None
+
+
+@pytest.fixture
+def ratings(monkeypatch):
+    monkeypatch.setattr(matchmaker, "ratings", {})
+    return matchmaker.ratings
+
+
+def test_duels_update_stats_and_boards(ratings):
+    async def test():
+        board = Leaderboard()
+        for winner in ("a", "a", None):
+            deltas = await matchmaker.record_result("a", "b", winner)
+            await board.record(("a", "b"), "Easy", winner, deltas)
+
+        a, b = board.stats("a"), board.stats("b")
+        assert (a["wins"], a["draws"], a["played"], a["rank"]) == (2, 1, 3, 1)
+        assert (b["losses"], b["rank"]) == (2, 2)
+        assert (a["streak"], a["best_streak"]) == (0, 2)
+        assert a["rating"] == round(matchmaker.get_rating("a"), 1)
+        assert board.stats("c") is None
+
+        page = board.page("easy", offset=1, limit=1)
+        assert page["total"] == 2
+        assert [(e["rank"], e["username"], e["losses"]) for e in page["entries"]] == [(2, "b", 2)]
+        assert board.page("hard")["entries"] == []
+    asyncio.run(test())
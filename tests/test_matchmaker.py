@@ -0,0 +1,74 @@
+import pytest
+
+from app import matchmaker
+from app.matchmaker import MAX_WINDOW, MatchQueue
+
+#---------------------------------------------------------
+# the in-process bucketed queue, driven with explicit clock values
+
+
+@pytest.fixture(autouse=True)
+def ratings(monkeypatch):
+    monkeypatch.setattr(matchmaker, "ratings", {})
+    return matchmaker.ratings
+
+
+def _players(match):
+    return sorted(match["players"]) if match else None
+
+
+def test_nearest_rating_wins(ratings):
+    ratings.update({"a": 1200, "b": 1350, "c": 1270})
+    queue = MatchQueue()
+    assert queue.enqueue("a", now=0) is None
+    assert queue.enqueue("b", now=0) is None
+    assert _players(queue.enqueue("c", now=0)) == ["a", "c"]
+    assert "b" in queue and len(queue) == 1
+
+
+def test_window_grows_until_the_ticker_pairs_them(ratings):
+    ratings.update({"a": 1200, "b": 1500})
+    queue = MatchQueue()
+    queue.enqueue("a", now=0)
+    queue.enqueue("b", now=0)
+    # 300 apart: fits once a window has grown by 200, four seconds in
+    assert queue.tick(now=3) == []
+    [match] = queue.tick(now=4)
+    assert _players(match) == ["a", "b"]
+    assert len(queue) == 0
+
+
+def test_filters_must_fit_and_the_longer_waiter_picks():
+    queue = MatchQueue()
+    queue.enqueue("easy", "Easy", now=0)
+    assert queue.enqueue("hard", "Hard", now=1) is None
+    match = queue.enqueue("any", None, "Graph", now=2)
+    assert _players(match) == ["any", "easy"]
+    assert match["difficulty"] == "Easy" and match["tag"] == "Graph"
+
+
+def test_incompatible_players_dont_starve_the_bucket():
+    # four mutually incompatible players at the front of the 1200 bucket
+    queue = MatchQueue()
+    for name, difficulty, tag in (("e1", "Easy", "x"), ("m1", "Medium", "x"), ("e2", "Easy", "y"), ("m2", "Medium", "y")):
+        assert queue.enqueue(name, difficulty, tag, now=0) is None
+    assert queue.enqueue("h1", "Hard", now=1) is None
+    assert _players(queue.enqueue("h2", "Hard", now=2)) == ["h1", "h2"]
+
+
+def test_players_at_the_max_window_are_still_rechecked(ratings):
+    ratings.update({"a": 1200})
+    queue = MatchQueue()
+    queue.enqueue("a", now=0)
+    for second in range(1, 60):
+        queue.tick(now=second)
+    assert queue.entries["a"].window(60) == MAX_WINDOW
+    assert any(username == "a" for _, _, username in queue.rechecks)
+
+
+def test_cancel_leaves_no_empty_groups():
+    queue = MatchQueue()
+    queue.enqueue("a", "Easy", now=0)
+    assert queue.cancel("a")
+    assert not queue.cancel("a")
+    assert queue.groups == {} and len(queue) == 0
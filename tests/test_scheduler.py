@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from app.scheduler import TimerWheel
+
+#---------------------------------------------------------
+# the timer wheel with 10 ms ticks and a few slots, so deadlines a couple
+# of laps out come up in a test's time
+
+
+def _run(test, slots=8):
+    async def main():
+        fired = []
+
+        async def callback(key):
+            fired.append(key)
+
+        wheel = TimerWheel(callback, resolution=0.01, slots=slots)
+        wheel.start()
+        try:
+            await test(wheel, fired)
+        finally:
+            await wheel.close()
+    asyncio.run(main())
+
+
+def test_fires_in_deadline_order():
+    async def test(wheel, fired):
+        now = time.time()
+        wheel.schedule("b", now + 0.06)
+        wheel.schedule("a", now + 0.03)
+        wheel.schedule("late", now - 5)  # already due: next tick
+        assert len(wheel) == 3
+        await asyncio.sleep(0.15)
+        assert fired == ["late", "a", "b"]
+        assert len(wheel) == 0
+    _run(test)
+
+
+def test_cancel_and_reschedule():
+    async def test(wheel, fired):
+        now = time.time()
+        wheel.schedule("gone", now + 0.03)
+        wheel.schedule("moved", now + 0.03)
+        assert wheel.cancel("gone") == now + 0.03
+        assert wheel.cancel("gone") is None
+        wheel.schedule("moved", now + 0.12)
+        assert wheel.deadline("moved") == now + 0.12
+
+        await asyncio.sleep(0.08)
+        assert fired == []
+        await asyncio.sleep(0.1)
+        assert fired == ["moved"]
+    _run(test)
+
+
+def test_later_laps_wait_their_turn():
+    # 4 slots of 10 ms: a deadline 100 ms out shares a slot with earlier ticks
+    async def test(wheel, fired):
+        now = time.time()
+        wheel.schedule("far", now + 0.1)
+        wheel.schedule("near", now + 0.02)
+        await asyncio.sleep(0.06)
+        assert fired == ["near"]
+        await asyncio.sleep(0.1)
+        assert fired == ["near", "far"]
+    _run(test, slots=4)
+
+
+def test_failing_callback_keeps_the_wheel_turning():
+    async def test(wheel, fired):
+        async def callback(key):
+            if key == "bad":
+                raise RuntimeError("boom")
+            fired.append(key)
+
+        wheel.callback = callback
+        now = time.time()
+        wheel.schedule("bad", now + 0.02)
+        wheel.schedule("good", now + 0.05)
+        await asyncio.sleep(0.12)
+        assert fired == ["good"]
+    _run(test)
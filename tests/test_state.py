@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+from app import duels, runner, state
+from app.resp_server import serve
+from app.result_cache import cache
+from app.state import InMemoryBackend, RedisBackend
+
+#---------------------------------------------------------
+# the Redis-protocol backend against the stand-in in app/resp_server.py,
+# two backends per test playing two workers
+
+
+async def _standin():
+    server = await serve(port=0)
+    return server, f"redis://127.0.0.1:{server.sockets[0].getsockname()[1]}/0"
+
+
+def _run(test):
+    async def main():
+        server, url = await _standin()
+        workers = [RedisBackend(url), RedisBackend(url)]
+        try:
+            await test(*workers)
+        finally:
+            for worker in workers:
+                await worker.close()
+            server.close()
+    asyncio.run(main())
+
+
+def test_hash_and_pubsub_round_trip():
+    async def test(a, b):
+        await a.hset("h", {"x": 1, "y": "two"})
+        assert await b.hgetall("h") == {"x": "1", "y": "two"}
+        assert await b.hmget("h", ["y", "z"]) == ["two", None]
+
+        received = asyncio.Queue()
+
+        async def handler(channel, message):
+            received.put_nowait((channel, message))
+
+        await b.subscribe("lcduel:test:*", handler)
+        await asyncio.sleep(0.05)
+        assert await a.publish("lcduel:test:1", "hello") == 1
+        assert await asyncio.wait_for(received.get(), 1) == ("lcduel:test:1", "hello")
+    _run(test)
+
+
+def test_zcard_counts_without_reading():
+    async def test(a, b):
+        assert await b.zcard("z") == 0
+        await a.zadd("z", {"p1": 1, "p2": 2})
+        await a.zadd("z", {"p1": 3})
+        assert await b.zcard("z") == 2
+        await b.zrem("z", "p1", "p2")
+        assert await a.zcard("z") == 0
+    _run(test)
+
+
+@pytest.fixture
+def duel_backend(monkeypatch):
+    def use(backend):
+        monkeypatch.setattr(duels, "_backend", backend)
+    return use
+
+
+def test_simultaneous_finish_is_seen(duel_backend):
+    # both players finish at once: at least one caller must see both
+    async def test(a, b):
+        duel_backend(a)
+        key = ("alice", "bob")
+        await duels.create(key, slug="two-sum")
+        seen = await asyncio.gather(duels.mark_finished(key, "alice"), duels.mark_finished(key, "bob"))
+        assert any(duel["finished"] == {"alice", "bob"} for duel in seen)
+    _run(test)
+
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_writes_after_claim_leave_nothing(duel_backend, shared):
+    async def test(a, b):
+        backend = a if shared else InMemoryBackend()
+        duel_backend(backend)
+        key = ("alice", "bob")
+        await duels.create(key, slug="two-sum")
+        assert await duels.claim(key)
+        await duels.set_progress(key, "alice", {"done": 1})
+        await duels.set_code(key, "bob", "print(1)")
+        await duels.set_verdict(key, "alice", {"passed": 1})
+        assert await duels.mark_finished(key, "alice") is None
+        assert await backend.hgetall("lcduel:duel:alice|bob") == {}
+    _run(test)
+
+
+def test_subscriptions_survive_a_dropped_connection():
+    async def test(a, b):
+        received = asyncio.Queue()
+
+        async def handler(channel, message):
+            received.put_nowait(message)
+
+        await b.subscribe("lcduel:one", handler)
+        await b.subscribe("lcduel:two", handler)
+        await asyncio.sleep(0.05)
+        b.sub_writer.transport.abort()
+
+        # every channel comes back once the loop has reconnected
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if await a.publish("lcduel:one", "1") and await a.publish("lcduel:two", "2"):
+                break
+        messages = {await asyncio.wait_for(received.get(), 1) for _ in range(2)}
+        assert messages == {"1", "2"}
+    _run(test)
+
+
+def test_announced_problem_changes_reach_other_workers(monkeypatch):
+    # b is the ingest process, a the server worker holding the copies
+    async def test(a, b):
+        monkeypatch.setattr(state, "backend", a)
+        await runner.start()
+        case = {"input": "1", "expected_output": "1"}
+        monkeypatch.setitem(runner._testcases, "two-sum", [case])
+        cache.put("two-sum", "src", case, {"status": "Accepted", "passed": True})
+        await asyncio.sleep(0.05)
+
+        monkeypatch.setattr(state, "backend", b)
+        await runner.announce_changes(["two-sum"])
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if "two-sum" not in runner._testcases:
+                break
+        assert "two-sum" not in runner._testcases
+        assert cache.get("two-sum", "src", case) is None
+    _run(test)